@@ -1,4 +1,5 @@
 from .chatmanager import *
 from .workflowmanager import *
+from .executor import *
 from .datamodel import *
 from .version import __version__
@@ -1,33 +1,163 @@
+import asyncio
+import functools
 import json
+import logging
+import contextlib
 import time
-from typing import List
+from typing import ContextManager, List, Optional
 from .datamodel import AgentWorkFlowConfig, Message
-from .utils import extract_successful_code_blocks, get_default_agent_config, get_modified_files
-from .workflowmanager import AutoGenWorkFlowManager
+from .utils import (
+    extract_successful_code_blocks,
+    get_default_agent_config,
+    get_modified_files,
+    md5_hash,
+    snapshot_folder,
+)
+from .utils.httpclients import HTTPClientPool
+from .utils.llmcache import CompletionCache
+from .utils.profiling import TurnProfiler
+from .utils.summarizer import Summarizer, history_transcript
+from .groupchat import SpeakerSelectionCache
+from .workflowmanager import TemplateCache, WorkflowCache, create_workflow_manager
 import os
 
+logger = logging.getLogger()
+
+
+def span(profiler: Optional[TurnProfiler], name: str) -> ContextManager[None]:
+    """
+    Time a phase of a turn with the profiler of the turn, if the turn is profiled.
+    """
+    return profiler.span(name) if profiler is not None else contextlib.nullcontext()
+
 
 class AutoGenChatManager:
-    def __init__(self) -> None:
-        pass
+    def __init__(
+        self,
+        workflow_cache: Optional[WorkflowCache] = None,
+        persist_workspace: bool = False,
+        completion_cache: Optional[CompletionCache] = None,
+        template_cache: Optional[TemplateCache] = None,
+        http_clients: Optional[HTTPClientPool] = None,
+        selection_cache: Optional[SpeakerSelectionCache] = None,
+        summarizer: Optional[Summarizer] = None,
+        profiles_dir: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            workflow_cache: An optional cache of live workflows, reused across the turns of a session.
+            persist_workspace: If True, each session runs in its own scratch folder that is kept across turns,
+                instead of a per-user scratch folder that is cleared on every message.
+            completion_cache: An optional completion cache for workflows that enable response_cache.
+            template_cache: An optional cache of compiled agent templates, shared by all sessions.
+            http_clients: An optional pool of HTTP clients shared by the LLM clients of all agents.
+            selection_cache: An optional cache of group chat speaker selection decisions, shared by all sessions.
+            summarizer: The summarizer of workflows with summary_method "llm". Without one, these workflows
+                return the last agent message.
+            profiles_dir: The folder captured turn profiles are saved to, in a subfolder per user. It must not be
+                publicly served, profiles are read with profile_file. Profiles are not saved if None.
+        """
+        self.workflow_cache = workflow_cache
+        self.persist_workspace = persist_workspace
+        self.completion_cache = completion_cache
+        self.template_cache = template_cache
+        self.http_clients = http_clients
+        self.selection_cache = selection_cache
+        self.summarizer = summarizer
+        self.profiles_dir = profiles_dir
 
-    def chat(self, message: Message, history: List, flow_config: AgentWorkFlowConfig = None, **kwargs) -> None:
+    def prepare_turn(
+        self,
+        message: Message,
+        history: List,
+        flow_config: AgentWorkFlowConfig = None,
+        profiler: Optional[TurnProfiler] = None,
+        **kwargs,
+    ) -> dict:
+        """
+        Resolve the scratch folder and the flow for a turn, reusing a cached flow if there is one.
+
+        Returns:
+            A dict with the turn state, passed on to finish_turn.
+        """
         work_dir = kwargs.get("work_dir", None)
         scratch_dir = os.path.join(work_dir, "scratch")
+        persist_workspace = self.persist_workspace and message.session_id is not None
+        if persist_workspace:
+            scratch_dir = os.path.join(scratch_dir, md5_hash(message.session_id))
+            os.makedirs(scratch_dir, exist_ok=True)
+            # mark the workspace as used, see cleanup_workspaces
+            os.utime(scratch_dir)
 
         # if no flow config is provided, use the default
         if flow_config is None:
             flow_config = get_default_agent_config(scratch_dir)
 
-        flow = AutoGenWorkFlowManager(config=flow_config, history=history, work_dir=scratch_dir)
-        message_text = message.content.strip()
+        flow = None
+        config_hash = None
+        use_cache = self.workflow_cache is not None and message.session_id is not None
+        if use_cache:
+            with span(profiler, "checkout_workflow"):
+                config_hash = WorkflowCache.config_hash(flow_config)
+                flow = self.workflow_cache.checkout(message.session_id, config_hash, history)
+            if flow is not None:
+                # start from the same workspace and agent messages as a new flow would
+                if not persist_workspace:
+                    flow.reset_workspace()
+                flow.profiler = profiler
+                flow.reset_history(history, kwargs.get("history_policy", None))
+        if flow is None:
+            with span(profiler, "create_workflow"):
+                flow = create_workflow_manager(
+                    flow_config,
+                    history=history,
+                    work_dir=scratch_dir,
+                    clear_work_dir=not persist_workspace,
+                    history_policy=kwargs.get("history_policy", None),
+                    completion_cache=self.completion_cache,
+                    template_cache=self.template_cache,
+                    http_clients=self.http_clients,
+                    selection_cache=self.selection_cache,
+                    profiler=profiler,
+                    user_id=message.user_id,
+                )
+        flow.profiler = profiler
+        flow.agent_history = []
+        flow.usage.reset()
+        flow.on_message = kwargs.get("on_message", None)
+        flow.on_delta = kwargs.get("on_delta", None)
 
-        output = ""
-        start_time = time.time()
+        return {
+            "flow": flow,
+            "flow_config": flow_config,
+            "config_hash": config_hash,
+            "use_cache": use_cache,
+            "work_dir": work_dir,
+            "scratch_dir": scratch_dir,
+            "history_length": len(history or []),
+            "start_time": time.time(),
+            "snapshot": snapshot_folder(scratch_dir),
+            "on_delta": kwargs.get("on_delta", None),
+            "profiler": profiler,
+        }
 
-        metadata = {}
-        flow.run(message=f"{message_text}", clear_history=False)
+    def finish_turn(self, message: Message, turn: dict) -> Message:
+        """
+        Build the assistant response of a turn and return the flow to the workflow cache.
+
+        Args:
+            message: The user message the turn ran on.
+            turn: The turn state returned by prepare_turn.
 
+        Returns:
+            The assistant response message.
+        """
+        flow = turn["flow"]
+        flow_config = turn["flow_config"]
+        start_time = turn["start_time"]
+        profiler = turn.get("profiler", None)
+
+        metadata = {}
         metadata["messages"] = flow.agent_history
 
         output = ""
@@ -38,16 +168,27 @@ class AutoGenChatManager:
             successful_code_blocks = "\n\n".join(successful_code_blocks)
             output = (last_message + "\n" + successful_code_blocks) if successful_code_blocks else last_message
         elif flow_config.summary_method == "llm":
-            output = ""
+            with span(profiler, "summarize"):
+                output = self.summarize_turn(flow, turn.get("on_delta", None))
         elif flow_config.summary_method == "none":
             output = ""
 
         metadata["code"] = ""
         metadata["summary_method"] = flow_config.summary_method
+        if flow_config.type == "parallel":
+            # name, status, run time and result of each branch
+            metadata["branches"] = flow.branch_results
         end_time = time.time()
         metadata["time"] = end_time - start_time
-        modified_files = get_modified_files(start_time, end_time, scratch_dir, dest_dir=work_dir)
+        # tokens, LLM latency, code execution time and cache hits of the turn, per message in metadata["messages"]
+        metadata["usage"] = flow.usage.total()
+        with span(profiler, "get_modified_files"):
+            modified_files = get_modified_files(
+                start_time, end_time, turn["scratch_dir"], dest_dir=turn["work_dir"], snapshot=turn["snapshot"]
+            )
         metadata["files"] = modified_files
+        if profiler is not None:
+            metadata["profile"] = self.profile_report(message, turn)
 
         print("Modified files: ", len(modified_files))
 
@@ -60,4 +201,113 @@ class AutoGenChatManager:
             session_id=message.session_id,
         )
 
+        if turn["use_cache"]:
+            # the agents now also hold this turn: the user message and the assistant response
+            flow.history_marker = (turn["history_length"] + 2, output_message.msg_id)
+            flow.on_message = None
+            flow.on_delta = None
+            flow.profiler = None
+            self.workflow_cache.checkin(message.session_id, turn["config_hash"], flow)
+
         return output_message
+
+    def profile_report(self, message: Message, turn: dict) -> dict:
+        """
+        Build the profile of a turn: its spans, the LLM and code execution time of the conversation and, if one
+        was captured, the name of the profile saved to the profiles folder of the user.
+        """
+        profiler = turn["profiler"]
+        usage = turn["flow"].usage.total()
+        file_name = None
+        if self.profiles_dir is not None:
+            try:
+                file_name = profiler.save(self.user_profiles_dir(message.user_id), message.msg_id)
+            except Exception as e:
+                logger.error("Error saving the profile of message %s: %s", message.msg_id, e)
+        else:
+            profiler.stop_capture()
+        report = profiler.report()
+        report["llm_latency"] = usage["llm_latency"]
+        report["code_execution_time"] = usage["code_execution_time"]
+        if file_name is not None:
+            report["file"] = {"path": f"api/messages/{message.msg_id}/profile", "name": file_name}
+        return report
+
+    def user_profiles_dir(self, user_id: str) -> str:
+        """
+        Return the folder the profiles of a user are saved to.
+        """
+        return os.path.join(self.profiles_dir, md5_hash(user_id))
+
+    def profile_file(self, user_id: str, msg_id: str) -> Optional[str]:
+        """
+        Return the path of the saved profile of a message of a user, or None if there is none.
+        """
+        if self.profiles_dir is None or not msg_id or os.path.basename(msg_id) != msg_id or msg_id.startswith("."):
+            return None
+        for extension in (".prof", ".html"):
+            path = os.path.join(self.user_profiles_dir(user_id), msg_id + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def summarize_turn(self, flow, on_delta=None) -> str:
+        """
+        Summarize the agent messages of a turn with the summarizer, on the summarizer's own model or else the
+        model of the workflow receiver. Falls back to the last agent message if the summary cannot be made.
+        """
+        last_message = flow.agent_history[-1]["message"]["content"] if flow.agent_history else ""
+        if self.summarizer is None:
+            return last_message
+        llm_config = flow.template.receiver.config.get("llm_config") or {}
+        try:
+            return self.summarizer.summarize(
+                history_transcript(flow.agent_history),
+                config_list=llm_config.get("config_list"),
+                on_delta=on_delta,
+            )
+        except Exception as e:
+            logger.error("Error summarizing turn, returning the last message: %s", e)
+            return last_message
+
+    def chat(self, message: Message, history: List, flow_config: AgentWorkFlowConfig = None, **kwargs) -> Message:
+        """
+        Run a turn of a chat. If kwargs["profile"] is one of PROFILE_MODES, the phases of the turn are timed and,
+        for the cprofile and pyinstrument modes, profiled; the result is stored in metadata["profile"].
+        """
+        profiler = TurnProfiler(kwargs["profile"]) if kwargs.get("profile") else None
+        if profiler is not None:
+            profiler.start_capture()
+        try:
+            turn = self.prepare_turn(message, history, flow_config, profiler=profiler, **kwargs)
+            message_text = message.content.strip()
+            with span(profiler, "run"):
+                turn["flow"].run(message=f"{message_text}", clear_history=False)
+            return self.finish_turn(message, turn)
+        finally:
+            if profiler is not None:
+                profiler.stop_capture()
+
+    async def achat(
+        self, message: Message, history: List, flow_config: AgentWorkFlowConfig = None, **kwargs
+    ) -> Message:
+        """
+        Asynchronous variant of chat. The conversation runs on the event loop with AutoGenWorkFlowManager.arun,
+        while the blocking workspace setup and file collection run on the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        profiler = TurnProfiler(kwargs["profile"]) if kwargs.get("profile") else None
+        turn = await loop.run_in_executor(
+            None, functools.partial(self.prepare_turn, message, history, flow_config, profiler=profiler, **kwargs)
+        )
+        message_text = message.content.strip()
+        # only the conversation is profiled, it is the part that runs on the event loop thread
+        if profiler is not None:
+            profiler.start_capture()
+        try:
+            with span(profiler, "run"):
+                await turn["flow"].arun(message=f"{message_text}", clear_history=False)
+        finally:
+            if profiler is not None:
+                profiler.stop_capture()
+        return await loop.run_in_executor(None, self.finish_turn, message, turn)
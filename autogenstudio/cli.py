@@ -1,4 +1,5 @@
 import os
+import secrets
 from typing_extensions import Annotated
 import typer
 import uvicorn
@@ -17,6 +18,10 @@ def ui(
     reload: Annotated[bool, typer.Option("--reload")] = False,
     docs: bool = False,
     appdir: str = None,
+    chat_workers: int = 4,
+    chat_queue_size: int = 32,
+    chat_user_limit: int = 2,
+    async_runtime: Annotated[bool, typer.Option("--async-runtime")] = False,
 ):
     """
     Run the AutoGen Studio UI.
@@ -28,11 +33,24 @@ def ui(
         reload (bool, optional): Whether to reload the UI on code changes. Defaults to False.
         docs (bool, optional): Whether to generate API docs. Defaults to False.
         appdir (str, optional): Path to the AutoGen Studio app directory. Defaults to None.
+        chat_workers (int, optional): Number of chat runs executed concurrently per worker. Defaults to 4.
+        chat_queue_size (int, optional): Number of chat runs that may wait for a free chat worker. Defaults to 32.
+        chat_user_limit (int, optional): Number of in-flight chat runs allowed per user. Defaults to 2.
+        async_runtime (bool, optional): Whether to run chats on the event loop instead of chat workers. Defaults to False.
     """
 
     os.environ["AUTOGENSTUDIO_API_DOCS"] = str(docs)
     if appdir:
         os.environ["AUTOGENSTUDIO_APPDIR"] = appdir
+    os.environ["AUTOGENSTUDIO_CHAT_WORKERS"] = str(chat_workers)
+    os.environ["AUTOGENSTUDIO_CHAT_QUEUE_SIZE"] = str(chat_queue_size)
+    os.environ["AUTOGENSTUDIO_CHAT_USER_LIMIT"] = str(chat_user_limit)
+    os.environ["AUTOGENSTUDIO_ASYNC_RUNTIME"] = str(async_runtime).lower()
+    # skills run by the agents (e.g. the Audio2Face audio skills) report their metrics to this server
+    metrics_host = "127.0.0.1" if host in ("0.0.0.0", "::") else host
+    os.environ.setdefault("AUTOGENSTUDIO_METRICS_URL", f"http://{metrics_host}:{port}/api/metrics")
+    # the skills authenticate their reports with this token, shared with the workers through the environment
+    os.environ.setdefault("AUTOGENSTUDIO_METRICS_TOKEN", secrets.token_urlsafe(32))
     set_env_variables()
 
     if 'NVIDIA_API_KEY' not in os.environ or os.environ['NVIDIA_API_KEY'] == "":
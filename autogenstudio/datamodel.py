@@ -93,6 +93,7 @@ class LLMConfig:
     cache_seed: Optional[Union[int, None]] = None
     timeout: Optional[int] = None
     max_tokens: Optional[int] = None
+    stream: Optional[bool] = False
 
     def dict(self):
         result = asdict(self)
@@ -154,9 +155,15 @@ class GroupChatConfig:
     messages: List[Dict] = field(default_factory=list)
     max_round: Optional[int] = 10
     admin_name: Optional[str] = "Admin"
+    # auto, round_robin, random, manual or keyword (see StudioGroupChat)
     speaker_selection_method: Optional[str] = "auto"
-    # TODO: match the new group chat default and support transition spec
     allow_repeat_speaker: Optional[Union[bool, List[AgentConfig]]] = True
+    # names of the agents each agent may hand over to, agents without an entry may hand over to any agent
+    speaker_transitions: Optional[Dict[str, List[str]]] = None
+    # keywords that route the conversation to an agent, by agent name
+    speaker_keywords: Optional[Dict[str, List[str]]] = None
+    # reuse the speakers picked by the LLM for the same last speaker and message
+    cache_speaker_selection: Optional[bool] = True
 
     def dict(self):
         result = asdict(self)
@@ -192,6 +199,40 @@ class GroupChatFlowSpec:
         return result
 
 
+def init_flow_spec(spec: Any) -> Union[AgentFlowSpec, GroupChatFlowSpec]:
+    """initialize an agent or group chat spec from a dict or spec"""
+    if not isinstance(spec, dict):
+        spec = spec.dict()
+    if spec["type"] == "groupchat":
+        return GroupChatFlowSpec(**spec)
+    else:
+        return AgentFlowSpec(**spec)
+
+
+@dataclass
+class ParallelConfig:
+    """Data model for the branches of a parallel workflow"""
+
+    # agents or group chats the task is sent to concurrently, each in its own chat with a copy of the sender
+    branches: List[Union[AgentFlowSpec, GroupChatFlowSpec]] = field(default_factory=list)
+    # all: wait for every branch, first: for the first completed branch, quorum: for `quorum` completed branches
+    join: Literal["all", "first", "quorum"] = "all"
+    # number of completed branches the quorum join waits for, a majority of the branches if None
+    quorum: Optional[int] = None
+    # seconds to wait for the branches before joining with the results available
+    timeout: Optional[float] = None
+    # if True the receiver combines the branch results, otherwise they are returned as they are
+    aggregate: Optional[bool] = True
+
+    def __post_init__(self):
+        self.branches = [init_flow_spec(branch) for branch in self.branches]
+
+    def dict(self):
+        result = asdict(self)
+        result["branches"] = [branch.dict() for branch in self.branches]
+        return result
+
+
 @dataclass
 class AgentWorkFlowConfig:
     """Data model for Flow Config for AutoGen"""
@@ -200,27 +241,28 @@ class AgentWorkFlowConfig:
     description: str
     sender: AgentFlowSpec
     receiver: Union[AgentFlowSpec, GroupChatFlowSpec]
-    type: Literal["twoagents", "groupchat"] = "twoagents"
+    type: Literal["twoagents", "groupchat", "parallel"] = "twoagents"
     id: Optional[str] = None
     user_id: Optional[str] = None
     timestamp: Optional[str] = None
     # how the agent message summary is generated. last: only last message is used, none: no summary,  llm: use llm to generate summary
     summary_method: Optional[Literal["last", "none", "llm"]] = "last"
+    # serve identical LLM requests of this workflow from the studio completion cache
+    response_cache: Optional[bool] = False
+    # branches of a parallel workflow, the receiver aggregates their results
+    parallel_config: Optional[ParallelConfig] = None
 
     def init_spec(self, spec: Dict):
         """initialize the agent spec"""
-        if not isinstance(spec, dict):
-            spec = spec.dict()
-        if spec["type"] == "groupchat":
-            return GroupChatFlowSpec(**spec)
-        else:
-            return AgentFlowSpec(**spec)
+        return init_flow_spec(spec)
 
     def __post_init__(self):
         if self.id is None:
             self.id = str(uuid.uuid4())
         self.sender = self.init_spec(self.sender)
         self.receiver = self.init_spec(self.receiver)
+        if self.parallel_config is not None and not isinstance(self.parallel_config, ParallelConfig):
+            self.parallel_config = ParallelConfig(**self.parallel_config)
         if self.user_id is None:
             self.user_id = "default"
         if self.timestamp is None:
@@ -230,6 +272,7 @@ class AgentWorkFlowConfig:
         result = asdict(self)
         result["sender"] = self.sender.dict()
         result["receiver"] = self.receiver.dict()
+        result["parallel_config"] = self.parallel_config.dict() if self.parallel_config else None
         return result
 
 
@@ -277,12 +320,32 @@ class Gallery(object):
         return result
 
 
+@dataclass
+class HistoryPolicy(object):
+    """Data model for the context window policy used when loading session history into agents"""
+
+    # all: replay every message, last_n: keep the last max_messages messages, token_budget: keep the most
+    # recent messages that fit in max_tokens
+    type: Literal["all", "last_n", "token_budget"] = "all"
+    max_messages: Optional[int] = None
+    max_tokens: Optional[int] = None
+    # prepend a short digest of the dropped messages
+    summarize_prefix: bool = False
+
+    def dict(self):
+        result = asdict(self)
+        return result
+
+
 @dataclass
 class ChatWebRequestModel(object):
     """Data model for Chat Web Request for Web End"""
 
     message: Message
     flow_config: AgentWorkFlowConfig
+    history_policy: Optional[HistoryPolicy] = None
+    # profile the turn: span timers only, or span timers and a cProfile or pyinstrument profile
+    profile: Optional[Literal["spans", "cprofile", "pyinstrument"]] = None
 
 
 @dataclass
@@ -302,3 +365,28 @@ class DBWebRequestModel(object):
     agent: Optional[AgentFlowSpec] = None
     workflow: Optional[AgentWorkFlowConfig] = None
     model: Optional[Model] = None
+
+
+@dataclass
+class CatalogImportWebRequestModel(object):
+    """Data model for importing many catalog items at once, all items are saved for user_id"""
+
+    user_id: str
+    models: Optional[List[Model]] = None
+    skills: Optional[List[Skill]] = None
+    agents: Optional[List[AgentFlowSpec]] = None
+    workflows: Optional[List[AgentWorkFlowConfig]] = None
+
+
+@dataclass
+class AudioPushMetricWebRequestModel(object):
+    """Data model for the duration of an Audio2Face audio push, reported by the audio skills"""
+
+    # track: PushAudio with the whole track, stream: PushAudioStream with audio chunks
+    mode: Literal["track", "stream"]
+    seconds: float
+    success: bool = True
+
+    def __post_init__(self):
+        if self.seconds < 0:
+            raise ValueError("seconds must not be negative")
@@ -0,0 +1,212 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict
+
+
+class ChatQueueFullError(Exception):
+    """
+    Raised when a chat run cannot be admitted because the executor queue or the user's concurrency limit is full.
+    """
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ChatExecutor:
+    """
+    Runs chat requests on a bounded worker pool so that long agent conversations do not block the event loop.
+    Admission is limited by the total number of in-flight runs (running + queued) and by the number of in-flight
+    runs per user. Rejected runs raise ChatQueueFullError with a retry hint in seconds.
+    """
+
+    def __init__(
+        self, max_workers: int = 4, max_queue_size: int = 32, max_per_user: int = 2, max_async_runs: int = 256
+    ) -> None:
+        """
+        Initializes the executor and its worker pool.
+
+        Args:
+            max_workers: The number of chat runs that may execute concurrently.
+            max_queue_size: The number of admitted runs that may wait for a free worker.
+            max_per_user: The number of in-flight runs (running + queued) allowed per user.
+            max_async_runs: The number of chat runs that may execute concurrently on the event loop.
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self.max_per_user = max(1, max_per_user)
+        self.max_async_runs = max(1, max_async_runs)
+        self._async_running = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="autogenstudio-chat")
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._per_user: Dict[str, int] = {}
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_run_time = 0.0
+
+    def _estimate_retry_after(self) -> int:
+        """
+        Estimate how many seconds a rejected caller should wait before retrying, based on the average run time.
+        Must be called with the lock held.
+        """
+        finished = self._completed + self._failed
+        average_run_time = self._total_run_time / finished if finished else 5.0
+        waves = math.ceil((self._queued + 1) / self.max_workers)
+        return max(1, math.ceil(average_run_time * waves))
+
+    def _admit(self, user_id: str, run_async: bool = False) -> None:
+        with self._lock:
+            if self._per_user.get(user_id, 0) >= self.max_per_user:
+                self._rejected += 1
+                raise ChatQueueFullError(
+                    f"Too many concurrent chats for this user (limit {self.max_per_user})",
+                    retry_after=self._estimate_retry_after(),
+                )
+            if run_async:
+                if self._async_running >= self.max_async_runs:
+                    self._rejected += 1
+                    raise ChatQueueFullError(
+                        "Too many concurrent chats, please retry later",
+                        retry_after=self._estimate_retry_after(),
+                    )
+                self._async_running += 1
+            else:
+                if self._running + self._queued >= self.max_workers + self.max_queue_size:
+                    self._rejected += 1
+                    raise ChatQueueFullError(
+                        "Chat queue is full, please retry later",
+                        retry_after=self._estimate_retry_after(),
+                    )
+                self._queued += 1
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+
+    def _release(self, user_id: str) -> None:
+        with self._lock:
+            remaining = self._per_user.get(user_id, 1) - 1
+            if remaining > 0:
+                self._per_user[user_id] = remaining
+            else:
+                self._per_user.pop(user_id, None)
+
+    def submit(self, user_id: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Admit a chat run and schedule it on the worker pool.
+
+        Args:
+            user_id: The id of the user the run belongs to, used for per-user limits.
+            fn: The (blocking) function to run, e.g. AutoGenChatManager.chat.
+
+        Returns:
+            A concurrent.futures.Future with the result of fn.
+
+        Raises:
+            ChatQueueFullError: If the queue or the user's concurrency limit is full.
+        """
+        self._admit(user_id)
+
+        def run() -> Any:
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+            start_time = time.time()
+            failed = False
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._total_run_time += time.time() - start_time
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+                self._release(user_id)
+
+        try:
+            return self._pool.submit(run)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            self._release(user_id)
+            raise
+
+    def submit_async(
+        self, user_id: str, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any
+    ) -> "asyncio.Task[Any]":
+        """
+        Admit a chat run and schedule it as a task on the running event loop instead of the worker pool. Async
+        runs share the per-user limit with pool runs and are bounded by max_async_runs.
+
+        Args:
+            user_id: The id of the user the run belongs to, used for per-user limits.
+            fn: The coroutine function to run, e.g. AutoGenChatManager.achat.
+
+        Returns:
+            An asyncio.Task with the result of fn.
+
+        Raises:
+            ChatQueueFullError: If the async run limit or the user's concurrency limit is full.
+        """
+        self._admit(user_id, run_async=True)
+
+        async def run() -> Any:
+            start_time = time.time()
+            failed = False
+            try:
+                return await fn(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._async_running -= 1
+                    self._total_run_time += time.time() - start_time
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+                self._release(user_id)
+
+        try:
+            return asyncio.get_running_loop().create_task(run())
+        except Exception:
+            with self._lock:
+                self._async_running -= 1
+            self._release(user_id)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the executor state and queue-depth metrics.
+        """
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "max_per_user": self.max_per_user,
+                "max_async_runs": self.max_async_runs,
+                "running": self._running,
+                "queued": self._queued,
+                "async_running": self._async_running,
+                "active_users": len(self._per_user),
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "average_run_time": self._total_run_time / finished if finished else 0.0,
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        """
+        Shut down the worker pool.
+        """
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,260 @@
+import dataclasses
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import autogen
+from .utils import md5_hash
+
+try:
+    # transition graphs are enforced by autogen itself from pyautogen 0.2.8 on
+    SUPPORTS_TRANSITION_GRAPH = "allowed_or_disallowed_speaker_transitions" in {
+        f.name for f in dataclasses.fields(autogen.GroupChat)
+    }
+except TypeError:
+    SUPPORTS_TRANSITION_GRAPH = False
+
+
+class SpeakerSelectionCache:
+    """
+    LRU cache of the speakers picked by the LLM ("auto" selection), shared by all group chats. Decisions are keyed
+    by the group chat agents and speaker rules, the selector model, the last speaker, the eligible candidates and
+    the sender and content of the last message, see StudioGroupChat.selection_key.
+    """
+
+    def __init__(self, max_size: int = 4096) -> None:
+        """
+        Args:
+            max_size: The maximum number of decisions to keep.
+        """
+        self.max_size = max_size
+        self._decisions: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the name of the speaker selected for a key, or None on a miss.
+        """
+        with self._lock:
+            name = self._decisions.get(key)
+            if name is None:
+                self.misses += 1
+                return None
+            self._decisions.move_to_end(key)
+            self.hits += 1
+            return name
+
+    def set(self, key: str, name: str) -> None:
+        """
+        Store a selection decision.
+        """
+        with self._lock:
+            self._decisions[key] = name
+            self._decisions.move_to_end(key)
+            while len(self._decisions) > self.max_size:
+                self._decisions.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache size and hit/miss counters.
+        """
+        with self._lock:
+            return {"size": len(self._decisions), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class StudioGroupChat(autogen.GroupChat):
+    """
+    GroupChat that picks the next speaker without an LLM call whenever a cheap rule can decide, in order:
+
+    1. speaker_transitions: if the last speaker may only hand over to one agent, that agent speaks.
+    2. speaker_keywords: if the last message matches the keywords of one eligible agent better than any other,
+       that agent speaks. With the "keyword" selection method agent names count as keywords too, and turns no
+       rule decides go round robin, so the chat makes no selection calls at all.
+    3. the selection cache: an "auto" decision made before for the same situation is reused.
+
+    Otherwise the configured speaker_selection_method of autogen is used, restricted to the allowed transitions.
+    """
+
+    def __init__(
+        self,
+        speaker_transitions: Optional[Dict[str, List[str]]] = None,
+        speaker_keywords: Optional[Dict[str, List[str]]] = None,
+        cache_speaker_selection: Optional[bool] = True,
+        selection_cache: Optional[SpeakerSelectionCache] = None,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Args:
+            speaker_transitions: The agents each agent may hand over to, by name. Agents without an entry may hand
+                over to any agent.
+            speaker_keywords: Keywords that route the conversation to an agent, by agent name.
+            cache_speaker_selection: If True, reuse "auto" selection decisions from the selection cache.
+            selection_cache: The cache of selection decisions, shared across group chats.
+            **kwargs: The arguments of autogen.GroupChat.
+        """
+        self.speaker_transitions = speaker_transitions or {}
+        self.speaker_keywords = {
+            name: [keyword.lower() for keyword in keywords] for name, keywords in (speaker_keywords or {}).items()
+        }
+        self.selection_cache = selection_cache if cache_speaker_selection else None
+        self.repeat_speaker = kwargs.get("allow_repeat_speaker", True)
+        # "keyword" is a studio method, autogen only sees its round robin fallback
+        self.keyword_routing = kwargs.get("speaker_selection_method") == "keyword"
+        if self.keyword_routing:
+            kwargs["speaker_selection_method"] = "round_robin"
+        if self.speaker_transitions and SUPPORTS_TRANSITION_GRAPH:
+            # autogen does not accept both, repeats are encoded in the graph instead
+            kwargs["allowed_or_disallowed_speaker_transitions"] = {
+                agent: self.eligible_speakers(agent, kwargs["agents"]) for agent in kwargs["agents"]
+            }
+            kwargs["speaker_transitions_type"] = "allowed"
+            kwargs["allow_repeat_speaker"] = None
+        super().__init__(**kwargs)
+        # the group chat part of the selection cache key: the agents, their transitions and repeat rules
+        self.selection_scope = md5_hash(
+            json.dumps(
+                [
+                    [
+                        [agent.name, getattr(agent, "description", ""), getattr(agent, "system_message", "")]
+                        for agent in self.agents
+                    ],
+                    {name: sorted(names) for name, names in self.speaker_transitions.items()},
+                    [agent.name for agent in self.agents if self.may_repeat(agent)],
+                ],
+                default=str,
+            )
+        )
+
+    def may_repeat(self, agent: autogen.Agent) -> bool:
+        """
+        Return True if an agent may speak twice in a row.
+        """
+        if isinstance(self.repeat_speaker, list):
+            names = [item["name"] if isinstance(item, dict) else item.name for item in self.repeat_speaker]
+            return agent.name in names
+        return self.repeat_speaker is not False
+
+    def eligible_speakers(self, last_speaker: autogen.Agent, agents: List[autogen.Agent]) -> List[autogen.Agent]:
+        """
+        Return the agents that may speak after last_speaker, according to the transitions and repeat rules.
+        """
+        if last_speaker.name in self.speaker_transitions:
+            names = set(self.speaker_transitions[last_speaker.name])
+            agents = [agent for agent in agents if agent.name in names]
+        if not self.may_repeat(last_speaker):
+            agents = [agent for agent in agents if agent is not last_speaker]
+        return agents
+
+    def route_by_keywords(self, content: str, candidates: List[autogen.Agent]) -> Optional[autogen.Agent]:
+        """
+        Score the candidates by keyword matches in a message and return the best match, if there is a single one.
+        """
+        text = content.lower()
+        scores = {}
+        for agent in candidates:
+            keywords = list(self.speaker_keywords.get(agent.name, []))
+            if self.keyword_routing:
+                keywords.append(agent.name.lower())
+            score = sum(len(re.findall(r"\b" + re.escape(keyword) + r"\b", text)) for keyword in keywords)
+            if score:
+                scores[agent.name] = (score, agent)
+        if not scores:
+            return None
+        best = max(score for score, _ in scores.values())
+        winners = [agent for score, agent in scores.values() if score == best]
+        return winners[0] if len(winners) == 1 else None
+
+    def next_in_order(self, last_speaker: autogen.Agent, candidates: List[autogen.Agent]) -> autogen.Agent:
+        """
+        Return the first candidate after last_speaker in the group chat order.
+        """
+        offset = self.agents.index(last_speaker) + 1 if last_speaker in self.agents else 0
+        ordered = self.agents[offset:] + self.agents[:offset]
+        return next(agent for agent in ordered if agent in candidates)
+
+    def selection_key(
+        self,
+        last_speaker: autogen.Agent,
+        candidates: List[autogen.Agent],
+        content: str,
+        selector: Optional[autogen.ConversableAgent] = None,
+    ) -> str:
+        """
+        Return the selection cache key of an "auto" selection among candidates after last_speaker.
+        """
+        llm_config = getattr(selector, "llm_config", None)
+        models = [config.get("model") for config in llm_config.get("config_list", [])] if llm_config else []
+        sender = self.messages[-1].get("name") if self.messages else None
+        return md5_hash(
+            json.dumps(
+                [
+                    self.selection_scope,
+                    models,
+                    last_speaker.name,
+                    sender,
+                    sorted(agent.name for agent in candidates),
+                    content,
+                ]
+            )
+        )
+
+    def select_by_rules(
+        self, last_speaker: autogen.Agent, selector: Optional[autogen.ConversableAgent] = None
+    ) -> Tuple[Optional[autogen.Agent], Optional[str]]:
+        """
+        Select the next speaker without calling the LLM, if a rule or a cached decision applies.
+
+        Returns:
+            A tuple of the selected agent (or None) and the cache key under which to store the decision made by
+            autogen instead (or None).
+        """
+        candidates = self.eligible_speakers(last_speaker, self.agents)
+        if not candidates:
+            return None, None
+        if len(candidates) == 1:
+            return candidates[0], None
+
+        content = self.messages[-1].get("content") if self.messages else None
+        content = content if isinstance(content, str) else json.dumps(content, default=str)
+        if self.speaker_keywords or self.keyword_routing:
+            agent = self.route_by_keywords(content, candidates)
+            if agent is not None:
+                return agent, None
+        if self.keyword_routing:
+            return self.next_in_order(last_speaker, candidates), None
+
+        if self.selection_cache is None or self.speaker_selection_method.lower() != "auto":
+            return None, None
+        key = self.selection_key(last_speaker, candidates, content, selector)
+        name = self.selection_cache.get(key)
+        # a cached speaker is only used if the current transitions still allow it after last_speaker
+        agent = next((agent for agent in candidates if agent.name == name), None)
+        return agent, None if agent is not None else key
+
+    def finish_selection(self, last_speaker: autogen.Agent, agent: autogen.Agent, key: Optional[str]) -> autogen.Agent:
+        """
+        Check the speaker selected by autogen against the transitions and cache the decision.
+        """
+        candidates = self.eligible_speakers(last_speaker, self.agents)
+        if candidates and agent not in candidates:
+            # older autogen versions cannot restrict the selection to the transition graph, the fallback is not
+            # an LLM decision and is not cached
+            agent = self.next_in_order(last_speaker, candidates)
+        elif key is not None:
+            self.selection_cache.set(key, agent.name)
+        return agent
+
+    def select_speaker(self, last_speaker: autogen.Agent, selector: autogen.ConversableAgent) -> autogen.Agent:
+        agent, key = self.select_by_rules(last_speaker, selector)
+        if agent is not None:
+            return agent
+        return self.finish_selection(last_speaker, super().select_speaker(last_speaker, selector), key)
+
+    async def a_select_speaker(self, last_speaker: autogen.Agent, selector: autogen.ConversableAgent) -> autogen.Agent:
+        agent, key = self.select_by_rules(last_speaker, selector)
+        if agent is not None:
+            return agent
+        return self.finish_selection(last_speaker, await super().a_select_speaker(last_speaker, selector), key)
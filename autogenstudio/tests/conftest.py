@@ -0,0 +1,115 @@
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import pytest
+
+from autogenstudio.utils.httpclients import HTTPClientPool
+
+
+class MockEndpoint:
+    """
+    A fake OpenAI chat completions endpoint. Records the requests it receives and answers each one with the
+    text returned by reply(request_body), "ok" by default. Requests with stream=True get the reply as
+    server-sent events, one chunk per word.
+    """
+
+    def __init__(self, reply: Optional[Callable[[Dict[str, Any]], str]] = None) -> None:
+        self.reply = reply or (lambda body: "ok")
+        self.requests: List[Dict[str, Any]] = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        if body.get("stream"):
+            return self.stream(body)
+        return httpx.Response(
+            200,
+            json={
+                "id": f"chatcmpl-{len(self.requests)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": self.reply(body)},
+                    }
+                ],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+            },
+        )
+
+    def stream(self, body: Dict[str, Any]) -> httpx.Response:
+        words = self.reply(body).split(" ")
+        deltas = [{"role": "assistant", "content": ""}] + [
+            {"content": word if index == 0 else " " + word} for index, word in enumerate(words)
+        ]
+        events = []
+        for index, delta in enumerate(deltas):
+            chunk = {
+                "id": f"chatcmpl-{len(self.requests)}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": "stop" if index == len(deltas) - 1 else None}
+                ],
+            }
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        events.append("data: [DONE]\n\n")
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content="".join(events).encode())
+
+    def client(self) -> httpx.Client:
+        return httpx.Client(transport=httpx.MockTransport(self.handle))
+
+    def config(self, model: str = "gpt-4") -> Dict[str, Any]:
+        """
+        Return a model config whose requests are served by this endpoint.
+        """
+        return {"model": model, "api_key": "sk-test", "base_url": "http://mock.local/v1", "http_client": self.client()}
+
+    def pool(self) -> HTTPClientPool:
+        """
+        Return an HTTP client pool that sends the requests of every model config to this endpoint.
+        """
+        endpoint = self
+
+        class MockClientPool(HTTPClientPool):
+            def get(self, model: Any) -> httpx.Client:
+                return endpoint.client()
+
+        return MockClientPool()
+
+
+@pytest.fixture
+def endpoint() -> MockEndpoint:
+    return MockEndpoint()
+
+
+@pytest.fixture(scope="session")
+def web_app(tmp_path_factory: pytest.TempPathFactory) -> Any:
+    """
+    The studio web app module, with its database and files in a temporary app folder.
+    """
+    monkeypatch = pytest.MonkeyPatch()
+    monkeypatch.setenv("AUTOGENSTUDIO_APPDIR", str(tmp_path_factory.mktemp("appdir")))
+    from autogenstudio.web import app
+
+    yield app
+    app.dbmanager.stop_write_behind()
+    monkeypatch.undo()
+
+
+@pytest.fixture
+def dbmanager(tmp_path: Any) -> Any:
+    """
+    A DBManager on a new database in a temporary folder.
+    """
+    from autogenstudio.utils.dbutils import DBManager
+
+    manager = DBManager(path=str(tmp_path / "database.sqlite"))
+    yield manager
+    manager.close()
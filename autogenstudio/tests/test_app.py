@@ -0,0 +1,114 @@
+import json
+
+import autogen.oai.client
+import pytest
+from fastapi.testclient import TestClient
+
+from autogenstudio.datamodel import AgentConfig, AgentFlowSpec, AgentWorkFlowConfig, LLMConfig
+
+
+def streaming_config() -> dict:
+    llm_config = LLMConfig(
+        config_list=[{"model": "gpt-4", "api_key": "sk-test", "base_url": "http://mock.local/v1"}], stream=True
+    )
+    return AgentWorkFlowConfig(
+        name="test",
+        description="test",
+        sender=AgentFlowSpec(
+            type="userproxy",
+            config=AgentConfig(name="user_proxy", code_execution_config=False, max_consecutive_auto_reply=0),
+        ),
+        receiver=AgentFlowSpec(type="assistant", config=AgentConfig(name="assistant", llm_config=llm_config)),
+    ).dict()
+
+
+def read_events(text: str) -> list:
+    events = []
+    for frame in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.mark.parametrize("async_runtime", [False, True])
+def test_stream_sends_deltas_before_result(web_app, endpoint, monkeypatch, async_runtime):
+    monkeypatch.setattr(web_app, "async_runtime", async_runtime)
+    monkeypatch.setattr(web_app.chatmanager, "http_clients", endpoint.pool())
+    # autogen counts the prompt tokens of streamed completions with tiktoken, which downloads its encodings
+    monkeypatch.setattr(autogen.oai.client, "count_token", lambda messages, model: 10)
+    endpoint.reply = lambda body: "streamed reply TERMINATE"
+    request = {
+        "message": {
+            "user_id": "stream-user",
+            "role": "user",
+            "content": "hello",
+            "root_msg_id": "root",
+            "session_id": f"stream-session-{async_runtime}",
+        },
+        "flow_config": streaming_config(),
+    }
+
+    with TestClient(web_app.app) as client:
+        response = client.post("/api/messages/stream", json=request)
+
+    events = read_events(response.text)
+    names = [name for name, _ in events]
+    assert names[-1] == "result"
+    assert "delta" in names
+    assert names.index("delta") < names.index("result")
+    assert "".join(data["content"] for name, data in events if name == "delta") == "streamed reply TERMINATE"
+
+
+def test_profiles_are_only_served_to_their_user(web_app, endpoint, monkeypatch):
+    # the worker pool of the chat executor is shut down with the app of the first test client
+    monkeypatch.setattr(web_app, "async_runtime", True)
+    monkeypatch.setattr(web_app.chatmanager, "http_clients", endpoint.pool())
+    flow_config = streaming_config()
+    flow_config["receiver"]["config"]["llm_config"]["stream"] = False
+    request = {
+        "message": {
+            "user_id": "profile-user",
+            "role": "user",
+            "content": "hello",
+            "root_msg_id": "root",
+            "msg_id": "profiled-message",
+            "session_id": "profile-session",
+        },
+        "flow_config": flow_config,
+        "profile": "pyinstrument",
+    }
+
+    with TestClient(web_app.app) as client:
+        profile = client.post("/api/messages", json=request).json()["metadata"]["profile"]
+        own = client.get(f"/{profile['file']['path']}", params={"user_id": "profile-user"})
+        other = client.get(f"/{profile['file']['path']}", params={"user_id": "other-user"})
+        files = client.get(f"/api/files/user/{web_app.md5_hash('profile-user')}/profiles/{profile['file']['name']}")
+
+    # pyinstrument is an optional package, without it the turn is profiled with cProfile
+    assert profile["mode"] == "cprofile"
+    assert own.status_code == 200 and own.content
+    assert other.status_code == 404
+    assert files.status_code == 404
+
+
+def test_audio_push_reports_require_the_metrics_token(web_app, monkeypatch):
+    monkeypatch.setattr(web_app, "metrics_token", "secret")
+    report = {"mode": "track", "seconds": 0.5}
+    client = TestClient(web_app.app)
+
+    assert client.post("/api/metrics/audio_push", json=report).status_code == 403
+    wrong = client.post("/api/metrics/audio_push", json=report, headers={"X-Metrics-Token": "wrong"})
+    assert wrong.status_code == 403
+    ok = client.post("/api/metrics/audio_push", json=report, headers={"X-Metrics-Token": "secret"})
+    assert ok.status_code == 200 and ok.json()["status"]
+    unknown_mode = client.post(
+        "/api/metrics/audio_push", json={**report, "mode": "other"}, headers={"X-Metrics-Token": "secret"}
+    )
+    assert unknown_mode.status_code == 422
+
+
+def test_audio_push_reports_without_token_are_local_only(web_app, monkeypatch):
+    monkeypatch.setattr(web_app, "metrics_token", None)
+    # the test client is not a local address
+    response = TestClient(web_app.app).post("/api/metrics/audio_push", json={"mode": "track", "seconds": 0.5})
+    assert response.status_code == 403
@@ -0,0 +1,39 @@
+from autogenstudio.datamodel import Model
+from autogenstudio.utils import dbutils
+from autogenstudio.utils.catalogcache import CatalogCache
+from autogenstudio.utils.dbutils import DBManager
+
+
+def test_writes_invalidate_cached_catalogs(dbmanager):
+    cache = CatalogCache(dbmanager)
+    model = Model(model="gpt-4", user_id="u", description="first")
+    dbutils.upsert_model(model, dbmanager)
+
+    etag, models = cache.get("models", "u")
+    assert cache.get("models", "u") == (etag, models)
+    assert cache.stats()["hits"] == 2
+
+    # a write by another connection, e.g. of another server process, changes the catalog version
+    other = DBManager(path=dbmanager.path)
+    try:
+        model.description = "second"
+        dbutils.upsert_model(model, other)
+    finally:
+        other.close()
+
+    new_etag, models = cache.get("models", "u")
+    assert new_etag != etag and new_etag == dbutils.get_catalog_etag("models", "u", dbmanager)
+    assert [item["description"] for item in models if item["id"] == model.id] == ["second"]
+
+
+def test_user_items_shadow_default_items(dbmanager):
+    cache = CatalogCache(dbmanager)
+    default = Model(model="gpt-4", user_id="default", description="default")
+    dbutils.upsert_model(default, dbmanager)
+    own = Model(model="gpt-4", id=default.id, user_id="u", description="own")
+    dbutils.upsert_model(own, dbmanager)
+
+    _, models = cache.get("models", "u")
+    assert [item["description"] for item in models if item["id"] == default.id] == ["own"]
+    _, models = cache.get("models", "other")
+    assert [item["description"] for item in models if item["id"] == default.id] == ["default"]
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+from autogenstudio.chatmanager import AutoGenChatManager
+from autogenstudio.datamodel import (
+    AgentConfig,
+    AgentFlowSpec,
+    AgentWorkFlowConfig,
+    HistoryPolicy,
+    LLMConfig,
+    Message,
+)
+from autogenstudio.workflowmanager import WorkflowCache
+
+
+def two_agent_config() -> AgentWorkFlowConfig:
+    llm_config = LLMConfig(config_list=[{"model": "gpt-4", "api_key": "sk-test", "base_url": "http://mock.local/v1"}])
+    return AgentWorkFlowConfig(
+        name="test",
+        description="test",
+        sender=AgentFlowSpec(
+            type="userproxy",
+            config=AgentConfig(name="user_proxy", code_execution_config=False, max_consecutive_auto_reply=0),
+        ),
+        receiver=AgentFlowSpec(
+            type="assistant", config=AgentConfig(name="assistant", system_message="You help.", llm_config=llm_config)
+        ),
+    )
+
+
+def test_history_policy_applies_to_cached_workflow(endpoint, tmp_path):
+    manager = AutoGenChatManager(workflow_cache=WorkflowCache(), http_clients=endpoint.pool())
+    flow_config = two_agent_config()
+    policy = HistoryPolicy(type="last_n", max_messages=2)
+    history = [
+        Message(user_id="u", role="user" if i % 2 == 0 else "assistant", content=f"message {i}", session_id="s")
+        for i in range(6)
+    ]
+
+    for content in ["first", "second"]:
+        message = Message(user_id="u", role="user", content=content, session_id="s")
+        response = manager.chat(message, history, flow_config, work_dir=str(tmp_path), history_policy=policy)
+        history = history + [message, response]
+
+    assert manager.workflow_cache.stats()["hits"] == 1
+    # the system message, the last two messages of the history and the new message
+    messages = endpoint.requests[-1]["messages"]
+    assert len(messages) == 4
+    assert messages[-1]["content"] == "second"
+
+
+def test_cached_workflow_starts_like_new_workflow(endpoint, tmp_path):
+    flow_config = two_agent_config()
+    history = [Message(user_id="u", role="user", content="earlier", session_id="s")]
+    requests = []
+    for workflow_cache in [WorkflowCache(), None]:
+        manager = AutoGenChatManager(workflow_cache=workflow_cache, http_clients=endpoint.pool())
+        turn_history = list(history)
+        for content in ["first", "second"]:
+            message = Message(user_id="u", role="user", content=content, session_id="s")
+            response = manager.chat(message, turn_history, flow_config, work_dir=str(tmp_path))
+            turn_history = turn_history + [message, response]
+        requests.append(endpoint.requests[-1]["messages"])
+
+    assert requests[0] == requests[1]
+
+
+def test_cached_workflow_clears_scratch_dir(endpoint, tmp_path):
+    manager = AutoGenChatManager(workflow_cache=WorkflowCache(), http_clients=endpoint.pool())
+    flow_config = two_agent_config()
+    history = []
+    for content in ["first", "second"]:
+        (tmp_path / "scratch").mkdir(exist_ok=True)
+        (tmp_path / "scratch" / f"{content}.txt").write_text(content)
+        message = Message(user_id="u", role="user", content=content, session_id="s")
+        response = manager.chat(message, history, flow_config, work_dir=str(tmp_path))
+        history = history + [message, response]
+        assert not (tmp_path / "scratch" / f"{content}.txt").exists()
+
+    assert manager.workflow_cache.stats()["hits"] == 1
+
+
+def test_achat_matches_chat(endpoint, tmp_path):
+    manager = AutoGenChatManager(http_clients=endpoint.pool())
+    flow_config = two_agent_config()
+    recorded = []
+
+    async def on_message(iteration):
+        recorded.append(iteration["sender"])
+
+    message = Message(user_id="u", role="user", content="hi")
+    sync_response = manager.chat(message, [], flow_config, work_dir=str(tmp_path))
+    async_response = asyncio.run(manager.achat(message, [], flow_config, work_dir=str(tmp_path), on_message=on_message))
+
+    assert async_response.content == sync_response.content == "ok"
+    senders = [iteration["sender"] for iteration in json.loads(async_response.metadata)["messages"]]
+    assert senders == [iteration["sender"] for iteration in json.loads(sync_response.metadata)["messages"]]
+    # coroutine callbacks are awaited in async runs
+    assert recorded == senders
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from autogenstudio.datamodel import AgentConfig, AgentFlowSpec, AgentWorkFlowConfig, Message, Model, Session
+from autogenstudio.utils import dbutils
+
+
+def message(session_id: str, content: str = "hello", role: str = "user", **kwargs) -> Message:
+    return Message(user_id="u", role=role, content=content, root_msg_id="root", session_id=session_id, **kwargs)
+
+
+def test_write_behind_reads_skip_the_queue(dbmanager):
+    # a long interval, so only the flushes under test write the queue
+    dbmanager.start_write_behind(flush_interval=60)
+    dbutils.create_message(message("a"), dbmanager)
+
+    dbutils.get_sessions(user_id="u", dbmanager=dbmanager)
+    assert dbutils.get_messages(user_id="u", session_id="b", dbmanager=dbmanager) == []
+    assert dbmanager.write_queue.pending == 1
+
+    rows = dbutils.get_messages(user_id="u", session_id="a", dbmanager=dbmanager)
+    assert [row["content"] for row in rows] == ["hello"]
+    assert dbmanager.write_queue.pending == 0
+
+
+def test_write_behind_writes_apply_in_order(dbmanager):
+    dbmanager.start_write_behind(flush_interval=60)
+    queued = message("a")
+    dbutils.create_message(queued, dbmanager)
+
+    dbmanager.query("DELETE FROM messages WHERE msg_id = ?", (queued.msg_id,))
+
+    assert dbmanager.write_queue.pending == 0
+    assert dbutils.get_messages(user_id="u", session_id="a", dbmanager=dbmanager) == []
+
+
+def legacy_database(path: str) -> sqlite3.Connection:
+    """
+    A database with the schema migrate_agent_turns runs on.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute(dbutils.MESSAGES_TABLE_SQL)
+    conn.execute(dbutils.MIGRATIONS[dbutils.MIGRATIONS.index(dbutils.migrate_agent_turns) - 1][0])
+    return conn
+
+
+def test_migrate_agent_turns_with_duplicate_msg_ids(tmp_path):
+    conn = legacy_database(str(tmp_path / "legacy.sqlite"))
+    insert = (
+        "INSERT INTO messages (user_id, session_id, root_msg_id, msg_id, role, content, metadata, timestamp)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    metadata = json.dumps({"messages": [{"sender": "assistant", "message": {"content": "hi"}}]})
+    conn.executemany(
+        insert,
+        [
+            ("u", "s", "root", "dup", "user", "first copy", None, "2024-01-01T00:00:00"),
+            ("u", "s", "other-root", "dup", "user", "second copy", None, "2024-01-01T00:00:00"),
+            ("u", "s", "root", "question", "user", "hello", None, "2024-01-01T00:00:01"),
+            ("u", "s", "root", "answer", "assistant", "hi", metadata, "2024-01-01T00:00:02"),
+        ],
+    )
+
+    dbutils.migrate_agent_turns(conn)
+
+    msg_ids = [row[0] for row in conn.execute("SELECT msg_id FROM messages ORDER BY rowid")]
+    assert len(set(msg_ids)) == 4 and msg_ids[0] == "dup"
+    # legacy turns are keyed by the user message of the run, as new turns are
+    assert [row[0] for row in conn.execute("SELECT msg_id FROM agent_turns")] == ["question"]
+    metadata = json.loads(conn.execute("SELECT metadata FROM messages WHERE msg_id = 'answer'").fetchone()[0])
+    assert metadata == {"turn_count": 1, "turn_msg_id": "question"}
+
+
+def test_agent_turns_are_deleted_with_their_messages(dbmanager):
+    for delete in ("question", "answer"):
+        question = message("s", msg_id=f"{delete}-question")
+        answer = message("s", content="hi", msg_id=f"{delete}-answer", role="assistant")
+        answer.metadata = json.dumps({"messages": [{"sender": "assistant", "message": {"content": "hi"}}]})
+        dbutils.create_message(question, dbmanager)
+        dbutils.create_response_message(answer, question, dbmanager)
+        assert len(dbutils.get_agent_turns("u", question.msg_id, dbmanager)) == 1
+
+        deleted = question if delete == "question" else answer
+        dbutils.delete_message("u", deleted.msg_id, "s", dbmanager)
+
+        assert dbutils.get_agent_turns("u", question.msg_id, dbmanager) == []
+
+
+def read_pages(load, limit, id_field="id"):
+    """
+    Read the pages of a listing until next_cursor reports the last page.
+    """
+    pages, cursor = [], None
+    while True:
+        rows = load(limit=limit, cursor=cursor)
+        pages.append(rows)
+        cursor = dbutils.next_cursor(rows, limit, id_field=id_field)
+        if cursor is None:
+            return pages
+
+
+def workflow_config() -> AgentWorkFlowConfig:
+    return AgentWorkFlowConfig(
+        name="test",
+        description="test",
+        sender=AgentFlowSpec(type="userproxy", config=AgentConfig(name="user_proxy")),
+        receiver=AgentFlowSpec(type="assistant", config=AgentConfig(name="assistant")),
+    )
+
+
+def test_message_pages_with_timestamp_ties(dbmanager):
+    for index in range(5):
+        dbutils.create_message(message("a", content=str(index), timestamp="2024-01-01T00:00:00"), dbmanager)
+
+    pages = read_pages(
+        lambda limit, cursor: dbutils.get_messages("u", "a", dbmanager, limit=limit, cursor=cursor),
+        limit=2,
+        id_field="msg_id",
+    )
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    msg_ids = [row["msg_id"] for page in pages for row in page]
+    assert msg_ids == sorted(msg_ids) and len(set(msg_ids)) == 5
+
+
+def test_session_pages_end_with_an_empty_last_page(dbmanager):
+    timestamps = ["2024-01-02", "2024-01-01", "2024-01-01", "2024-01-01"]
+    for index, timestamp in enumerate(timestamps):
+        session = Session(user_id="u", id=f"session-{index}", timestamp=timestamp, flow_config=workflow_config())
+        dbutils.create_session(user_id="u", session=session, dbmanager=dbmanager)
+
+    pages = read_pages(lambda limit, cursor: dbutils.get_sessions("u", dbmanager, limit=limit, cursor=cursor), limit=2)
+
+    # a full last page still returns a cursor, the page after it is empty
+    assert [len(page) for page in pages] == [2, 2, 0]
+    ids = [row["id"] for page in pages for row in page]
+    assert ids == ["session-0", "session-3", "session-2", "session-1"]
+
+
+def test_gallery_pages_with_timestamp_ties(dbmanager):
+    session = Session(user_id="u", id="published", flow_config=workflow_config())
+    dbutils.create_session(user_id="u", session=session, dbmanager=dbmanager)
+    dbutils.create_message(message("published"), dbmanager)
+    items = [dbutils.create_gallery(session, dbmanager, tags=["demo"]) for _ in range(3)]
+    dbmanager.query("UPDATE gallery SET timestamp = ?", ("2024-01-01",))
+
+    pages = read_pages(
+        lambda limit, cursor: dbutils.get_gallery(None, dbmanager, limit=limit, cursor=cursor, tag="demo"), limit=2
+    )
+
+    assert [len(page) for page in pages] == [2, 1]
+    ids = [row["id"] for page in pages for row in page]
+    assert ids == sorted((item.id for item in items), reverse=True)
+
+
+def test_reads_use_per_thread_connections_in_wal_mode(dbmanager):
+    assert dbmanager.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    dbutils.create_message(message("a"), dbmanager)
+    results = {}
+
+    def read():
+        results["connection"] = dbmanager.reader()
+        results["rows"] = dbutils.get_messages(user_id="u", session_id="a", dbmanager=dbmanager)
+
+    # reads do not wait for the writer
+    with dbmanager.write_lock("test"):
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join(5)
+
+    assert not thread.is_alive()
+    assert [row["content"] for row in results["rows"]] == ["hello"]
+    assert results["connection"] is not dbmanager.reader() and results["connection"] is not dbmanager.conn
+
+
+def test_listing_queries_are_served_from_indexes(dbmanager):
+    assert dbmanager.conn.execute("PRAGMA user_version").fetchone()[0] == len(dbutils.MIGRATIONS)
+    listings = {
+        "idx_messages_user_session_timestamp": (
+            "SELECT * FROM messages WHERE user_id = ? AND session_id = ? AND (timestamp, msg_id) > (?, ?) "
+            "ORDER BY timestamp ASC, msg_id ASC LIMIT 10",
+            ("u", "a", "", ""),
+        ),
+        "idx_sessions_user_timestamp": (
+            "SELECT * FROM sessions WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT 10",
+            ("u",),
+        ),
+        "idx_gallery_timestamp": (
+            "SELECT id, tags, timestamp, title, message_count FROM gallery ORDER BY timestamp DESC, id DESC LIMIT 10",
+            (),
+        ),
+    }
+    for index, (query, args) in listings.items():
+        plan = " ".join(row[3] for row in dbmanager.conn.execute("EXPLAIN QUERY PLAN " + query, args))
+        assert index in plan
+        # the rows come out of the index in order, without a sort step
+        assert "TEMP B-TREE" not in plan
+
+
+def test_acreate_message_writes_off_the_event_loop(dbmanager):
+    asyncio.run(dbutils.acreate_message(message("a"), dbmanager))
+
+    rows = dbutils.get_messages(user_id="u", session_id="a", dbmanager=dbmanager)
+    assert [row["content"] for row in rows] == ["hello"]
+
+
+def test_gallery_items_of_the_same_content_share_a_snapshot(dbmanager):
+    session = Session(user_id="u", id="published", flow_config=workflow_config())
+    dbutils.create_session(user_id="u", session=session, dbmanager=dbmanager)
+    dbutils.create_message(message("published", content="what is a haiku?"), dbmanager)
+    first = dbutils.create_gallery(session, dbmanager, tags=["poetry"])
+    second = dbutils.create_gallery(session, dbmanager)
+
+    assert dbmanager.query("SELECT COUNT(*) FROM gallery_snapshots")[0][0] == 1
+    listing = dbutils.get_gallery(None, dbmanager)
+    assert {row["id"] for row in listing} == {first.id, second.id}
+    assert all("messages" not in row and row["title"] == "what is a haiku?" for row in listing)
+    [item] = dbutils.get_gallery(first.id, dbmanager)
+    assert item["session"]["id"] == "published" and item["tags"] == ["poetry"]
+    assert [row["content"] for row in item["messages"]] == ["what is a haiku?"]
+
+
+def test_upsert_updates_rows_in_place(dbmanager):
+    model = Model(model="gpt-4", user_id="u", description="first")
+    [stored] = dbutils.upsert_catalog_items("models", [dbutils.model_row(model)], dbmanager)
+    assert stored["description"] == "first"
+
+    model.description = "second"
+    models = dbutils.upsert_model(model, dbmanager)
+
+    assert [row["description"] for row in models if row["id"] == model.id] == ["second"]
+    assert dbmanager.query("SELECT COUNT(*) FROM models WHERE id = ?", (model.id,))[0][0] == 1
+
+
+def test_import_catalog_is_atomic(dbmanager):
+    model = Model(model="gpt-4", user_id="u")
+    invalid = Model(model="gpt-4", user_id="u")
+    invalid.timestamp = None
+    with pytest.raises(sqlite3.IntegrityError):
+        dbutils.import_catalog({"models": [model, invalid]}, dbmanager)
+
+    assert dbmanager.query("SELECT COUNT(*) FROM models WHERE id = ?", (model.id,))[0][0] == 0
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+import pytest
+
+from autogenstudio.executor import ChatExecutor, ChatQueueFullError
+
+
+@pytest.fixture
+def executor():
+    executor = ChatExecutor(max_workers=1, max_queue_size=1, max_per_user=2, max_async_runs=1)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def test_rejects_runs_beyond_the_queue(executor):
+    release = threading.Event()
+    futures = [executor.submit(user, release.wait, 10) for user in ("a", "b")]
+
+    with pytest.raises(ChatQueueFullError) as rejection:
+        executor.submit("c", release.wait, 10)
+
+    assert rejection.value.retry_after >= 1
+    assert executor.stats()["rejected"] == 1
+    release.set()
+    assert all(future.result(10) for future in futures)
+    # the finished runs free their slots
+    assert executor.submit("c", lambda: "done").result(10) == "done"
+
+
+def test_rejects_runs_beyond_the_user_limit():
+    executor = ChatExecutor(max_workers=4, max_queue_size=4, max_per_user=1)
+    release = threading.Event()
+    try:
+        future = executor.submit("a", release.wait, 10)
+        with pytest.raises(ChatQueueFullError):
+            executor.submit("a", release.wait, 10)
+        # other users are not limited by the runs of user a
+        assert executor.submit("b", lambda: "done").result(10) == "done"
+        release.set()
+        future.result(10)
+        assert executor.submit("a", lambda: "done").result(10) == "done"
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
+
+
+def test_failed_runs_release_their_slots(executor):
+    def fail():
+        raise RuntimeError("chat failed")
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            executor.submit("a", fail).result(10)
+
+    stats = executor.stats()
+    assert stats["failed"] == 3
+    assert stats["running"] == stats["queued"] == stats["active_users"] == 0
+
+
+def test_async_runs_share_the_user_limit_and_release_on_failure(executor):
+    async def fail():
+        raise RuntimeError("chat failed")
+
+    async def scenario():
+        release = asyncio.Event()
+        task = executor.submit_async("a", release.wait)
+        # max_async_runs is 1
+        with pytest.raises(ChatQueueFullError):
+            executor.submit_async("b", release.wait)
+        release.set()
+        await task
+        with pytest.raises(RuntimeError):
+            await executor.submit_async("a", fail)
+        return executor.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["async_running"] == stats["active_users"] == 0
+    assert stats["completed"] == 1 and stats["failed"] == 1
@@ -0,0 +1,91 @@
+import autogen
+
+from autogenstudio.datamodel import (
+    AgentConfig,
+    AgentFlowSpec,
+    AgentWorkFlowConfig,
+    GroupChatConfig,
+    GroupChatFlowSpec,
+    LLMConfig,
+)
+from autogenstudio.groupchat import SpeakerSelectionCache, StudioGroupChat
+from autogenstudio.workflowmanager import create_workflow_manager
+
+
+def transition_config() -> AgentWorkFlowConfig:
+    llm_config = LLMConfig(config_list=[{"model": "gpt-4", "api_key": "sk-test", "base_url": "http://mock.local/v1"}])
+
+    def assistant(name: str) -> AgentFlowSpec:
+        return AgentFlowSpec(
+            type="assistant", config=AgentConfig(name=name, system_message=f"You are {name}.", llm_config=llm_config)
+        )
+
+    return AgentWorkFlowConfig(
+        name="test",
+        description="test",
+        type="groupchat",
+        sender=AgentFlowSpec(
+            type="userproxy",
+            config=AgentConfig(name="user_proxy", code_execution_config=False, max_consecutive_auto_reply=0),
+        ),
+        receiver=GroupChatFlowSpec(
+            type="groupchat",
+            config=AgentConfig(name="manager", llm_config=llm_config),
+            groupchat_config=GroupChatConfig(
+                agents=[assistant("writer"), assistant("critic")],
+                max_round=3,
+                speaker_selection_method="round_robin",
+                speaker_transitions={"user_proxy": ["writer", "critic"], "writer": ["critic"]},
+            ),
+        ),
+    )
+
+
+def test_transition_routed_groupchat(endpoint, tmp_path):
+    endpoint.reply = lambda body: f"reply to {body['messages'][0]['content']}"
+    flow = create_workflow_manager(transition_config(), work_dir=str(tmp_path), http_clients=endpoint.pool())
+
+    flow.run(message="write a haiku")
+
+    # autogen selects the first speaker from the transition graph, the writer hands over to the critic
+    assert len(endpoint.requests) == 2
+    messages = flow.receiver._groupchat.messages
+    assert [message["name"] for message in messages] == ["user_proxy", "writer", "critic"]
+    assert messages[-1]["content"] == "reply to You are critic."
+
+
+def auto_groupchat(transitions, selection_cache) -> StudioGroupChat:
+    agents = [
+        autogen.ConversableAgent(name=name, llm_config=False, human_input_mode="NEVER")
+        for name in ["user_proxy", "writer", "critic", "editor"]
+    ]
+    return StudioGroupChat(
+        agents=agents,
+        messages=[{"name": "user_proxy", "role": "user", "content": "write a haiku"}],
+        speaker_selection_method="auto",
+        speaker_transitions=transitions,
+        selection_cache=selection_cache,
+    )
+
+
+def test_cached_selection_respects_transitions():
+    cache = SpeakerSelectionCache()
+    groupchat = auto_groupchat({"user_proxy": ["writer", "critic"]}, cache)
+    user_proxy, critic = groupchat.agent_by_name("user_proxy"), groupchat.agent_by_name("critic")
+
+    agent, key = groupchat.select_by_rules(user_proxy)
+    assert agent is None
+    groupchat.finish_selection(user_proxy, critic, key)
+    assert groupchat.select_by_rules(user_proxy) == (critic, None)
+
+    # the same agents and message with other transitions do not share the decision
+    other = auto_groupchat({"user_proxy": ["writer", "editor"]}, cache)
+    agent, other_key = other.select_by_rules(other.agent_by_name("user_proxy"))
+    assert agent is None and other_key != key
+    other = auto_groupchat({"user_proxy": ["writer", "critic"], "writer": ["editor"]}, cache)
+    agent, other_key = other.select_by_rules(other.agent_by_name("user_proxy"))
+    assert agent is None and other_key != key
+
+    # a cached speaker the transitions do not allow is not used
+    cache.set(key, "editor")
+    assert groupchat.select_by_rules(user_proxy) == (None, key)
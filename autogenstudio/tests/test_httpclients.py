@@ -0,0 +1,23 @@
+from autogenstudio.utils.httpclients import HTTPClientPool
+
+
+def test_clients_are_shared_per_endpoint_and_key():
+    pool = HTTPClientPool(http2=False)
+    base = {"base_url": "http://mock.local/v1", "api_key": "sk-first"}
+    try:
+        config_list = pool.configure([{**base, "model": "gpt-4"}, {**base, "model": "gpt-3.5-turbo"}])
+        other_key = pool.configure([{**base, "api_key": "sk-second", "model": "gpt-4"}])
+        unpooled = pool.configure([{**base, "model": "claude", "api_type": "anthropic"}])
+
+        # the model name does not matter, the endpoint and credentials do
+        assert config_list[0]["http_client"] is config_list[1]["http_client"]
+        assert other_key[0]["http_client"] is not config_list[0]["http_client"]
+        assert "http_client" not in unpooled[0]
+        stats = pool.stats()
+        assert stats["clients"] == 2
+        # the api key is not kept in the stats
+        assert "sk-first" not in str(stats)
+    finally:
+        pool.close()
+    assert pool.stats()["clients"] == 0
+
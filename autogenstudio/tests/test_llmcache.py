@@ -0,0 +1,58 @@
+import pytest
+from autogen import OpenAIWrapper
+
+from autogenstudio.utils.llmcache import CachedOpenAIWrapper, get_completion_cache
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_identical_request_is_served_from_cache(backend, endpoint, tmp_path):
+    cache = get_completion_cache(backend, str(tmp_path / "cache.sqlite"), 1024 * 1024)
+    llm_config = {"config_list": [endpoint.config()], "temperature": 0}
+    client = CachedOpenAIWrapper(OpenAIWrapper(**llm_config), cache, llm_config)
+    messages = [{"role": "user", "content": "hello"}]
+
+    first = client.create(messages=messages, cache_seed=None)
+    assert not client.last_hit
+    second = client.create(messages=messages, cache_seed=None)
+
+    assert client.last_hit
+    assert len(endpoint.requests) == 1
+    assert cache.stats()["hits"] == 1
+    assert client.extract_text_or_completion_object(second) == client.extract_text_or_completion_object(first)
+    assert second.usage.prompt_tokens == first.usage.prompt_tokens
+
+
+def test_different_messages_miss(endpoint):
+    cache = get_completion_cache("memory", "", 1024 * 1024)
+    llm_config = {"config_list": [endpoint.config()]}
+    client = CachedOpenAIWrapper(OpenAIWrapper(**llm_config), cache, llm_config)
+
+    client.create(messages=[{"role": "user", "content": "hello"}], cache_seed=None)
+    client.create(messages=[{"role": "user", "content": "goodbye"}], cache_seed=None)
+
+    assert not client.last_hit
+    assert len(endpoint.requests) == 2
+
+
+def test_different_api_keys_miss(endpoint):
+    cache = get_completion_cache("memory", "", 1024 * 1024)
+    messages = [{"role": "user", "content": "hello"}]
+    for api_key in ("sk-first", "sk-second"):
+        llm_config = {"config_list": [{**endpoint.config(), "api_key": api_key}]}
+        client = CachedOpenAIWrapper(OpenAIWrapper(**llm_config), cache, llm_config)
+        client.create(messages=messages, cache_seed=None)
+        assert not client.last_hit
+
+    assert len(endpoint.requests) == 2
+
+
+def test_different_users_miss(endpoint):
+    cache = get_completion_cache("memory", "", 1024 * 1024)
+    llm_config = {"config_list": [endpoint.config()]}
+    messages = [{"role": "user", "content": "hello"}]
+    for user_id in ("alice", "bob"):
+        client = CachedOpenAIWrapper(OpenAIWrapper(**llm_config), cache, llm_config, scope=user_id)
+        client.create(messages=messages, cache_seed=None)
+        assert not client.last_hit
+
+    assert len(endpoint.requests) == 2
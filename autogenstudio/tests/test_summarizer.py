@@ -0,0 +1,16 @@
+from autogenstudio.utils import summarizer as summarizer_module
+from autogenstudio.utils.summarizer import Summarizer
+
+
+def test_summary_is_sent_to_on_delta_without_streaming_support(endpoint, monkeypatch):
+    monkeypatch.setattr(summarizer_module, "stream_deltas_supported", lambda: False)
+    endpoint.reply = lambda body: "The agents wrote a haiku."
+    config = {"model": "gpt-4", "api_key": "sk-test", "base_url": "http://mock.local/v1"}
+    summarizer = Summarizer(config_list=[config], stream=True, http_clients=endpoint.pool())
+    deltas = []
+
+    summary = summarizer.summarize([{"name": "writer", "content": "a haiku"}], on_delta=deltas.append)
+
+    assert not summarizer.stream
+    assert summary == "The agents wrote a haiku."
+    assert deltas == [summary]
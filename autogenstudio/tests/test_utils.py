@@ -0,0 +1,31 @@
+import time
+
+from autogenstudio.utils import get_modified_files, snapshot_folder
+
+
+def run_turn(workspace, dest_dir, edit):
+    snapshot = snapshot_folder(str(workspace))
+    start_time = time.time()
+    edit()
+    return get_modified_files(start_time, time.time(), str(workspace), str(dest_dir), snapshot=snapshot)
+
+
+def test_published_files_do_not_change_with_the_workspace(tmp_path):
+    workspace = tmp_path / "scratch"
+    workspace.mkdir()
+    dest_dir = tmp_path / "user"
+    report = workspace / "report.txt"
+
+    first = run_turn(workspace, dest_dir, lambda: report.write_text("first version"))
+
+    def rewrite_in_place():
+        # same inode, as code that opens the file for writing does
+        with open(report, "r+") as f:
+            f.write("FIRST")
+
+    second = run_turn(workspace, dest_dir, rewrite_in_place)
+
+    assert [file["name"] for file in first] == ["report.txt"]
+    assert [file["name"] for file in second] == ["report.txt"]
+    assert (dest_dir / "report.txt").read_text() == "first version"
+    assert (dest_dir / "report_1.txt").read_text() == "FIRST version"
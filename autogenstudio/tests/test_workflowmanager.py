@@ -0,0 +1,81 @@
+import threading
+
+from autogenstudio.datamodel import (
+    AgentConfig,
+    AgentFlowSpec,
+    AgentWorkFlowConfig,
+    LLMConfig,
+    ParallelConfig,
+)
+from autogenstudio.workflowmanager import TemplateCache, create_workflow_manager
+
+
+def assistant(name: str) -> AgentFlowSpec:
+    llm_config = LLMConfig(config_list=[{"model": "gpt-4", "api_key": "sk-test", "base_url": "http://mock.local/v1"}])
+    return AgentFlowSpec(type="assistant", config=AgentConfig(name=name, system_message=name, llm_config=llm_config))
+
+
+def test_first_join_ignores_branches_left_running(endpoint, tmp_path):
+    release = threading.Event()
+
+    def reply(body):
+        if body["messages"][0]["content"] == "slow":
+            release.wait(10)
+        return "done"
+
+    endpoint.reply = reply
+    config = AgentWorkFlowConfig(
+        name="test",
+        description="test",
+        type="parallel",
+        sender=AgentFlowSpec(
+            type="userproxy",
+            config=AgentConfig(name="user_proxy", code_execution_config=False, max_consecutive_auto_reply=0),
+        ),
+        receiver=assistant("receiver"),
+        parallel_config=ParallelConfig(branches=[assistant("fast"), assistant("slow")], join="first", aggregate=False),
+    )
+    flow = create_workflow_manager(config, work_dir=str(tmp_path), http_clients=endpoint.pool())
+    flow.run("task")
+    usage = flow.usage.total()
+    agent_history = list(flow.agent_history)
+
+    # let the slow branch finish its reply after the turn is recorded
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name.startswith("autogenstudio-branch"):
+            thread.join(10)
+
+    assert [result["status"] for result in flow.branch_results] == ["completed", "cancelled"]
+    assert usage["llm_calls"] == 1
+    assert flow.usage.total() == usage
+    assert flow.agent_history == agent_history
+    senders = [iteration["sender"] for iteration in agent_history]
+    assert "fast" in senders and "slow" not in senders
+    assert senders[-1] == "receiver"
+
+
+def test_template_cache_reuses_compiled_workflows(tmp_path):
+    template_cache = TemplateCache()
+    config = AgentWorkFlowConfig(
+        name="test",
+        description="test",
+        sender=AgentFlowSpec(type="userproxy", config=AgentConfig(name="user_proxy", max_consecutive_auto_reply=0)),
+        receiver=assistant("assistant"),
+    )
+    flows = [
+        create_workflow_manager(config, work_dir=str(tmp_path / name), template_cache=template_cache)
+        for name in ("first", "second")
+    ]
+
+    assert template_cache.stats()["hits"] == 1
+    assert flows[0].template is flows[1].template
+    assert flows[0].receiver is not flows[1].receiver
+    # each flow runs code in its own work dir, the shared template is not modified
+    assert flows[1].sender._code_execution_config["work_dir"] == str(tmp_path / "second")
+    assert "work_dir" not in flows[0].template.sender.config["code_execution_config"]
+
+    config.receiver.config.system_message = "changed"
+    flow = create_workflow_manager(config, work_dir=str(tmp_path / "changed"), template_cache=template_cache)
+    assert template_cache.stats()["misses"] == 2
+    assert flow.receiver.system_message.startswith("changed")
@@ -1,2 +1,10 @@
 from .dbutils import *
 from .utils import *
+from .llmcache import *
+from .catalogcache import *
+from .httpclients import *
+from .summarizer import *
+from .compaction import *
+from .usage import *
+from .metrics import *
+from .profiling import *
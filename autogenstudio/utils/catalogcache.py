@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .dbutils import CATALOG_JSON_COLUMNS, DBManager, catalog_etag, get_catalog_versions, parse_catalog_row
+
+
+class CatalogCache:
+    """
+    Read-through cache of the models, skills, agents and workflows catalogs. Rows are cached parsed, per user,
+    and the default rows are cached once per catalog and shared by all users. Entries are tagged with the
+    catalog versions that the write triggers maintain (see get_catalog_versions), so any write, including one
+    made by another server process, invalidates the affected entries on the next read.
+
+    Cached items are shared between requests and must not be modified by callers.
+    """
+
+    def __init__(self, dbmanager: DBManager, max_users: int = 1024) -> None:
+        """
+        Args:
+            dbmanager: The DBManager instance used to load the catalogs.
+            max_users: The number of per-user catalog entries to keep, least recently used first out.
+        """
+        self.dbmanager = dbmanager
+        self.max_users = max_users
+        # (catalog, user_id) -> (version, [(id, timestamp, item)])
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, List[Tuple[str, str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, catalog: str, user_id: str, version: int) -> List[Tuple[str, str, Any]]:
+        key = (catalog, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        query = f"SELECT * FROM {catalog} WHERE user_id = ?"
+        rows = self.dbmanager.query(query=query, args=(user_id,), return_json=True)
+        items = [(row["id"], row["timestamp"], parse_catalog_row(catalog, row)) for row in rows]
+
+        with self._lock:
+            self._entries[key] = (version, items)
+            self._entries.move_to_end(key)
+            # default entries are few and shared, only per-user entries count towards max_users
+            user_keys = [entry_key for entry_key in self._entries if entry_key[1] != "default"]
+            for entry_key in user_keys[: max(0, len(user_keys) - self.max_users)]:
+                del self._entries[entry_key]
+        return items
+
+    def get(self, catalog: str, user_id: str) -> Tuple[str, List[Any]]:
+        """
+        Return a user's view of a catalog: the user's items and the default items the user has no own copy of,
+        newest first.
+
+        Args:
+            catalog: One of models, skills, agents or workflows.
+            user_id: The ID of the user.
+
+        Returns:
+            A tuple of the catalog etag and the items.
+        """
+        if catalog not in CATALOG_JSON_COLUMNS:
+            raise ValueError(f"Unknown catalog: {catalog}")
+        user_version, default_version = get_catalog_versions(catalog, user_id, self.dbmanager)
+        user_items = self._load(catalog, user_id, user_version) if user_id != "default" else []
+        default_items = self._load(catalog, "default", default_version)
+
+        own_ids = {item_id for item_id, _, _ in user_items}
+        items = user_items + [entry for entry in default_items if entry[0] not in own_ids]
+        items = sorted(items, key=lambda entry: entry[1] or "", reverse=True)
+        return catalog_etag(catalog, user_version, default_version), [item for _, _, item in items]
+
+    def invalidate(self, catalog: Optional[str] = None, user_id: Optional[str] = None) -> None:
+        """
+        Drop cached entries, all of them or those of a catalog and/or user.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if (catalog is None or key[0] == catalog) and (user_id is None or key[1] == user_id):
+                    del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the number of cached entries and hit/miss counters.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_users": self.max_users,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,179 @@
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .dbutils import DBManager, get_session_history, save_session_summary
+from .summarizer import Summarizer
+from .utils import count_tokens
+
+logger = logging.getLogger()
+
+COMPACTION_INSTRUCTION = """You maintain the memory of a long conversation between a user and an AI assistant.
+Summarize the conversation so that the assistant can continue it without the original messages: keep the
+user's goals, decisions, facts, numbers, file names and open questions, and drop repetition. If the
+conversation starts with an earlier summary, merge it into the new summary."""
+
+# tokens added by the chat format to every message
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+class SessionCompactor:
+    """
+    Rolling compaction of long sessions. Once the history replayed to the agents exceeds max_tokens, the older
+    messages are folded into the session summary (see dbutils.get_session_history) and only the most recent
+    messages, up to keep_tokens, are replayed as they are. Compaction runs on a background thread after a turn
+    is saved, so it never adds latency to a chat request.
+    """
+
+    def __init__(
+        self,
+        dbmanager: DBManager,
+        summarizer: Summarizer,
+        max_tokens: int = 8000,
+        keep_tokens: int = 2000,
+        token_model: str = "gpt-4",
+        max_cached_counts: int = 10000,
+    ) -> None:
+        """
+        Args:
+            dbmanager: The DBManager instance used to load and save session history.
+            summarizer: The summarizer that folds messages into the session summary.
+            max_tokens: The history size, in tokens, that triggers a compaction. 0 disables compaction.
+            keep_tokens: The size of the recent messages kept out of the summary.
+            token_model: The model whose tokenizer is used to estimate history sizes.
+            max_cached_counts: The number of message token counts kept, messages are counted once.
+        """
+        self.dbmanager = dbmanager
+        self.summarizer = summarizer
+        self.max_tokens = max_tokens
+        self.keep_tokens = min(keep_tokens, max_tokens)
+        self.token_model = token_model
+        self.max_cached_counts = max_cached_counts
+        self.compactions = 0
+        self.errors = 0
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+        # sessions waiting for a compaction check, with the models of their workflow
+        self._pending: Dict[Tuple[str, str], Optional[List[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="autogenstudio-compaction", daemon=True)
+        self._thread.start()
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        """
+        Return the token count of a message, counted with the tokenizer once per msg_id.
+        """
+        msg_id = message.get("msg_id")
+        with self._lock:
+            if msg_id is not None and msg_id in self._token_counts:
+                self._token_counts.move_to_end(msg_id)
+                return self._token_counts[msg_id]
+        tokens = count_tokens(message.get("content") or "", model=self.token_model) + MESSAGE_TOKEN_OVERHEAD
+        if msg_id is not None:
+            with self._lock:
+                self._token_counts[msg_id] = tokens
+                while len(self._token_counts) > self.max_cached_counts:
+                    self._token_counts.popitem(last=False)
+        return tokens
+
+    def estimate_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        Estimate the number of prompt tokens a list of messages takes.
+        """
+        return sum(self.count_message(message) for message in messages)
+
+    def schedule(self, user_id: str, session_id: Optional[str], config_list: Optional[List[Dict]] = None) -> None:
+        """
+        Queue a compaction check of a session. Sessions already waiting are not queued twice.
+
+        :param user_id: The ID of the user the session belongs to
+        :param session_id: The ID of the session
+        :param config_list: The models of the session workflow, used if the summarizer has no model of its own
+        """
+        if session_id is None or self.max_tokens <= 0:
+            return
+        key = (user_id, session_id)
+        with self._lock:
+            queued = key in self._pending
+            self._pending[key] = config_list
+        if not queued:
+            self._queue.put(key)
+
+    def compact(self, user_id: str, session_id: str, config_list: Optional[List[Dict]] = None) -> bool:
+        """
+        Fold the older messages of a session into its summary if the session history exceeds max_tokens.
+
+        :param user_id: The ID of the user the session belongs to
+        :param session_id: The ID of the session
+        :param config_list: The models of the session workflow, used if the summarizer has no model of its own
+        :return: True if the session was compacted
+        """
+        history = get_session_history(user_id=user_id, session_id=session_id, dbmanager=self.dbmanager)
+        if self.estimate_tokens(history) <= self.max_tokens:
+            return False
+        summary = history[0] if history and history[0]["role"] == "summary" else None
+        messages = history[1:] if summary else history
+
+        # keep the most recent messages that fit in keep_tokens, fold the others into the summary
+        budget = self.keep_tokens
+        keep = 0
+        for message in reversed(messages):
+            budget -= self.count_message(message)
+            if budget < 0:
+                break
+            keep += 1
+        folded = messages[: len(messages) - keep]
+        if not folded:
+            return False
+
+        transcript = [{"name": "earlier summary", "content": summary["content"]}] if summary else []
+        transcript += [{"name": message["role"], "content": message["content"] or ""} for message in folded]
+        text = self.summarizer.summarize(transcript, config_list=config_list, instruction=COMPACTION_INSTRUCTION)
+        message_count = len(folded) + (json.loads(summary["metadata"])["message_count"] if summary else 0)
+        save_session_summary(
+            user_id=user_id,
+            session_id=session_id,
+            summary=text,
+            until_message=folded[-1],
+            message_count=message_count,
+            tokens=count_tokens(text, model=self.token_model),
+            dbmanager=self.dbmanager,
+        )
+        self.compactions += 1
+        return True
+
+    def _run(self) -> None:
+        while True:
+            key = self._queue.get()
+            if key is None:
+                return
+            with self._lock:
+                config_list = self._pending.pop(key, None)
+            try:
+                self.compact(key[0], key[1], config_list)
+            except Exception as e:
+                self.errors += 1
+                logger.error("Error compacting session %s: %s", key[1], e)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the compaction settings and counters.
+        """
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "keep_tokens": self.keep_tokens,
+                "pending": len(self._pending),
+                "compactions": self.compactions,
+                "errors": self.errors,
+            }
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Stop the background thread, after the checks already queued.
+        """
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
@@ -1,11 +1,19 @@
+import asyncio
+import base64
+import functools
+import hashlib
 import json
 import logging
 import sqlite3
 import threading
+import time
 import os
-from typing import Any, List, Dict, Optional, Tuple
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Iterator, List, Dict, Optional, Tuple
 from ..datamodel import AgentFlowSpec, AgentWorkFlowConfig, Gallery, Message, Model, Session, Skill
 from ..version import __version__ as __db_version__
+from .metrics import db_lock_wait, db_query_duration
 
 
 VERSION_TABLE_SQL = """
@@ -107,14 +115,423 @@ GALLERY_TABLE_SQL = """
             )
             """
 
+# agent turns are keyed by the msg_id of the user message that started the run (the turn_msg_id in the metadata
+# of the response), which exists before the run starts; deleting that message deletes the turns of the run
+AGENT_TURNS_TABLE_SQL = """
+            CREATE TABLE IF NOT EXISTS agent_turns (
+                user_id TEXT NOT NULL,
+                session_id TEXT,
+                msg_id TEXT NOT NULL REFERENCES messages (msg_id) ON DELETE CASCADE,
+                turn_index INTEGER NOT NULL,
+                sender TEXT,
+                recipient TEXT,
+                message TEXT,
+                timestamp DATETIME,
+                UNIQUE (msg_id, turn_index)
+            )
+            """
+
+# agent_turns as of migrate_agent_turns, before the usage column; migrations must not change with the schema
+LEGACY_AGENT_TURN_INSERT_SQL = "INSERT OR REPLACE INTO agent_turns (user_id, session_id, msg_id, turn_index, sender, recipient, message, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+AGENT_TURN_INSERT_SQL = "INSERT OR REPLACE INTO agent_turns (user_id, session_id, msg_id, turn_index, sender, recipient, message, timestamp, usage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def migrate_agent_turns(conn: sqlite3.Connection) -> None:
+    """
+    Recreate agent_turns with a foreign key to messages and split the agent history stored in the metadata of
+    existing messages into agent_turns rows. Like new turns, legacy turns are keyed by the user message that
+    started the run: the last user message of the session before the response, or the response itself if
+    there is none.
+
+    msg_id was never unique before, so duplicate msg_ids are made unique first: the oldest row keeps its msg_id
+    and the others get the msg_id suffixed with their rowid.
+
+    :param conn: The connection the migration runs on, inside a transaction
+    """
+    duplicates = conn.execute(
+        """
+        UPDATE messages SET msg_id = msg_id || '-' || rowid
+        WHERE msg_id IS NOT NULL AND rowid NOT IN (SELECT MIN(rowid) FROM messages GROUP BY msg_id)
+        """
+    ).rowcount
+    if duplicates:
+        logger.warning("Renamed %s messages with a duplicate msg_id", duplicates)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_msg_id ON messages (msg_id)")
+    conn.execute("ALTER TABLE agent_turns RENAME TO agent_turns_legacy")
+    conn.execute(AGENT_TURNS_TABLE_SQL)
+    conn.execute(
+        "INSERT INTO agent_turns SELECT * FROM agent_turns_legacy WHERE msg_id IN (SELECT msg_id FROM messages)"
+    )
+    conn.execute("DROP TABLE agent_turns_legacy")
+
+    rows = conn.execute(
+        """
+        SELECT user_id, session_id, msg_id, metadata, timestamp, rowid FROM messages
+        WHERE msg_id IS NOT NULL AND metadata LIKE ?
+        """,
+        ('%"messages"%',),
+    ).fetchall()
+    for user_id, session_id, msg_id, metadata, timestamp, rowid in rows:
+        try:
+            metadata = json.loads(metadata)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(metadata, dict) or not isinstance(metadata.get("messages"), list):
+            continue
+        turns = metadata.pop("messages")
+        run = conn.execute(
+            """
+            SELECT msg_id FROM messages
+            WHERE user_id = ? AND session_id IS ? AND role = 'user' AND msg_id IS NOT NULL
+                AND (timestamp < ? OR (timestamp = ? AND rowid < ?))
+            ORDER BY timestamp DESC, rowid DESC LIMIT 1
+            """,
+            (user_id, session_id, timestamp, timestamp, rowid),
+        ).fetchone()
+        turn_msg_id = run[0] if run is not None else msg_id
+        conn.executemany(
+            LEGACY_AGENT_TURN_INSERT_SQL,
+            [
+                agent_turn_args(user_id, session_id, turn_msg_id, turn_index, turn)[:8]
+                for turn_index, turn in enumerate(turns)
+            ],
+        )
+        metadata["turn_count"] = len(turns)
+        metadata["turn_msg_id"] = turn_msg_id
+        conn.execute("UPDATE messages SET metadata = ? WHERE msg_id = ?", (json.dumps(metadata), msg_id))
+
+
+GALLERY_SNAPSHOTS_TABLE_SQL = """
+            CREATE TABLE IF NOT EXISTS gallery_snapshots (
+                hash TEXT NOT NULL,
+                session TEXT,
+                messages TEXT,
+                UNIQUE (hash)
+            )
+            """
+
+GALLERY_TAGS_TABLE_SQL = """
+            CREATE TABLE IF NOT EXISTS gallery_tags (
+                gallery_id TEXT NOT NULL REFERENCES gallery (id) ON DELETE CASCADE,
+                tag TEXT NOT NULL,
+                UNIQUE (tag, gallery_id)
+            )
+            """
+
+# number of characters of the first message kept as the title of a gallery item
+GALLERY_TITLE_LENGTH = 200
+
+
+def gallery_snapshot(session: Dict[str, Any], messages: List[Dict[str, Any]]) -> Tuple[str, str, str]:
+    """
+    Serialize a published session and compute its content address.
+
+    :param session: The session as a dictionary
+    :param messages: The session messages as dictionaries
+    :return: A tuple of (hash, session JSON, messages JSON)
+    """
+    session_json = json.dumps(session, sort_keys=True)
+    messages_json = json.dumps(messages, sort_keys=True)
+    snapshot_hash = hashlib.sha256((session_json + "\n" + messages_json).encode("utf-8")).hexdigest()
+    return snapshot_hash, session_json, messages_json
+
+
+def gallery_title(messages: List[Dict[str, Any]]) -> str:
+    """
+    Return the title of a gallery item: the beginning of its first message.
+    """
+    return (messages[0].get("content") or "")[:GALLERY_TITLE_LENGTH] if messages else ""
+
+
+def migrate_gallery_snapshots(conn: sqlite3.Connection) -> None:
+    """
+    Move the session and messages of existing gallery items into content-addressed snapshots, add the listing
+    columns and fill the tags table.
+
+    :param conn: The connection the migration runs on, inside a transaction
+    """
+    conn.execute(GALLERY_SNAPSHOTS_TABLE_SQL)
+    conn.execute(GALLERY_TAGS_TABLE_SQL)
+    conn.execute("ALTER TABLE gallery ADD COLUMN snapshot_hash TEXT")
+    conn.execute("ALTER TABLE gallery ADD COLUMN title TEXT")
+    conn.execute("ALTER TABLE gallery ADD COLUMN message_count INTEGER DEFAULT 0")
+
+    rows = conn.execute("SELECT id, session, messages, tags FROM gallery").fetchall()
+    for gallery_id, session, messages, tags in rows:
+        session = json.loads(session) if session else {}
+        messages = json.loads(messages) if messages else []
+        tags = json.loads(tags) if tags else []
+        snapshot_hash, session_json, messages_json = gallery_snapshot(session, messages)
+        conn.execute(
+            "INSERT OR IGNORE INTO gallery_snapshots (hash, session, messages) VALUES (?, ?, ?)",
+            (snapshot_hash, session_json, messages_json),
+        )
+        conn.execute(
+            "UPDATE gallery SET snapshot_hash = ?, title = ?, message_count = ?, session = NULL, messages = NULL WHERE id = ?",
+            (snapshot_hash, gallery_title(messages), len(messages), gallery_id),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO gallery_tags (gallery_id, tag) VALUES (?, ?)", [(gallery_id, tag) for tag in tags]
+        )
+
+
+CATALOG_VERSIONS_TABLE_SQL = """
+            CREATE TABLE IF NOT EXISTS catalog_versions (
+                catalog TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (catalog, user_id)
+            )
+            """
+
+SESSION_SUMMARIES_TABLE_SQL = """
+            CREATE TABLE IF NOT EXISTS session_summaries (
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                until_timestamp DATETIME NOT NULL,
+                until_msg_id TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                tokens INTEGER,
+                timestamp DATETIME NOT NULL,
+                UNIQUE (user_id, session_id)
+            )
+            """
+
+# catalog tables, with the columns stored as JSON
+CATALOG_JSON_COLUMNS = {
+    "models": (),
+    "skills": (),
+    "agents": ("config", "skills"),
+    "workflows": ("sender", "receiver", "parallel_config"),
+}
+
+# Schema migrations, applied in order by DBManager.run_migrations. Each entry upgrades the schema by one version
+# (tracked with PRAGMA user_version) and is either a list of SQL statements or a callable taking the connection.
+MIGRATIONS = [
+    # indexes matching the filters and ORDER BY clauses of the listing queries
+    [
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_session_timestamp ON messages (user_id, session_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user_timestamp ON sessions (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_models_user_timestamp ON models (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_skills_user_timestamp ON skills (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_agents_user_timestamp ON agents (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_workflows_user_timestamp ON workflows (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_gallery_timestamp ON gallery (timestamp)",
+    ],
+    # include the id tie-breaker used by keyset pagination so pages are served straight from the index
+    [
+        "DROP INDEX IF EXISTS idx_messages_user_session_timestamp",
+        "DROP INDEX IF EXISTS idx_sessions_user_timestamp",
+        "DROP INDEX IF EXISTS idx_gallery_timestamp",
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_session_timestamp ON messages (user_id, session_id, timestamp, msg_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user_timestamp ON sessions (user_id, timestamp, id)",
+        "CREATE INDEX IF NOT EXISTS idx_gallery_timestamp ON gallery (timestamp, id)",
+    ],
+    # per-workflow opt-in to the studio completion cache
+    [
+        "ALTER TABLE workflows ADD COLUMN response_cache INTEGER DEFAULT 0",
+    ],
+    # intermediate agent turns, keyed by the user message that started the run
+    [
+        """
+            CREATE TABLE IF NOT EXISTS agent_turns (
+                user_id TEXT NOT NULL,
+                session_id TEXT,
+                msg_id TEXT NOT NULL,
+                turn_index INTEGER NOT NULL,
+                sender TEXT,
+                recipient TEXT,
+                message TEXT,
+                timestamp DATETIME,
+                UNIQUE (msg_id, turn_index)
+            )
+            """,
+    ],
+    # agent turns reference their message and move out of the messages.metadata blobs
+    migrate_agent_turns,
+    # gallery items reference content-addressed snapshots, tags are searchable through gallery_tags
+    migrate_gallery_snapshots,
+    # catalog versions, bumped by triggers on every write and used as catalog etags
+    [CATALOG_VERSIONS_TABLE_SQL]
+    + [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            INSERT INTO catalog_versions (catalog, user_id, version) VALUES ('{table}', {row}.user_id, 1)
+            ON CONFLICT (catalog, user_id) DO UPDATE SET version = version + 1;
+        END
+        """
+        for table in CATALOG_JSON_COLUMNS
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+    ],
+    # branches of parallel workflows
+    [
+        "ALTER TABLE workflows ADD COLUMN parallel_config TEXT",
+    ],
+    # rolling summaries of the compacted part of long sessions
+    [SESSION_SUMMARIES_TABLE_SQL],
+    # tokens, latencies and cache hits of each agent turn, see utils.usage
+    [
+        "ALTER TABLE agent_turns ADD COLUMN usage TEXT",
+    ],
+]
 
-lock = threading.Lock()
 logger = logging.getLogger()
 
 
+# statements that only read and can run on a per-thread reader connection without taking the write lock
+READ_STATEMENTS = {"SELECT", "WITH", "EXPLAIN"}
+
+
+class WriteBehindQueue:
+    """
+    Buffers write statements of a DBManager and writes them in batches: pending rows are written with executemany
+    in a single transaction once max_batch_size rows are queued or flush_interval seconds have passed.
+    """
+
+    def __init__(self, dbmanager: "DBManager", max_batch_size: int = 100, flush_interval: float = 0.5) -> None:
+        """
+        Args:
+            dbmanager (DBManager): The database manager whose writer connection is used.
+            max_batch_size (int): The number of queued rows that triggers a flush.
+            flush_interval (float): The maximum number of seconds a row stays queued.
+        """
+        self.dbmanager = dbmanager
+        self.max_batch_size = max(1, max_batch_size)
+        self.flush_interval = flush_interval
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+        self._pending: List[Tuple[str, Tuple]] = []
+        # number of queued rows per scope (the session of a message or agent turn)
+        self._scopes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # held while a batch is taken and written, so a flush returns only once earlier writes are committed
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="autogenstudio-db-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of queued rows.
+        """
+        return len(self._pending)
+
+    def put(self, query: str, args: Tuple, scope: Optional[str] = None) -> None:
+        """
+        Queue a write statement.
+
+        Args:
+            query (str): The SQL statement.
+            args (Tuple): The arguments of the statement.
+            scope (str): An optional scope of the row, see has_pending.
+        """
+        with self._lock:
+            self._pending.append((query, args))
+            if scope is not None:
+                self._scopes[scope] = self._scopes.get(scope, 0) + 1
+            if len(self._pending) >= self.max_batch_size:
+                self._wakeup.set()
+
+    def has_pending(self, scope: Optional[str] = None) -> bool:
+        """
+        Return True if rows are queued, or rows of the given scope if one is given.
+        """
+        with self._lock:
+            return scope in self._scopes if scope is not None else bool(self._pending)
+
+    def flush(self) -> int:
+        """
+        Write all queued rows in one transaction. If the batch fails, rows are retried one by one so that a
+        single bad row does not drop the others.
+
+        Returns:
+            int: The number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._scopes = {}
+            if not batch:
+                return 0
+            # group consecutive rows of the same statement, keeping the queue order
+            groups: List[Tuple[str, List[Tuple]]] = []
+            for query, args in batch:
+                if groups and groups[-1][0] == query:
+                    groups[-1][1].append(args)
+                else:
+                    groups.append((query, [args]))
+
+            conn = self.dbmanager.conn
+            start_time = time.perf_counter()
+            with self.dbmanager.write_lock("flush"):
+                try:
+                    conn.execute("BEGIN")
+                    for query, rows in groups:
+                        conn.executemany(query, rows)
+                    conn.commit()
+                    written = len(batch)
+                except Exception as e:
+                    conn.rollback()
+                    logger.error("Error writing batch of %s rows, retrying row by row: %s", len(batch), e)
+                    written = 0
+                    for query, args in batch:
+                        try:
+                            conn.execute(query, args)
+                            conn.commit()
+                            written += 1
+                        except Exception as row_error:
+                            conn.rollback()
+                            self.errors += 1
+                            logger.error("Error running query with query %s and args %s: %s", query, args, row_error)
+            db_query_duration.observe(time.perf_counter() - start_time, statement="BATCH")
+            self.batches += 1
+            self.rows += written
+            return written
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing write-behind queue: %s", e)
+
+    def close(self) -> None:
+        """
+        Stop the background writer and flush the remaining rows.
+        """
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return batch counters and the queue depth.
+        """
+        return {
+            "pending": self.pending,
+            "batches": self.batches,
+            "rows": self.rows,
+            "errors": self.errors,
+            "max_batch_size": self.max_batch_size,
+            "flush_interval": self.flush_interval,
+        }
+
+
 class DBManager:
     """
     A database manager class that handles the creation and interaction with an SQLite database.
+
+    The database runs in WAL mode. Reads use a connection per thread and run concurrently without locking, while
+    writes go through a single writer connection, are serialized by a write lock and committed immediately.
     """
 
     def __init__(self, path: str = "database.sqlite", **kwargs: Any) -> None:
@@ -127,34 +544,101 @@ class DBManager:
         """
 
         self.path = path
+        self.connect_kwargs = kwargs
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.write_queue: Optional[WriteBehindQueue] = None
         # check if the database exists, if not create it
         # self.reset_db()
         if not os.path.exists(self.path):
             logger.info("Creating database")
             self.init_db(path=self.path, **kwargs)
+        else:
+            try:
+                self.conn = self.connect()
+                self.cursor = self.conn.cursor()
+            except Exception as e:
+                logger.error("Error connecting to database: %s", e)
+                raise e
+        self.run_migrations()
+
+    def connect(self, path: Optional[str] = None, **kwargs: Any) -> sqlite3.Connection:
+        """
+        Open a new connection to the database with WAL journaling enabled.
 
-        try:
-            self.conn = sqlite3.connect(self.path, check_same_thread=False, **kwargs)
-            self.cursor = self.conn.cursor()
-        except Exception as e:
-            logger.error("Error connecting to database: %s", e)
-            raise e
+        Args:
+            path (str): The file path to the SQLite database file. Defaults to the manager path.
+            **kwargs: Additional keyword arguments to pass to the sqlite3.connect method.
+
+        Returns:
+            sqlite3.Connection: The new connection.
+        """
+        conn = sqlite3.connect(path or self.path, check_same_thread=False, **(kwargs or self.connect_kwargs))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        """
+        Return the reader connection of the current thread, opening it on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def write_lock(self, operation: str) -> Iterator[None]:
+        """
+        Hold the write lock, recording the time spent waiting for it.
+
+        Args:
+            operation (str): The operation that takes the lock, used as metrics label.
+        """
+        start_time = time.perf_counter()
+        with self._write_lock:
+            db_lock_wait.observe(time.perf_counter() - start_time, operation=operation)
+            yield
 
     def reset_db(self):
         """
         Reset the database by deleting the database file and creating a new one.
         """
         print("resetting db")
+        self.close()
         if os.path.exists(self.path):
             os.remove(self.path)
         self.init_db(path=self.path)
 
     def run_migrations(self):
         """
-        Run migrations to update the database schema.
+        Run migrations to update the database schema. Migrations newer than the schema version stored in
+        PRAGMA user_version are applied in order, each in its own transaction.
         """
-
-        pass
+        with self._write_lock:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            for target_version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logger.info("Migrating database schema to version %s", target_version)
+                try:
+                    self.conn.execute("BEGIN")
+                    if callable(migration):
+                        migration(self.conn)
+                    else:
+                        for statement in migration:
+                            self.conn.execute(statement)
+                    self.conn.execute(f"PRAGMA user_version = {target_version}")
+                    self.conn.commit()
+                except Exception as e:
+                    self.conn.rollback()
+                    logger.error("Error migrating database schema to version %s: %s", target_version, e)
+                    raise e
 
     def init_db(self, path: str = "database.sqlite", **kwargs: Any) -> None:
         """
@@ -165,9 +649,8 @@ class DBManager:
             **kwargs: Additional keyword arguments to pass to the sqlite3.connect method.
         """
         # Connect to the database (or create a new one if it doesn't exist)
-        self.conn = sqlite3.connect(path, check_same_thread=False, **kwargs)
+        self.conn = self.connect(path, **kwargs)
         self.cursor = self.conn.cursor()
-
         # Create the version table
         self.cursor.execute(VERSION_TABLE_SQL)
         self.cursor.execute("INSERT INTO version (version) VALUES (?)", (__db_version__,))
@@ -262,7 +745,8 @@ class DBManager:
 
     def query(self, query: str, args: Tuple = (), return_json: bool = False) -> List[Dict[str, Any]]:
         """
-        Executes a given SQL query and returns the results.
+        Executes a given SQL query and returns the results. Reads run on the reader connection of the
+        current thread; writes are serialized on the writer connection and committed.
 
         Args:
             query (str): The SQL query to execute.
@@ -273,28 +757,124 @@ class DBManager:
             List[Dict[str, Any]]: The result of the SQL query.
         """
         try:
-            with lock:
-                self.cursor.execute(query, args)
-                result = self.cursor.fetchall()
-                self.commit()
-                if return_json:
-                    result = [dict(zip([key[0] for key in self.cursor.description], row)) for row in result]
-                return result
+            statement = query.lstrip().split(None, 1)[0].upper()
+            if statement not in READ_STATEMENTS:
+                # queued writes go first, so writes apply in order; reads that must see queued rows call flush_writes
+                self.flush_writes()
+            start_time = time.perf_counter()
+            if statement in READ_STATEMENTS:
+                cursor = self.reader().execute(query, args)
+                result = cursor.fetchall()
+            else:
+                with self.write_lock("query"):
+                    cursor = self.conn.execute(query, args)
+                    result = cursor.fetchall()
+                    self.conn.commit()
+            db_query_duration.observe(time.perf_counter() - start_time, statement=statement)
+            if return_json:
+                result = [dict(zip([key[0] for key in cursor.description], row)) for row in result]
+            return result
         except Exception as e:
             logger.error("Error running query with query %s and args %s: %s", query, args, e)
             raise e
 
+    async def aquery(self, query: str, args: Tuple = (), return_json: bool = False) -> List[Dict[str, Any]]:
+        """
+        Asynchronous variant of query. The statement runs on a thread of the default executor, so the event loop
+        is not blocked while a write waits for the write lock or the disk.
+
+        Args:
+            query (str): The SQL query to execute.
+            args (Tuple): The arguments to pass to the SQL query.
+            return_json (bool): If True, the results will be returned as a list of dictionaries.
+
+        Returns:
+            List[Dict[str, Any]]: The result of the SQL query.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.query, query, args, return_json))
+
+    def start_write_behind(self, max_batch_size: int = 100, flush_interval: float = 0.5) -> None:
+        """
+        Queue writes made with enqueue and write them in batches from a background thread.
+
+        Args:
+            max_batch_size (int): The number of queued rows that triggers a flush.
+            flush_interval (float): The maximum number of seconds a row stays queued.
+        """
+        if self.write_queue is None:
+            self.write_queue = WriteBehindQueue(self, max_batch_size=max_batch_size, flush_interval=flush_interval)
+
+    def stop_write_behind(self) -> None:
+        """
+        Flush queued writes and stop the background writer. Later writes are executed immediately.
+        """
+        if self.write_queue is not None:
+            write_queue, self.write_queue = self.write_queue, None
+            write_queue.close()
+
+    def enqueue(self, query: str, args: Tuple = (), scope: Optional[str] = None) -> None:
+        """
+        Run a write statement through the write-behind queue if it is enabled, or immediately otherwise.
+
+        Args:
+            query (str): The SQL statement.
+            args (Tuple): The arguments of the statement.
+            scope (str): An optional scope of the row (a session id), used by flush_writes.
+        """
+        if self.write_queue is not None:
+            self.write_queue.put(query, args, scope=scope)
+        else:
+            self.query(query=query, args=args)
+
+    def flush_writes(self, scope: Optional[str] = None) -> None:
+        """
+        Write the queued rows now, if there are any, or any of the given scope. Called by writes, which apply in
+        queue order, and by the reads that must see rows queued before them, e.g. the messages of a session.
+
+        Args:
+            scope (str): If given, only flush when rows of this scope are queued.
+        """
+        write_queue = self.write_queue
+        if write_queue is not None and write_queue.has_pending(scope):
+            write_queue.flush()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run several statements on the writer connection in one transaction, holding the write lock. The
+        transaction is committed when the block exits and rolled back if it raises.
+
+        Yields:
+            sqlite3.Connection: The writer connection.
+        """
+        self.flush_writes()
+        with self.write_lock("transaction"):
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
     def commit(self) -> None:
         """
-        Commits the current transaction Modelto the database.
+        Commits the current transaction to the database.
         """
-        self.conn.commit()
+        with self.write_lock("commit"):
+            self.conn.commit()
 
     def close(self) -> None:
         """
-        Closes the database connection.
+        Closes all database connections.
         """
-        self.conn.close()
+        self.stop_write_behind()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
 
 
 def get_models(user_id: str, dbmanager: DBManager) -> List[dict]:
@@ -311,7 +891,7 @@ def get_models(user_id: str, dbmanager: DBManager) -> List[dict]:
     query = "SELECT * FROM models WHERE user_id = ? OR user_id = ?"
     args = (user_id, "default")
     results = dbmanager.query(query, args, return_json=True)
-    return results
+    return shadow_defaults(results, user_id)
 
 
 def upsert_model(model: Model, dbmanager: DBManager) -> List[dict]:
@@ -325,45 +905,8 @@ def upsert_model(model: Model, dbmanager: DBManager) -> List[dict]:
     Returns:
         A list  of model configurations
     """
-
-    # Check if the model config with the provided id already exists in the database
-    existing_model = get_item_by_field("models", "id", model.id, dbmanager)
-
-    if existing_model:
-        # If the model config exists, update it with the new data
-        updated_data = {
-            "model": model.model,
-            "api_key": model.api_key,
-            "base_url": model.base_url,
-            "api_type": model.api_type,
-            "api_version": model.api_version,
-            "user_id": model.user_id,
-            "timestamp": model.timestamp,
-            "description": model.description,
-        }
-        update_item("models", model.id, updated_data, dbmanager)
-    else:
-        # If the model config does not exist, insert a new one
-        query = """
-            INSERT INTO models (id, user_id, timestamp, model, api_key, base_url, api_type, api_version, description)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        args = (
-            model.id,
-            model.user_id,
-            model.timestamp,
-            model.model,
-            model.api_key,
-            model.base_url,
-            model.api_type,
-            model.api_version,
-            model.description,
-        )
-        dbmanager.query(query=query, args=args)
-
-    # Return the inserted or updated model config
-    models = get_models(model.user_id, dbmanager)
-    return models
+    upsert_catalog_items("models", [model_row(model)], dbmanager)
+    return get_models(model.user_id, dbmanager)
 
 
 def delete_model(model: Model, dbmanager: DBManager) -> List[dict]:
@@ -387,58 +930,397 @@ def delete_model(model: Model, dbmanager: DBManager) -> List[dict]:
     return models
 
 
-def create_message(message: Message, dbmanager: DBManager) -> None:
+MESSAGE_INSERT_SQL = "INSERT INTO messages (user_id, root_msg_id, msg_id, role, content, metadata, timestamp, session_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def message_insert_args(message: Message, metadata: Optional[str] = None) -> Tuple:
     """
-    Save a message in the database using the provided database manager.
+    Return the arguments of MESSAGE_INSERT_SQL for a message.
 
     :param message: The Message object containing message data
-    :param dbmanager: The DBManager instance used to interact with the database
+    :param metadata: The metadata to store instead of message.metadata, if given
+    :return: A tuple of column values
     """
-    query = "INSERT INTO messages (user_id, root_msg_id, msg_id, role, content, metadata, timestamp, session_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
-    args = (
+    return (
         message.user_id,
         message.root_msg_id,
         message.msg_id,
         message.role,
         message.content,
-        message.metadata,
+        message.metadata if metadata is None else metadata,
         message.timestamp,
         message.session_id,
     )
-    dbmanager.query(query=query, args=args)
 
 
-def get_messages(user_id: str, session_id: str, dbmanager: DBManager) -> List[dict]:
+def create_message(message: Message, dbmanager: DBManager) -> None:
+    """
+    Save a message in the database using the provided database manager.
+
+    :param message: The Message object containing message data
+    :param dbmanager: The DBManager instance used to interact with the database
+    """
+    dbmanager.enqueue(query=MESSAGE_INSERT_SQL, args=message_insert_args(message), scope=message.session_id)
+
+
+async def acreate_message(message: Message, dbmanager: DBManager) -> None:
+    """
+    Asynchronous variant of create_message, for callers running on an event loop.
+
+    :param message: The Message object containing message data
+    :param dbmanager: The DBManager instance used to interact with the database
+    """
+    if dbmanager.write_queue is not None:
+        dbmanager.write_queue.put(MESSAGE_INSERT_SQL, message_insert_args(message), scope=message.session_id)
+    else:
+        await dbmanager.aquery(query=MESSAGE_INSERT_SQL, args=message_insert_args(message))
+
+
+def agent_turn_args(
+    user_id: str, session_id: Optional[str], msg_id: str, turn_index: int, iteration: Dict[str, Any]
+) -> Tuple:
+    """
+    Return the arguments of AGENT_TURN_INSERT_SQL for an agent turn.
+
+    :param iteration: The agent message as recorded by AutoGenWorkFlowManager.process_reply
+    :return: A tuple of column values
+    """
+    return (
+        user_id,
+        session_id,
+        msg_id,
+        turn_index,
+        iteration.get("sender"),
+        iteration.get("recipient"),
+        json.dumps(iteration.get("message"), default=str),
+        iteration.get("timestamp"),
+        json.dumps(iteration["usage"]) if iteration.get("usage") else None,
+    )
+
+
+def create_agent_turn(message: Message, turn_index: int, iteration: Dict[str, Any], dbmanager: DBManager) -> None:
+    """
+    Save an intermediate agent turn of a run while the run is in progress.
+
+    :param message: The user message that started the run
+    :param turn_index: The position of the turn in the run
+    :param iteration: The agent message as recorded by AutoGenWorkFlowManager.process_reply
+    :param dbmanager: The DBManager instance used to interact with the database
+    """
+    args = agent_turn_args(message.user_id, message.session_id, message.msg_id, turn_index, iteration)
+    dbmanager.enqueue(query=AGENT_TURN_INSERT_SQL, args=args, scope=message.session_id)
+
+
+def create_response_message(
+    response_message: Message, message: Message, dbmanager: DBManager, save_turns: bool = True
+) -> None:
+    """
+    Save the assistant response of a run. The agent history in metadata["messages"] is moved to the agent_turns
+    table, keyed by the user message that started the run, and replaced by turn_count and turn_msg_id.
+
+    :param response_message: The assistant response, with the agent history in its metadata
+    :param message: The user message that started the run
+    :param dbmanager: The DBManager instance used to interact with the database
+    :param save_turns: If False, the turns are assumed to be saved already, see create_agent_turn
+    """
+    metadata = json.loads(response_message.metadata) if response_message.metadata else {}
+    turns = metadata.pop("messages", [])
+    metadata["turn_count"] = len(turns)
+    metadata["turn_msg_id"] = message.msg_id
+    dbmanager.enqueue(
+        query=MESSAGE_INSERT_SQL,
+        args=message_insert_args(response_message, json.dumps(metadata)),
+        scope=response_message.session_id,
+    )
+    if save_turns:
+        for turn_index, iteration in enumerate(turns):
+            create_agent_turn(message, turn_index, iteration, dbmanager)
+
+
+def get_agent_turns(user_id: str, msg_id: str, dbmanager: DBManager) -> List[Dict[str, Any]]:
+    """
+    Load the agent turns of a run, in the format of AutoGenWorkFlowManager.agent_history.
+
+    :param user_id: The ID of the user the run belongs to
+    :param msg_id: The turn_msg_id of the response message
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: A list of dictionaries with sender, recipient, message, timestamp and usage
+    """
+    # the turns of a run that just finished may still be queued
+    dbmanager.flush_writes()
+    query = "SELECT sender, recipient, message, timestamp, usage FROM agent_turns WHERE msg_id = ? AND user_id = ? ORDER BY turn_index ASC"
+    rows = dbmanager.query(query=query, args=(msg_id, user_id), return_json=True)
+    for row in rows:
+        decode_agent_turn(row)
+    return rows
+
+
+def decode_agent_turn(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Decode the JSON columns of an agent_turns row. Turns without usage (e.g. saved before usage was recorded)
+    are returned without a usage key, as in agent_history.
+    """
+    row["message"] = json.loads(row["message"]) if row["message"] else None
+    usage = row.pop("usage", None)
+    if usage:
+        row["usage"] = json.loads(usage)
+    return row
+
+
+def inline_agent_turns(messages: List[dict], dbmanager: DBManager) -> List[dict]:
+    """
+    Put the agent turns of each message back into metadata["messages"], loading all turns in one query.
+
+    :param messages: Message rows as returned by get_messages
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: The messages, with their metadata decoded and turns inlined
+    """
+    turn_msg_ids = {}
+    for message in messages:
+        metadata = message.get("metadata")
+        if isinstance(metadata, str) and metadata:
+            metadata = json.loads(metadata)
+            message["metadata"] = metadata
+        if isinstance(metadata, dict) and metadata.get("turn_msg_id"):
+            turn_msg_ids.setdefault(metadata["turn_msg_id"], []).append(metadata)
+    if not turn_msg_ids:
+        return messages
+
+    placeholders = ", ".join("?" for _ in turn_msg_ids)
+    query = f"SELECT msg_id, sender, recipient, message, timestamp, usage FROM agent_turns WHERE msg_id IN ({placeholders}) ORDER BY msg_id, turn_index ASC"
+    turns: Dict[str, List[Dict[str, Any]]] = {}
+    for row in dbmanager.query(query=query, args=tuple(turn_msg_ids), return_json=True):
+        decode_agent_turn(row)
+        turns.setdefault(row.pop("msg_id"), []).append(row)
+    for turn_msg_id, metadatas in turn_msg_ids.items():
+        for metadata in metadatas:
+            metadata["messages"] = turns.get(turn_msg_id, [])
+    return messages
+
+
+def encode_cursor(timestamp: str, item_id: str) -> str:
+    """
+    Encode the (timestamp, id) position of the last row of a page as an opaque pagination cursor.
+
+    :param timestamp: The timestamp of the last row
+    :param item_id: The id of the last row
+    :return: A url-safe cursor string
+    """
+    return base64.urlsafe_b64encode(json.dumps([timestamp, item_id]).encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decode a pagination cursor created by encode_cursor.
+
+    :param cursor: The cursor string
+    :return: A (timestamp, id) tuple
+    """
+    try:
+        timestamp, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return timestamp, item_id
+
+
+def next_cursor(rows: List[dict], limit: Optional[int], id_field: str = "id") -> Optional[str]:
+    """
+    Return the cursor of the page following rows, or None if rows is the last page.
+
+    :param rows: The rows of the current page
+    :param limit: The page size used to load rows
+    :param id_field: The name of the id column used as pagination tie-breaker
+    :return: A cursor string or None
+    """
+    if not limit or len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1]["timestamp"], rows[-1][id_field])
+
+
+def get_messages(
+    user_id: str, session_id: str, dbmanager: DBManager, limit: Optional[int] = None, cursor: Optional[str] = None
+) -> List[dict]:
     """
     Load messages for a specific user and session from the database, sorted by timestamp.
 
     :param user_id: The ID of the user whose messages are to be loaded
     :param session_id: The ID of the session whose messages are to be loaded
     :param dbmanager: The DBManager instance to interact with the database
+    :param limit: The maximum number of messages to load, all messages if None
+    :param cursor: A cursor from a previous page; only messages after it are loaded
 
     :return: A list of dictionaries, each representing a message
     """
+    # the messages of the session may still be queued, see DBManager.enqueue
+    dbmanager.flush_writes(scope=session_id)
     query = "SELECT * FROM messages WHERE user_id = ? AND session_id = ?"
-    args = (user_id, session_id)
-    result = dbmanager.query(query=query, args=args, return_json=True)
-    # Sort by timestamp ascending
-    result = sorted(result, key=lambda k: k["timestamp"], reverse=False)
+    args = [user_id, session_id]
+    if cursor:
+        query += " AND (timestamp, msg_id) > (?, ?)"
+        args.extend(decode_cursor(cursor))
+    query += " ORDER BY timestamp ASC, msg_id ASC"
+    if limit:
+        query += " LIMIT ?"
+        args.append(limit)
+    result = dbmanager.query(query=query, args=tuple(args), return_json=True)
     return result
 
 
-def get_sessions(user_id: str, dbmanager: DBManager) -> List[dict]:
+def get_session_summary(user_id: str, session_id: str, dbmanager: DBManager) -> Optional[dict]:
+    """
+    Load the rolling summary of the compacted part of a session.
+
+    :param user_id: The ID of the user the session belongs to
+    :param session_id: The ID of the session
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: The summary row, or None if the session was never compacted
+    """
+    query = "SELECT * FROM session_summaries WHERE user_id = ? AND session_id = ?"
+    rows = dbmanager.query(query=query, args=(user_id, session_id), return_json=True)
+    return rows[0] if rows else None
+
+
+def save_session_summary(
+    user_id: str,
+    session_id: str,
+    summary: str,
+    until_message: dict,
+    message_count: int,
+    tokens: int,
+    dbmanager: DBManager,
+) -> None:
+    """
+    Save the rolling summary of a session, replacing the previous one.
+
+    :param user_id: The ID of the user the session belongs to
+    :param session_id: The ID of the session
+    :param summary: The summary of all messages up to and including until_message
+    :param until_message: The last message folded into the summary
+    :param message_count: The number of messages folded into the summary
+    :param tokens: The token count of the summary
+    :param dbmanager: The DBManager instance to interact with the database
+    """
+    query = """
+        INSERT INTO session_summaries
+            (user_id, session_id, summary, until_timestamp, until_msg_id, message_count, tokens, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, session_id) DO UPDATE SET
+            summary = excluded.summary,
+            until_timestamp = excluded.until_timestamp,
+            until_msg_id = excluded.until_msg_id,
+            message_count = excluded.message_count,
+            tokens = excluded.tokens,
+            timestamp = excluded.timestamp
+    """
+    args = (
+        user_id,
+        session_id,
+        summary,
+        until_message["timestamp"],
+        until_message["msg_id"],
+        message_count,
+        tokens,
+        datetime.now().isoformat(),
+    )
+    dbmanager.query(query=query, args=args)
+
+
+def get_session_history(user_id: str, session_id: str, dbmanager: DBManager) -> List[dict]:
+    """
+    Load the history replayed to the agents for a session: the rolling summary of the compacted messages, as a
+    message with role "summary", followed by the messages after it. Without a summary, all messages.
+
+    :param user_id: The ID of the user the session belongs to
+    :param session_id: The ID of the session
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: A list of message dictionaries, oldest first
+    """
+    summary = get_session_summary(user_id, session_id, dbmanager)
+    if summary is None:
+        return get_messages(user_id=user_id, session_id=session_id, dbmanager=dbmanager)
+    cursor = encode_cursor(summary["until_timestamp"], summary["until_msg_id"])
+    messages = get_messages(user_id=user_id, session_id=session_id, dbmanager=dbmanager, cursor=cursor)
+    summary_message = {
+        "msg_id": None,
+        "user_id": user_id,
+        "session_id": session_id,
+        "role": "summary",
+        "content": summary["summary"],
+        "timestamp": summary["until_timestamp"],
+        "metadata": json.dumps({"message_count": summary["message_count"], "tokens": summary["tokens"]}),
+    }
+    return [summary_message] + messages
+
+
+def usage_columns(column: str, prefix: str = "$") -> str:
+    """
+    Return the SELECT expressions that sum the usage records stored as JSON in a column, see utils.usage.
+    """
+    sums = ["llm_calls", "prompt_tokens", "completion_tokens", "llm_latency", "code_execution_time", "cache_hits"]
+    columns = [f"COALESCE(SUM(json_extract({column}, '{prefix}.{name}')), 0) AS {name}" for name in sums]
+    columns.append(f"AVG(json_extract({column}, '{prefix}.time_to_first_token')) AS time_to_first_token")
+    return ", ".join(columns)
+
+
+def get_session_stats(user_id: str, session_id: str, dbmanager: DBManager) -> Dict[str, Any]:
+    """
+    Load the token, latency and cache usage of a session: summed over the session, per agent and per response.
+    time_to_first_token is averaged over the responses (or turns) that streamed.
+
+    :param user_id: The ID of the user the session belongs to
+    :param session_id: The ID of the session
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: A dictionary with total, agents and messages keys
+    """
+    dbmanager.flush_writes(scope=session_id)
+    query = f"""
+        SELECT COUNT(*) AS responses, COALESCE(SUM(json_extract(metadata, '$.time')), 0) AS time,
+            {usage_columns("metadata", "$.usage")}
+        FROM messages WHERE user_id = ? AND session_id = ? AND role = 'assistant'
+    """
+    total = dbmanager.query(query=query, args=(user_id, session_id), return_json=True)[0]
+
+    query = f"""
+        SELECT sender AS name, COUNT(*) AS turns, {usage_columns("usage")}
+        FROM agent_turns
+        WHERE msg_id IN (SELECT msg_id FROM messages WHERE user_id = ? AND session_id = ?)
+        GROUP BY sender ORDER BY sender
     """
-    Load sessions for a specific user from the database, sorted by timestamp.
+    agents = dbmanager.query(query=query, args=(user_id, session_id), return_json=True)
+
+    query = """
+        SELECT msg_id, timestamp, json_extract(metadata, '$.time') AS time, json_extract(metadata, '$.usage') AS usage
+        FROM messages WHERE user_id = ? AND session_id = ? AND role = 'assistant'
+        ORDER BY timestamp ASC, msg_id ASC
+    """
+    messages = dbmanager.query(query=query, args=(user_id, session_id), return_json=True)
+    for row in messages:
+        row["usage"] = json.loads(row["usage"]) if row["usage"] else None
+    return {"total": total, "agents": agents, "messages": messages}
+
+
+def get_sessions(
+    user_id: str, dbmanager: DBManager, limit: Optional[int] = None, cursor: Optional[str] = None
+) -> List[dict]:
+    """
+    Load sessions for a specific user from the database, sorted by timestamp (newest first).
 
     :param user_id: The ID of the user whose sessions are to be loaded
     :param dbmanager: The DBManager instance to interact with the database
+    :param limit: The maximum number of sessions to load, all sessions if None
+    :param cursor: A cursor from a previous page; only sessions older than it are loaded
     :return: A list of dictionaries, each representing a session
     """
     query = "SELECT * FROM sessions WHERE user_id = ?"
-    args = (user_id,)
-    result = dbmanager.query(query=query, args=args, return_json=True)
-    # Sort by timestamp ascending
-    result = sorted(result, key=lambda k: k["timestamp"], reverse=True)
+    args = [user_id]
+    if cursor:
+        query += " AND (timestamp, id) < (?, ?)"
+        args.extend(decode_cursor(cursor))
+    query += " ORDER BY timestamp DESC, id DESC"
+    if limit:
+        query += " LIMIT ?"
+        args.append(limit)
+    result = dbmanager.query(query=query, args=tuple(args), return_json=True)
     for row in result:
         row["flow_config"] = json.loads(row["flow_config"])
     return result
@@ -477,12 +1359,17 @@ def delete_session(session: Session, dbmanager: DBManager) -> List[dict]:
     args = (session.id,)
     dbmanager.query(query=query, args=args)
 
+    query = "DELETE FROM session_summaries WHERE session_id = ?"
+    dbmanager.query(query=query, args=args)
+
     return get_sessions(user_id=session.user_id, dbmanager=dbmanager)
 
 
 def create_gallery(session: Session, dbmanager: DBManager, tags: List[str] = []) -> Gallery:
     """
-    Publish a session to the gallery table in the database. Fetches the session messages first, then saves session and messages object to the gallery database table.
+    Publish a session to the gallery table in the database. The session and its messages are stored once as a
+    content-addressed snapshot, shared by gallery items publishing the same content, and the gallery row only
+    keeps the listing fields and a reference to the snapshot.
     :param session: The Session object containing session data
     :param dbmanager: The DBManager instance used to interact with the database
     :param tags: A list of tags to associate with the session
@@ -490,48 +1377,88 @@ def create_gallery(session: Session, dbmanager: DBManager, tags: List[str] = [])
     """
 
     messages = get_messages(user_id=session.user_id, session_id=session.id, dbmanager=dbmanager)
+    # gallery items are self-contained snapshots, so they keep the agent turns inline
+    messages = inline_agent_turns(messages, dbmanager)
+    for message in messages:
+        if isinstance(message.get("metadata"), dict):
+            message["metadata"] = json.dumps(message["metadata"])
     gallery_item = Gallery(session=session, messages=messages, tags=tags)
-    query = "INSERT INTO gallery (id, session, messages, tags, timestamp) VALUES (?, ?, ?, ?,?)"
+    message_dicts = [message.dict() for message in gallery_item.messages]
+    snapshot_hash, session_json, messages_json = gallery_snapshot(gallery_item.session.dict(), message_dicts)
+    dbmanager.query(
+        query="INSERT OR IGNORE INTO gallery_snapshots (hash, session, messages) VALUES (?, ?, ?)",
+        args=(snapshot_hash, session_json, messages_json),
+    )
+    query = "INSERT INTO gallery (id, tags, timestamp, snapshot_hash, title, message_count) VALUES (?, ?, ?, ?, ?, ?)"
     args = (
         gallery_item.id,
-        json.dumps(gallery_item.session.dict()),
-        json.dumps([message.dict() for message in gallery_item.messages]),
         json.dumps(gallery_item.tags),
         gallery_item.timestamp,
+        snapshot_hash,
+        gallery_title(message_dicts),
+        len(message_dicts),
     )
     dbmanager.query(query=query, args=args)
+    for tag in set(gallery_item.tags or []):
+        dbmanager.query(
+            query="INSERT OR IGNORE INTO gallery_tags (gallery_id, tag) VALUES (?, ?)", args=(gallery_item.id, tag)
+        )
     return gallery_item
 
 
-def get_gallery(gallery_id, dbmanager: DBManager) -> List[Gallery]:
+def get_gallery(
+    gallery_id,
+    dbmanager: DBManager,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    tag: Optional[str] = None,
+) -> List[dict]:
     """
-    Load gallery items from the database, sorted by timestamp. If gallery_id is provided, only the gallery item with the matching gallery_id will be returned.
+    Load gallery items from the database, sorted by timestamp (newest first). If gallery_id is provided, only the
+    gallery item with the matching gallery_id is returned, with its session and messages. Otherwise a listing
+    projection (id, tags, title, timestamp, message_count) is returned, without loading the snapshots.
 
     :param gallery_id: The ID of the gallery item to be loaded
     :param dbmanager: The DBManager instance to interact with the database
-    :return: A list of Gallery objects
+    :param limit: The maximum number of gallery items to load, all items if None
+    :param cursor: A cursor from a previous page; only items older than it are loaded
+    :param tag: Only list gallery items with this tag
+    :return: A list of dictionaries, each representing a gallery item
     """
 
     if gallery_id:
-        query = "SELECT * FROM gallery WHERE id = ?"
-        args = (gallery_id,)
-    else:
-        query = "SELECT * FROM gallery"
-        args = ()
-    result = dbmanager.query(query=query, args=args, return_json=True)
-    # Sort by timestamp ascending
-    result = sorted(result, key=lambda k: k["timestamp"], reverse=True)
-    gallery = []
+        query = """
+            SELECT gallery.id, gallery.tags, gallery.timestamp, gallery.title, gallery.message_count,
+                gallery_snapshots.session, gallery_snapshots.messages
+            FROM gallery LEFT JOIN gallery_snapshots ON gallery_snapshots.hash = gallery.snapshot_hash
+            WHERE gallery.id = ?
+            """
+        result = dbmanager.query(query=query, args=(gallery_id,), return_json=True)
+        for row in result:
+            row["session"] = json.loads(row["session"]) if row["session"] else None
+            row["messages"] = json.loads(row["messages"]) if row["messages"] else []
+            row["tags"] = json.loads(row["tags"]) if row["tags"] else []
+        return result
+
+    query = "SELECT id, tags, timestamp, title, message_count FROM gallery"
+    conditions = []
+    args = []
+    if tag:
+        conditions.append("id IN (SELECT gallery_id FROM gallery_tags WHERE tag = ?)")
+        args.append(tag)
+    if cursor:
+        conditions.append("(timestamp, id) < (?, ?)")
+        args.extend(decode_cursor(cursor))
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp DESC, id DESC"
+    if limit:
+        query += " LIMIT ?"
+        args.append(limit)
+    result = dbmanager.query(query=query, args=tuple(args), return_json=True)
     for row in result:
-        gallery_item = Gallery(
-            id=row["id"],
-            session=Session(**json.loads(row["session"])),
-            messages=[Message(**message) for message in json.loads(row["messages"])],
-            tags=json.loads(row["tags"]),
-            timestamp=row["timestamp"],
-        )
-        gallery.append(gallery_item)
-    return gallery
+        row["tags"] = json.loads(row["tags"]) if row["tags"] else []
+    return result
 
 
 def get_skills(user_id: str, dbmanager: DBManager) -> List[Skill]:
@@ -543,49 +1470,25 @@ def get_skills(user_id: str, dbmanager: DBManager) -> List[Skill]:
     :return: A list of Skill objects
     """
 
-    query = "SELECT * FROM skills WHERE user_id = ? OR user_id = ?"
+    query = "SELECT * FROM skills WHERE user_id IN (?, ?) ORDER BY timestamp DESC"
     args = (user_id, "default")
-    result = dbmanager.query(query=query, args=args, return_json=True)
-    # Sort by timestamp ascending
-    result = sorted(result, key=lambda k: k["timestamp"], reverse=True)
-    skills = []
-    for row in result:
-        skill = Skill(**row)
-        skills.append(skill)
-    return skills
+    result = shadow_defaults(dbmanager.query(query=query, args=args, return_json=True), user_id)
+    return [parse_catalog_row("skills", row) for row in result]
 
 
 def upsert_skill(skill: Skill, dbmanager: DBManager) -> List[Skill]:
     """
     Insert or update a skill for a specific user in the database.
 
-    If the skill with the given ID already exists, it will be updated with the new data.
+    If the skill with the given ID already exists for the user, it will be updated with the new data.
     Otherwise, a new skill will be created.
 
     :param  skill: The Skill object containing skill data
     :param dbmanager: The DBManager instance to interact with the database
     :return: A list of dictionaries, each representing a skill
     """
-
-    existing_skill = get_item_by_field("skills", "id", skill.id, dbmanager)
-
-    if existing_skill:
-        updated_data = {
-            "user_id": skill.user_id,
-            "timestamp": skill.timestamp,
-            "content": skill.content,
-            "title": skill.title,
-            "file_name": skill.file_name,
-        }
-        update_item("skills", skill.id, updated_data, dbmanager)
-    else:
-        query = "INSERT INTO skills (id, user_id, timestamp, content, title, file_name) VALUES (?, ?, ?, ?, ?, ?)"
-        args = (skill.id, skill.user_id, skill.timestamp, skill.content, skill.title, skill.file_name)
-        dbmanager.query(query=query, args=args)
-
-    skills = get_skills(user_id=skill.user_id, dbmanager=dbmanager)
-
-    return skills
+    upsert_catalog_items("skills", [skill_row(skill)], dbmanager)
+    return get_skills(user_id=skill.user_id, dbmanager=dbmanager)
 
 
 def delete_skill(skill: Skill, dbmanager: DBManager) -> List[Skill]:
@@ -622,11 +1525,23 @@ def delete_message(
         query = "DELETE FROM messages WHERE user_id = ? AND session_id = ?"
         args = (user_id, session_id)
         dbmanager.query(query=query, args=args)
+        query = "DELETE FROM session_summaries WHERE user_id = ? AND session_id = ?"
+        dbmanager.query(query=query, args=args)
         return []
     else:
-        query = "DELETE FROM messages WHERE user_id = ? AND msg_id = ? AND session_id = ?"
         args = (user_id, msg_id, session_id)
-        dbmanager.query(query=query, args=args)
+        with dbmanager.transaction() as conn:
+            # the turns of a response are keyed by its turn_msg_id, they go with the response too
+            conn.execute(
+                """
+                DELETE FROM agent_turns WHERE msg_id IN (
+                    SELECT json_extract(metadata, '$.turn_msg_id') FROM messages
+                    WHERE user_id = ? AND msg_id = ? AND session_id = ? AND json_valid(metadata)
+                )
+                """,
+                args,
+            )
+            conn.execute("DELETE FROM messages WHERE user_id = ? AND msg_id = ? AND session_id = ?", args)
         messages = get_messages(user_id=user_id, session_id=session_id, dbmanager=dbmanager)
         return messages
 
@@ -640,60 +1555,25 @@ def get_agents(user_id: str, dbmanager: DBManager) -> List[AgentFlowSpec]:
     :return: A list of AgentFlowSpec objects
     """
 
-    query = "SELECT * FROM agents WHERE user_id = ? OR user_id = ?"
+    query = "SELECT * FROM agents WHERE user_id IN (?, ?) ORDER BY timestamp DESC"
     args = (user_id, "default")
-    result = dbmanager.query(query=query, args=args, return_json=True)
-    # Sort by timestamp ascending
-    result = sorted(result, key=lambda k: k["timestamp"], reverse=True)
-    agents = []
-    for row in result:
-        row["config"] = json.loads(row["config"])
-        row["skills"] = json.loads(row["skills"] or "[]")
-        agent = AgentFlowSpec(**row)
-        agents.append(agent)
-    return agents
+    result = shadow_defaults(dbmanager.query(query=query, args=args, return_json=True), user_id)
+    return [parse_catalog_row("agents", row) for row in result]
 
 
 def upsert_agent(agent_flow_spec: AgentFlowSpec, dbmanager: DBManager) -> List[Dict[str, Any]]:
     """
     Insert or update an agent for a specific user in the database.
 
-    If the agent with the given ID already exists, it will be updated with the new data.
+    If the agent with the given ID already exists for the user, it will be updated with the new data.
     Otherwise, a new agent will be created.
 
     :param agent_flow_spec: The AgentFlowSpec object containing agent configuration
     :param dbmanager: The DBManager instance to interact with the database
     :return: A list of dictionaries, each representing an agent after insertion or update
     """
-
-    existing_agent = get_item_by_field("agents", "id", agent_flow_spec.id, dbmanager)
-
-    if existing_agent:
-        updated_data = {
-            "user_id": agent_flow_spec.user_id,
-            "timestamp": agent_flow_spec.timestamp,
-            "config": json.dumps(agent_flow_spec.config.dict()),
-            "type": agent_flow_spec.type,
-            "description": agent_flow_spec.description,
-            "skills": json.dumps([x.dict() for x in agent_flow_spec.skills] if agent_flow_spec.skills else []),
-        }
-        update_item("agents", agent_flow_spec.id, updated_data, dbmanager)
-    else:
-        query = "INSERT INTO agents (id, user_id, timestamp, config, type, description, skills) VALUES (?, ?, ?, ?, ?, ?, ?)"
-        config_json = json.dumps(agent_flow_spec.config.dict())
-        args = (
-            agent_flow_spec.id,
-            agent_flow_spec.user_id,
-            agent_flow_spec.timestamp,
-            config_json,
-            agent_flow_spec.type,
-            agent_flow_spec.description,
-            json.dumps([x.dict() for x in agent_flow_spec.skills] if agent_flow_spec.skills else []),
-        )
-        dbmanager.query(query=query, args=args)
-
-    agents = get_agents(user_id=agent_flow_spec.user_id, dbmanager=dbmanager)
-    return agents
+    upsert_catalog_items("agents", [agent_row(agent_flow_spec)], dbmanager)
+    return get_agents(user_id=agent_flow_spec.user_id, dbmanager=dbmanager)
 
 
 def delete_agent(agent: AgentFlowSpec, dbmanager: DBManager) -> List[Dict[str, Any]]:
@@ -713,18 +1593,204 @@ def delete_agent(agent: AgentFlowSpec, dbmanager: DBManager) -> List[Dict[str, A
     return get_agents(user_id=agent.user_id, dbmanager=dbmanager)
 
 
-def get_item_by_field(table: str, field: str, value: Any, dbmanager: DBManager) -> Optional[Dict[str, Any]]:
-    query = f"SELECT * FROM {table} WHERE {field} = ?"
-    args = (value,)
-    result = dbmanager.query(query=query, args=args)
-    return result[0] if result else None
+def model_row(model: Model) -> Dict[str, Any]:
+    """
+    Return the models table columns of a model.
+    """
+    return {
+        "id": model.id,
+        "user_id": model.user_id,
+        "timestamp": model.timestamp,
+        "model": model.model,
+        "api_key": model.api_key,
+        "base_url": model.base_url,
+        "api_type": model.api_type,
+        "api_version": model.api_version,
+        "description": model.description,
+    }
+
+
+def skill_row(skill: Skill) -> Dict[str, Any]:
+    """
+    Return the skills table columns of a skill.
+    """
+    return {
+        "id": skill.id,
+        "user_id": skill.user_id,
+        "timestamp": skill.timestamp,
+        "content": skill.content,
+        "title": skill.title,
+        "file_name": skill.file_name,
+    }
 
 
-def update_item(table: str, item_id: str, updated_data: Dict[str, Any], dbmanager: DBManager) -> None:
-    set_clause = ", ".join([f"{key} = ?" for key in updated_data.keys()])
-    query = f"UPDATE {table} SET {set_clause} WHERE id = ?"
-    args = (*updated_data.values(), item_id)
-    dbmanager.query(query=query, args=args)
+def agent_row(agent_flow_spec: AgentFlowSpec) -> Dict[str, Any]:
+    """
+    Return the agents table columns of an agent.
+    """
+    return {
+        "id": agent_flow_spec.id,
+        "user_id": agent_flow_spec.user_id,
+        "timestamp": agent_flow_spec.timestamp,
+        "config": json.dumps(agent_flow_spec.config.dict()),
+        "type": agent_flow_spec.type,
+        "description": agent_flow_spec.description,
+        "skills": json.dumps([x.dict() for x in agent_flow_spec.skills] if agent_flow_spec.skills else []),
+    }
+
+
+def workflow_row(workflow: AgentWorkFlowConfig) -> Dict[str, Any]:
+    """
+    Return the workflows table columns of a workflow.
+    """
+    return {
+        "id": workflow.id,
+        "user_id": workflow.user_id,
+        "timestamp": workflow.timestamp,
+        "sender": json.dumps(workflow.sender.dict()),
+        "receiver": json.dumps(
+            [receiver.dict() for receiver in workflow.receiver]
+            if isinstance(workflow.receiver, list)
+            else workflow.receiver.dict()
+        ),
+        "type": workflow.type,
+        "name": workflow.name,
+        "description": workflow.description,
+        "summary_method": workflow.summary_method,
+        "response_cache": workflow.response_cache,
+        "parallel_config": json.dumps(workflow.parallel_config.dict()) if workflow.parallel_config else None,
+    }
+
+
+CATALOG_ROW_BUILDERS = {
+    "models": model_row,
+    "skills": skill_row,
+    "agents": agent_row,
+    "workflows": workflow_row,
+}
+
+
+def catalog_row(catalog: str, item: Any) -> Dict[str, Any]:
+    """
+    Return the table columns of a models, skills, agents or workflows catalog item.
+    """
+    if catalog not in CATALOG_ROW_BUILDERS:
+        raise ValueError(f"Unknown catalog: {catalog}")
+    return CATALOG_ROW_BUILDERS[catalog](item)
+
+
+def decode_catalog_row(catalog: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Decode the JSON columns of a catalog row.
+    """
+    for column in CATALOG_JSON_COLUMNS[catalog]:
+        if isinstance(row.get(column), str):
+            row[column] = json.loads(row[column])
+    return row
+
+
+def parse_catalog_row(catalog: str, row: Dict[str, Any]) -> Any:
+    """
+    Turn a catalog row into the object returned by the catalog getters: a dict for models, a Skill,
+    AgentFlowSpec or AgentWorkFlowConfig otherwise.
+    """
+    if catalog == "models":
+        return row
+    if catalog == "skills":
+        return Skill(**row)
+    if catalog == "agents":
+        row["config"] = json.loads(row["config"])
+        row["skills"] = json.loads(row["skills"] or "[]")
+        return AgentFlowSpec(**row)
+    if catalog == "workflows":
+        row["sender"] = json.loads(row["sender"])
+        row["receiver"] = json.loads(row["receiver"])
+        row["parallel_config"] = json.loads(row["parallel_config"]) if row.get("parallel_config") else None
+        return AgentWorkFlowConfig(**row)
+    raise ValueError(f"Unknown catalog: {catalog}")
+
+
+def shadow_defaults(rows: List[Dict[str, Any]], user_id: str) -> List[Dict[str, Any]]:
+    """
+    Drop the default catalog rows that a user has saved an own copy of, i.e. a row with the same id.
+    """
+    own_ids = {row["id"] for row in rows if row["user_id"] == user_id}
+    return [row for row in rows if row["user_id"] == user_id or row["id"] not in own_ids]
+
+
+def _upsert_rows(conn: sqlite3.Connection, catalog: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    stored = []
+    for row in rows:
+        columns = list(row)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in ("id", "user_id"))
+        query = f"INSERT INTO {catalog} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) ON CONFLICT (id, user_id) DO UPDATE SET {updates} RETURNING *"
+        cursor = conn.execute(query, tuple(row.values()))
+        names = [key[0] for key in cursor.description]
+        stored.append(decode_catalog_row(catalog, dict(zip(names, cursor.fetchone()))))
+    return stored
+
+
+def upsert_catalog_items(catalog: str, rows: List[Dict[str, Any]], dbmanager: DBManager) -> List[Dict[str, Any]]:
+    """
+    Insert or update catalog rows with a native UPSERT on (id, user_id), in a single transaction.
+
+    :param catalog: One of models, skills, agents or workflows
+    :param rows: The rows to store, see catalog_row
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: The stored rows as returned by the database, with JSON columns decoded
+    """
+    if catalog not in CATALOG_JSON_COLUMNS:
+        raise ValueError(f"Unknown catalog: {catalog}")
+    with dbmanager.transaction() as conn:
+        return _upsert_rows(conn, catalog, rows)
+
+
+def import_catalog(items: Dict[str, List[Any]], dbmanager: DBManager) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Insert or update many models, skills, agents and workflows at once, in a single transaction.
+
+    :param items: Catalog items by catalog name (models, skills, agents, workflows)
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: The stored rows by catalog name
+    """
+    rows = {catalog: [catalog_row(catalog, item) for item in catalog_items] for catalog, catalog_items in items.items()}
+    with dbmanager.transaction() as conn:
+        return {catalog: _upsert_rows(conn, catalog, catalog_rows) for catalog, catalog_rows in rows.items()}
+
+
+def get_catalog_etag(catalog: str, user_id: str, dbmanager: DBManager) -> str:
+    """
+    Return the etag of a user's view of a catalog. It changes whenever a row of the user or a default row of the
+    catalog is written.
+
+    :param catalog: One of models, skills, agents or workflows
+    :param user_id: The ID of the user
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: The etag
+    """
+    user_version, default_version = get_catalog_versions(catalog, user_id, dbmanager)
+    return catalog_etag(catalog, user_version, default_version)
+
+
+def get_catalog_versions(catalog: str, user_id: str, dbmanager: DBManager) -> Tuple[int, int]:
+    """
+    Return the current versions of a user's rows and of the default rows of a catalog.
+
+    :param catalog: One of models, skills, agents or workflows
+    :param user_id: The ID of the user
+    :param dbmanager: The DBManager instance to interact with the database
+    :return: A tuple of (user version, default version)
+    """
+    query = "SELECT user_id, version FROM catalog_versions WHERE catalog = ? AND user_id IN (?, ?)"
+    versions = dict(dbmanager.query(query=query, args=(catalog, user_id, "default")))
+    return versions.get(user_id, 0), versions.get("default", 0)
+
+
+def catalog_etag(catalog: str, user_version: int, default_version: int) -> str:
+    """
+    Format the etag of a catalog view from its versions, see get_catalog_versions.
+    """
+    return f"{catalog}-{user_version}-{default_version}"
 
 
 def get_workflows(user_id: str, dbmanager: DBManager) -> List[Dict[str, Any]]:
@@ -735,70 +1801,24 @@ def get_workflows(user_id: str, dbmanager: DBManager) -> List[Dict[str, Any]]:
     :param dbmanager: The DBManager instance to interact with the database
     :return: A list of dictionaries, each representing a workflow
     """
-    query = "SELECT * FROM workflows WHERE user_id = ? OR user_id = ?"
+    query = "SELECT * FROM workflows WHERE user_id IN (?, ?) ORDER BY timestamp DESC"
     args = (user_id, "default")
-    result = dbmanager.query(query=query, args=args, return_json=True)
-    # Sort by timestamp ascending
-    result = sorted(result, key=lambda k: k["timestamp"], reverse=True)
-    workflows = []
-    for row in result:
-        row["sender"] = json.loads(row["sender"])
-        row["receiver"] = json.loads(row["receiver"])
-        workflow = AgentWorkFlowConfig(**row)
-        workflows.append(workflow)
-    return workflows
+    result = shadow_defaults(dbmanager.query(query=query, args=args, return_json=True), user_id)
+    return [parse_catalog_row("workflows", row) for row in result]
 
 
 def upsert_workflow(workflow: AgentWorkFlowConfig, dbmanager: DBManager) -> List[Dict[str, Any]]:
     """
     Insert or update a workflow for a specific user in the database.
 
-    If the workflow with the given ID already exists, it will be updated with the new data.
+    If the workflow with the given ID already exists for the user, it will be updated with the new data.
     Otherwise, a new workflow will be created.
 
     :param workflow: The AgentWorkFlowConfig object containing workflow data
     :param dbmanager: The DBManager instance to interact with the database
     :return: A list of dictionaries, each representing a workflow after insertion or update
     """
-    existing_workflow = get_item_by_field("workflows", "id", workflow.id, dbmanager)
-
-    # print(workflow.receiver)
-
-    if existing_workflow:
-        updated_data = {
-            "user_id": workflow.user_id,
-            "timestamp": workflow.timestamp,
-            "sender": json.dumps(workflow.sender.dict()),
-            "receiver": json.dumps(
-                [receiver.dict() for receiver in workflow.receiver]
-                if isinstance(workflow.receiver, list)
-                else workflow.receiver.dict()
-            ),
-            "type": workflow.type,
-            "name": workflow.name,
-            "description": workflow.description,
-            "summary_method": workflow.summary_method,
-        }
-        update_item("workflows", workflow.id, updated_data, dbmanager)
-    else:
-        query = "INSERT INTO workflows (id, user_id, timestamp, sender, receiver, type, name, description, summary_method) VALUES (?, ?, ?, ?, ?, ?, ?, ?,?)"
-        args = (
-            workflow.id,
-            workflow.user_id,
-            workflow.timestamp,
-            json.dumps(workflow.sender.dict()),
-            json.dumps(
-                [receiver.dict() for receiver in workflow.receiver]
-                if isinstance(workflow.receiver, list)
-                else workflow.receiver.dict()
-            ),
-            workflow.type,
-            workflow.name,
-            workflow.description,
-            workflow.summary_method,
-        )
-        dbmanager.query(query=query, args=args)
-
+    upsert_catalog_items("workflows", [workflow_row(workflow)], dbmanager)
     return get_workflows(user_id=workflow.user_id, dbmanager=dbmanager)
 
 
@@ -0,0 +1,140 @@
+import hashlib
+import importlib.util
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from ..datamodel import Model
+from .utils import sanitize_model
+
+# api types whose autogen client is built on the openai SDK and accepts an http_client
+POOLED_API_TYPES = {None, "open_ai", "openai", "azure"}
+
+
+def http_client_key(model: Model) -> Tuple[Optional[str], ...]:
+    """
+    Compute the registry key of a model config: clients are shared by all configs with the same endpoint and
+    credentials, whatever the model name. The api_key is hashed so that it is not kept in the key.
+
+    :param model: A model or model config dict
+    :return: The registry key
+    """
+    sanitized_model = sanitize_model(model)
+    api_key = sanitized_model.get("api_key")
+    return (
+        sanitized_model.get("base_url"),
+        hashlib.sha256(api_key.encode()).hexdigest() if api_key else None,
+        sanitized_model.get("api_type"),
+        sanitized_model.get("api_version"),
+    )
+
+
+class HTTPClientPool:
+    """
+    Process-wide registry of keep-alive HTTP clients for the OpenAI-compatible endpoints used by agents. Without
+    it every agent builds its own OpenAIWrapper, and with it a new connection pool, so each message pays for new
+    TCP and TLS handshakes. Clients are thread-safe and shared across agents, sessions and requests.
+
+    HTTP/2 is used when the optional h2 package is installed.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+    ) -> None:
+        """
+        Args:
+            max_connections: The maximum number of connections of each client.
+            max_keepalive_connections: The maximum number of idle connections each client keeps open.
+            keepalive_expiry: The number of seconds an idle connection is kept open.
+            http2: If True, negotiate HTTP/2 with endpoints that support it (requires h2).
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self._clients: Dict[Tuple[Optional[str], ...], httpx.Client] = {}
+        self._requests: Dict[Tuple[Optional[str], ...], int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: Model) -> httpx.Client:
+        """
+        Return the shared client of a model config, creating it on first use.
+        """
+        key = http_client_key(model)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+
+                def count_request(request: httpx.Request) -> None:
+                    with self._lock:
+                        self._requests[key] = self._requests.get(key, 0) + 1
+
+                client = httpx.Client(
+                    limits=self.limits,
+                    http2=self.http2,
+                    follow_redirects=True,
+                    event_hooks={"request": [count_request]},
+                )
+                self._clients[key] = client
+                self._requests[key] = 0
+            return client
+
+    def configure(self, config_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Return a copy of an llm_config config_list with the shared client set on every entry that supports it.
+
+        :param config_list: The config_list of an llm_config
+        :return: The config_list with http_client entries
+        """
+        configured = []
+        for config in config_list:
+            config = dict(config)
+            if config.get("api_type") in POOLED_API_TYPES and "http_client" not in config:
+                config["http_client"] = self.get(config)
+            configured.append(config)
+        return configured
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the number of clients and, per endpoint, the requests sent and the open connections.
+        """
+        with self._lock:
+            endpoints = []
+            for key, client in self._clients.items():
+                # httpx does not expose pool state publicly, read it from the httpcore pool when available
+                pool = getattr(getattr(client, "_transport", None), "_pool", None)
+                connections = list(getattr(pool, "connections", []) or [])
+                endpoints.append(
+                    {
+                        "base_url": key[0],
+                        "api_type": key[2],
+                        "requests": self._requests.get(key, 0),
+                        "connections": len(connections),
+                        "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+                    }
+                )
+            return {
+                "clients": len(self._clients),
+                "http2": self.http2,
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "endpoints": endpoints,
+            }
+
+    def close(self) -> None:
+        """
+        Close all clients and their connections.
+        """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._requests.clear()
+        for client in clients:
+            client.close()
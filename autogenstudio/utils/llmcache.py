@@ -0,0 +1,273 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from openai.types.chat import ChatCompletion
+
+from .utils import md5_hash, sanitize_model
+
+logger = logging.getLogger()
+
+# create() arguments that do not change the completion and are left out of the cache key
+IGNORED_CREATE_PARAMS = {"messages", "context", "cache", "cache_seed", "agent", "stream"}
+
+
+def completion_cache_key(llm_config: Dict[str, Any], params: Dict[str, Any], scope: Optional[str] = None) -> str:
+    """
+    Compute the cache key of a completion request from the sanitized model configs, the generation settings,
+    the message list and the scope of the caller. API keys are hashed into the key, so that requests made with
+    different credentials (e.g. two deployments behind the same base_url) never share an entry.
+
+    :param llm_config: The llm_config of the agent, with config_list and generation settings
+    :param params: The create() arguments, including the messages sent to the model
+    :param scope: The owner of the entry, e.g. a user id; requests of different scopes never share an entry
+    :return: The cache key
+    """
+    config_list = []
+    for config in llm_config.get("config_list", []):
+        sanitized_config = sanitize_model(config)
+        api_key = sanitized_config.pop("api_key", None)
+        sanitized_config["api_key_hash"] = hashlib.sha256(api_key.encode()).hexdigest() if api_key else None
+        config_list.append(sanitized_config)
+    settings = {k: v for k, v in llm_config.items() if k not in ("config_list", "timeout", "stream")}
+    settings.update({k: v for k, v in params.items() if k not in IGNORED_CREATE_PARAMS})
+    payload = {
+        "scope": scope,
+        "config_list": config_list,
+        "settings": settings,
+        "messages": params.get("messages", []),
+    }
+    return md5_hash(json.dumps(payload, sort_keys=True, default=str))
+
+
+class CompletionCache:
+    """
+    Base class for studio-level completion caches. Values are picklable completion responses; subclasses implement
+    _get and _set and evict entries once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached response for a key, or None on a miss.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a response, evicting the least recently used entries if the cache grows beyond max_bytes.
+        """
+        try:
+            data = pickle.dumps(value)
+        except Exception as e:
+            logger.warning("Completion is not cacheable: %s", e)
+            return
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._set(key, value, data)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss counters and the cache size.
+        """
+        with self._lock:
+            return {
+                "backend": type(self).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size_bytes": self._size_bytes(),
+                "max_bytes": self.max_bytes,
+            }
+
+    def _get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Any, data: bytes) -> None:
+        raise NotImplementedError
+
+    def _size_bytes(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryCompletionCache(CompletionCache):
+    """
+    Completion cache kept in process memory with LRU eviction.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        super().__init__(max_bytes=max_bytes)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+
+    def _get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _set(self, key: str, value: Any, data: bytes) -> None:
+        if key in self._entries:
+            self._total_bytes -= self._entries.pop(key)[0]
+        self._entries[key] = (len(data), value)
+        self._total_bytes += len(data)
+        while self._total_bytes > self.max_bytes:
+            self._total_bytes -= self._entries.popitem(last=False)[1][0]
+            self.evictions += 1
+
+    def _size_bytes(self) -> int:
+        return self._total_bytes
+
+
+class SQLiteCompletionCache(CompletionCache):
+    """
+    Completion cache stored in an SQLite file, shared by all workers of the server and kept across restarts.
+    Entries are evicted least recently used first.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024) -> None:
+        super().__init__(max_bytes=max_bytes)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions (accessed)")
+        self.conn.commit()
+
+    def _get(self, key: str) -> Optional[Any]:
+        row = self.conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE completions SET accessed = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return pickle.loads(row[0])
+
+    def _set(self, key: str, value: Any, data: bytes) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO completions (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+            (key, data, len(data), time.time()),
+        )
+        total_bytes = self._size_bytes()
+        if total_bytes > self.max_bytes:
+            rows = self.conn.execute("SELECT key, size FROM completions ORDER BY accessed ASC").fetchall()
+            evicted = []
+            for evicted_key, size in rows:
+                if total_bytes <= self.max_bytes:
+                    break
+                evicted.append((evicted_key,))
+                total_bytes -= size
+            self.conn.executemany("DELETE FROM completions WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+        self.conn.commit()
+
+    def _size_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+
+class CachedOpenAIWrapper:
+    """
+    Proxy around an agent's OpenAIWrapper that serves identical create() requests of the same scope (the user
+    running the workflow) from a CompletionCache. Every other attribute is delegated to the wrapped client.
+    """
+
+    def __init__(
+        self, client: Any, cache: CompletionCache, llm_config: Dict[str, Any], scope: Optional[str] = None
+    ) -> None:
+        self._client = client
+        self._cache = cache
+        self._llm_config = llm_config
+        self._scope = scope
+        # True if the last create() call was served from the cache
+        self.last_hit = False
+
+    def create(self, **config: Any) -> Any:
+        key = completion_cache_key(self._llm_config, config, scope=self._scope)
+        cached = self._cache.get(key)
+        self.last_hit = cached is not None
+        if cached is not None:
+            return self.restore(cached)
+        response = self._client.create(**config)
+        self._cache.set(key, self.serialize(response))
+        return response
+
+    @staticmethod
+    def serialize(response: Any) -> Any:
+        """
+        Return the cacheable form of a response. OpenAIWrapper responses hold a reference to the client that made
+        them (message_retrieval_function), which cannot be pickled, so only the completion fields are kept.
+        """
+        if not isinstance(response, ChatCompletion):
+            return response
+        return {
+            "completion": response.model_dump(include=set(ChatCompletion.model_fields)),
+            "cost": getattr(response, "cost", 0),
+            "config_id": getattr(response, "config_id", 0),
+        }
+
+    def restore(self, cached: Any) -> Any:
+        """
+        Rebuild a response from its cached form, with the attributes OpenAIWrapper sets on the responses it returns.
+        """
+        if not isinstance(cached, dict) or "completion" not in cached:
+            return cached
+        response = ChatCompletion.model_validate(cached["completion"])
+        response.cost = cached["cost"]
+        response.config_id = cached["config_id"]
+        response.pass_filter = True
+        clients = getattr(self._client, "_clients", None)
+        if clients:
+            client = clients[cached["config_id"]] if cached["config_id"] < len(clients) else clients[0]
+            response.message_retrieval_function = client.message_retrieval
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+def get_completion_cache(backend: str, path: str, max_bytes: int) -> Optional[CompletionCache]:
+    """
+    Create a completion cache.
+
+    :param backend: "memory", "sqlite" or "none"
+    :param path: The database file used by the sqlite backend
+    :param max_bytes: The maximum size of the cache
+    :return: A CompletionCache, or None if backend is "none"
+    """
+    if backend == "memory":
+        return InMemoryCompletionCache(max_bytes=max_bytes)
+    if backend == "sqlite":
+        return SQLiteCompletionCache(path, max_bytes=max_bytes)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown completion cache backend: {backend}")
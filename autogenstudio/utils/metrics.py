@@ -0,0 +1,280 @@
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# content type of the Prometheus text exposition format served by GET /api/metrics
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# histogram buckets in seconds, from fast database queries to long LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def format_value(value: float) -> str:
+    """
+    Format a sample value for the text exposition format.
+    """
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    """
+    Format a label set, escaping label values as the text exposition format requires.
+    """
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Base class of the metric types. Samples are kept per label set; subclasses render them in render_samples.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """
+        Return the HELP, TYPE and sample lines of the metric.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in sorted(values):
+            lines.extend(self.render_samples(label_values, value))
+        return lines
+
+    def render_samples(self, label_values: Tuple[str, ...], value: Any) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, label_values)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. a number of calls or bytes.
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g. the number of chats in flight.
+    """
+
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values (usually durations in seconds) over fixed buckets, with their sum and count.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self.label_values(labels)
+        with self._lock:
+            # counts per bucket (the last one is +Inf), then the sum
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def render_samples(self, label_values: Tuple[str, ...], value: Any) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), value[:-1]):
+            cumulative += count
+            labels = format_labels(self.labelnames + ("le",), label_values + (format_value(bound),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.labelnames, label_values)
+        lines.append(f"{self.name}_sum{labels} {format_value(value[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of the studio server, rendered in the Prometheus text exposition format. Metrics are registered
+    once, at import time, and updated from any thread.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Return all metrics in the text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "autogenstudio_http_request_duration_seconds",
+    "Time until the response headers of an API request are sent, by route.",
+    ("method", "route", "status"),
+)
+chats_in_flight = registry.gauge(
+    "autogenstudio_chats_in_flight", "Chat runs admitted by the chat executor, by state.", ("state",)
+)
+chat_errors = registry.counter("autogenstudio_chat_errors_total", "Chat runs that failed with an error.")
+db_lock_wait = registry.histogram(
+    "autogenstudio_db_lock_wait_seconds",
+    "Time spent waiting for the database write lock, by operation.",
+    ("operation",),
+)
+db_query_duration = registry.histogram(
+    "autogenstudio_db_query_duration_seconds",
+    "Database query latency, including the write lock wait, by statement type.",
+    ("statement",),
+)
+llm_calls = registry.counter(
+    "autogenstudio_llm_calls_total", "LLM completion calls, by model and cache hit.", ("model", "cached")
+)
+llm_call_duration = registry.histogram(
+    "autogenstudio_llm_call_duration_seconds", "LLM completion call latency, by model.", ("model",)
+)
+workdir_bytes_published = registry.counter(
+    "autogenstudio_workdir_bytes_published_total",
+    "Bytes of work dir files published to the user files folder, by method (reflink or copy).",
+    ("method",),
+)
+audio_push_duration = registry.histogram(
+    "autogenstudio_audio_push_duration_seconds",
+    "Duration of Audio2Face gRPC audio pushes reported by the audio skills, by mode and outcome.",
+    ("mode", "status"),
+)
+
+
+def observe_llm_call(model: Optional[str], seconds: float, cached: bool = False) -> None:
+    """
+    Record an LLM completion call.
+
+    :param model: The model that served the call
+    :param seconds: The latency of the call
+    :param cached: True if the call was served from the completion cache
+    """
+    model = model or "unknown"
+    llm_calls.inc(model=model, cached=str(cached).lower())
+    llm_call_duration.observe(seconds, model=model)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the latency of every HTTP request in http_request_duration, labelled with the
+    route template (e.g. /sessions/{session_id}/stats) rather than the raw path, so that label cardinality stays
+    bounded. Streaming responses are timed until their headers are sent.
+    """
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start_time = time.perf_counter()
+        status = {"code": 500, "observed": False}
+
+        def observe() -> None:
+            if status["observed"]:
+                return
+            status["observed"] = True
+            # the router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_request_duration.observe(
+                time.perf_counter() - start_time, method=scope["method"], route=route, status=status["code"]
+            )
+
+        async def send_with_metrics(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                observe()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            observe()
@@ -0,0 +1,145 @@
+import contextvars
+import cProfile
+import importlib.util
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger()
+
+# profiling modes: span timers only, or span timers with a cProfile or pyinstrument profile of the turn
+PROFILE_MODES = ("spans", "cprofile", "pyinstrument")
+
+# nesting depth of the span being timed, per thread and per asyncio task
+_span_depth: contextvars.ContextVar = contextvars.ContextVar("autogenstudio_span_depth", default=0)
+
+# cProfile can only run once per process from Python 3.12 on, so profiles are captured one at a time
+_capture_lock = threading.Lock()
+
+
+class TurnProfiler:
+    """
+    Span timers for one chat turn, with an optional profile of the turn: cProfile (saved as a .prof file, e.g.
+    for snakeviz) or, if the optional pyinstrument package is installed, a pyinstrument sampling profile (saved
+    as .html, the pyinstrument mode falls back to cProfile without it). Only one profile is captured at a time;
+    turns that start while another one is captured only record their spans.
+    """
+
+    def __init__(self, mode: str = "spans") -> None:
+        """
+        Args:
+            mode: One of PROFILE_MODES.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        if mode == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+            logger.warning("pyinstrument is not installed, profiling with cProfile instead")
+            mode = "cprofile"
+        self.mode = mode
+        self.start_time = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.capture_error: Optional[str] = None
+        self._profiler = None
+        self._capturing = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Time a phase of the turn. Spans may be nested, their depth is recorded.
+        """
+        depth = _span_depth.get()
+        token = _span_depth.set(depth + 1)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            end_time = time.perf_counter()
+            _span_depth.reset(token)
+            with self._lock:
+                self.spans.append(
+                    {
+                        "name": name,
+                        "start": round(start_time - self.start_time, 6),
+                        "duration": round(end_time - start_time, 6),
+                        "depth": depth,
+                    }
+                )
+
+    def start_capture(self) -> None:
+        """
+        Start the profile of the turn on the current thread, unless the mode is "spans".
+        """
+        if self.mode == "spans" or self._profiler is not None:
+            return
+        if not _capture_lock.acquire(blocking=False):
+            self.capture_error = "another profile was being captured"
+            return
+        try:
+            if self.mode == "cprofile":
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            else:
+                import pyinstrument
+
+                self._profiler = pyinstrument.Profiler(async_mode="enabled")
+                self._profiler.start()
+            self._capturing = True
+        except Exception as e:
+            self._profiler = None
+            self.capture_error = str(e)
+            _capture_lock.release()
+
+    def stop_capture(self) -> None:
+        """
+        Stop the profile of the turn, if one is being captured.
+        """
+        if not self._capturing:
+            return
+        try:
+            if self.mode == "cprofile":
+                self._profiler.disable()
+            else:
+                self._profiler.stop()
+        finally:
+            self._capturing = False
+            _capture_lock.release()
+
+    def save(self, folder: str, name: str) -> Optional[str]:
+        """
+        Stop the capture and save the profile to a folder.
+
+        :param folder: The folder the profile is saved to, created if needed
+        :param name: The file name of the profile, without extension
+        :return: The file name of the saved profile, or None if no profile was captured
+        """
+        self.stop_capture()
+        if self._profiler is None:
+            return None
+        os.makedirs(folder, exist_ok=True)
+        if self.mode == "cprofile":
+            file_name = f"{name}.prof"
+            self._profiler.dump_stats(os.path.join(folder, file_name))
+        else:
+            file_name = f"{name}.html"
+            with open(os.path.join(folder, file_name), "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        return file_name
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Return the mode, the time since the profiler was created and the spans, in start order.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: (span["start"], span["depth"]))
+        report = {
+            "mode": self.mode,
+            "total": round(time.perf_counter() - self.start_time, 6),
+            "spans": spans,
+        }
+        if self.capture_error is not None:
+            report["capture_error"] = self.capture_error
+        return report
@@ -0,0 +1,197 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from autogen.oai.client import OpenAIWrapper
+
+from .httpclients import HTTPClientPool
+from .metrics import observe_llm_call
+from .utils import capture_stream_deltas, md5_hash, sanitize_model, stream_deltas_supported
+
+SUMMARY_INSTRUCTION = """You summarize the work of a team of AI agents for the user who gave them the task.
+Write the answer to the task as the user should read it: the result, the key facts, numbers and file names,
+and code only where the user needs it. Leave out the back and forth between the agents and any TERMINATE
+markers. Be concise."""
+
+
+def history_transcript(agent_history: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Turn the agent history of a run into a transcript for the summarizer.
+
+    :param agent_history: The iterations recorded by AutoGenWorkFlowManager
+    :return: A list of dicts with name and content keys
+    """
+    transcript = []
+    for iteration in agent_history:
+        content = iteration["message"].get("content")
+        if content is None:
+            continue
+        if not isinstance(content, str):
+            content = json.dumps(content, default=str)
+        transcript.append({"name": iteration["sender"], "content": content})
+    return transcript
+
+
+class Summarizer:
+    """
+    Summarizes transcripts with one (streaming) LLM call, usually on a small or local model. Summaries are
+    cached by a hash chain over the transcript: a transcript that was summarized before is served from the
+    cache, and a transcript that extends a summarized one (a growing session) is summarized incrementally
+    from the summary of its longest cached prefix.
+    """
+
+    def __init__(
+        self,
+        config_list: Optional[List[Dict[str, Any]]] = None,
+        max_tokens: int = 512,
+        max_message_chars: int = 4000,
+        max_size: int = 1024,
+        stream: bool = True,
+        http_clients: Optional[HTTPClientPool] = None,
+    ) -> None:
+        """
+        Args:
+            config_list: The models used for summaries. If None, callers pass the config_list of the workflow.
+            max_tokens: The maximum length of a summary.
+            max_message_chars: Messages are cut to this many characters in the summary prompt.
+            max_size: The number of summaries kept in the cache.
+            stream: If True, summaries are streamed to the on_delta callback as they are generated. If the installed
+                AutoGen cannot stream to a callback (see stream_deltas_supported), on_delta receives the whole
+                summary at once.
+            http_clients: An optional HTTPClientPool shared with the agents.
+        """
+        self.config_list = [sanitize_model(config) for config in config_list] if config_list else None
+        self.max_tokens = max_tokens
+        self.max_message_chars = max_message_chars
+        self.max_size = max_size
+        self.stream = stream and stream_deltas_supported()
+        self.http_clients = http_clients
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def chain(
+        self, config_list: List[Dict[str, Any]], instruction: str, transcript: List[Dict[str, str]]
+    ) -> List[str]:
+        """
+        Return the hash chain of a transcript: entry i identifies the summary of the first i + 1 messages, for
+        the given models and instruction.
+        """
+        models = []
+        for config in config_list:
+            config = sanitize_model(config)
+            config.pop("api_key", None)
+            models.append(config)
+        digest = md5_hash(json.dumps([models, instruction, self.max_tokens], sort_keys=True))
+        chain = []
+        for message in transcript:
+            digest = md5_hash(digest + json.dumps(message, sort_keys=True))
+            chain.append(digest)
+        return chain
+
+    def cached(self, chain: List[str]) -> Tuple[int, Optional[str]]:
+        """
+        Find the summary of the longest summarized prefix of a transcript.
+
+        Returns:
+            A tuple of the prefix length and its summary, (0, None) if no prefix is cached.
+        """
+        with self._lock:
+            for length in range(len(chain), 0, -1):
+                summary = self._summaries.get(chain[length - 1])
+                if summary is not None:
+                    self._summaries.move_to_end(chain[length - 1])
+                    return length, summary
+        return 0, None
+
+    def store(self, key: str, summary: str) -> None:
+        """
+        Cache a summary under the chain hash of its transcript.
+        """
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_size:
+                self._summaries.popitem(last=False)
+
+    def format_transcript(self, transcript: List[Dict[str, str]]) -> str:
+        """
+        Format a transcript for the summary prompt, cutting long messages.
+        """
+        return "\n\n".join(
+            f"{message['name']}: {message['content'][: self.max_message_chars].strip()}" for message in transcript
+        )
+
+    def summarize(
+        self,
+        transcript: List[Dict[str, str]],
+        config_list: Optional[List[Dict[str, Any]]] = None,
+        instruction: str = SUMMARY_INSTRUCTION,
+        on_delta: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Summarize a transcript.
+
+        :param transcript: A list of dicts with name and content keys, oldest first
+        :param config_list: The models to use if the summarizer has no models of its own
+        :param instruction: The system message of the summary call
+        :param on_delta: An optional callback invoked with the streamed chunks of the summary
+        :return: The summary
+        """
+        config_list = self.config_list or config_list
+        if not config_list:
+            raise ValueError("No model is configured for summaries")
+        if not transcript:
+            return ""
+        chain = self.chain(config_list, instruction, transcript)
+        length, summary = self.cached(chain)
+        if length == len(transcript):
+            self.hits += 1
+            if on_delta is not None:
+                on_delta(summary)
+            return summary
+
+        if summary is not None:
+            self.prefix_hits += 1
+            prompt = (
+                f"Summary of the earlier part of the conversation:\n\n{summary}\n\n"
+                f"The conversation continued:\n\n{self.format_transcript(transcript[length:])}"
+            )
+        else:
+            self.misses += 1
+            prompt = f"Conversation:\n\n{self.format_transcript(transcript)}"
+
+        if self.http_clients is not None:
+            config_list = self.http_clients.configure(config_list)
+        client = OpenAIWrapper(config_list=config_list)
+        start_time = time.time()
+        with capture_stream_deltas(on_delta if self.stream else None):
+            response = client.create(
+                messages=[{"role": "system", "content": instruction}, {"role": "user", "content": prompt}],
+                max_tokens=self.max_tokens,
+                stream=self.stream,
+                cache_seed=None,
+            )
+        observe_llm_call(getattr(response, "model", None) or config_list[0].get("model"), time.time() - start_time)
+        summary = (client.extract_text_or_completion_object(response)[0] or "").strip()
+        if on_delta is not None and not self.stream:
+            on_delta(summary)
+        self.store(chain[-1], summary)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache size and hit/miss counters.
+        """
+        with self._lock:
+            return {
+                "size": len(self._summaries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "prefix_hits": self.prefix_hits,
+                "misses": self.misses,
+            }
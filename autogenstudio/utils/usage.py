@@ -0,0 +1,137 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import observe_llm_call
+from .utils import capture_stream_deltas
+
+# usage counters that are summed over LLM calls, code executions, turns and sessions
+USAGE_COUNTERS = ("llm_calls", "prompt_tokens", "completion_tokens", "llm_latency", "code_execution_time", "cache_hits")
+
+
+def empty_usage() -> Dict[str, Any]:
+    """
+    Return a usage record with all counters at zero.
+    """
+    usage = {counter: 0 for counter in USAGE_COUNTERS}
+    usage["time_to_first_token"] = None
+    return usage
+
+
+def add_usage(total: Dict[str, Any], usage: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add a usage record to a total, in place. The time to first token of the total is the one of its first
+    streamed call.
+
+    :param total: The usage record to add to
+    :param usage: The usage record to add
+    :return: The total
+    """
+    for counter in USAGE_COUNTERS:
+        total[counter] += usage.get(counter) or 0
+    if total["time_to_first_token"] is None:
+        total["time_to_first_token"] = usage.get("time_to_first_token")
+    return total
+
+
+class UsageMeter:
+    """
+    Collects the LLM and code execution usage of the agents of a run. Usage is kept per agent until it is
+    attributed to the next message the agent sends (see take), and summed over the run.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._total = empty_usage()
+        self._lock = threading.Lock()
+
+    def record(self, agent_name: str, **usage: Any) -> None:
+        """
+        Record usage of an agent, e.g. record("assistant", llm_calls=1, prompt_tokens=120).
+        """
+        with self._lock:
+            add_usage(self._pending.setdefault(agent_name, empty_usage()), usage)
+            add_usage(self._total, usage)
+
+    def merge(self, usage: Dict[str, Any]) -> None:
+        """
+        Add the total of another meter, e.g. of a parallel branch, to the total of the run. The usage is not
+        attributed to a message, the merged meter already attributed it.
+        """
+        with self._lock:
+            add_usage(self._total, usage)
+
+    def take(self, agent_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Return and clear the usage an agent recorded since its last message, None if there is none.
+        """
+        with self._lock:
+            return self._pending.pop(agent_name, None)
+
+    def total(self) -> Dict[str, Any]:
+        """
+        Return the usage of the run so far.
+        """
+        with self._lock:
+            return dict(self._total)
+
+    def reset(self) -> None:
+        """
+        Clear all usage, at the start of a run.
+        """
+        with self._lock:
+            self._pending = {}
+            self._total = empty_usage()
+
+
+class MeteredClient:
+    """
+    Proxy around an agent's LLM client that records the latency, time to first token, token usage and cache
+    hits of every create() call in a UsageMeter. Streamed chunks are also forwarded to on_delta: the capture
+    runs around the completion call itself, on the thread that makes it, which async agents do not share with
+    the chat. Every other attribute is delegated to the wrapped client.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        meter: UsageMeter,
+        agent_name: str,
+        stream: bool = False,
+        on_delta: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self._client = client
+        self._meter = meter
+        self._agent_name = agent_name
+        self._stream = stream
+        self._on_delta = on_delta
+
+    def create(self, **config: Any) -> Any:
+        start_time = time.time()
+        first_token_times = []
+
+        def on_delta(content: str) -> None:
+            if not first_token_times:
+                first_token_times.append(time.time())
+            if self._on_delta is not None:
+                self._on_delta(content)
+
+        with capture_stream_deltas(on_delta if self._stream else None):
+            response = self._client.create(**config)
+        latency = time.time() - start_time
+        cache_hit = bool(getattr(self._client, "last_hit", False))
+        usage = getattr(response, "usage", None)
+        self._meter.record(
+            self._agent_name,
+            llm_calls=1,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            llm_latency=latency,
+            time_to_first_token=first_token_times[0] - start_time if first_token_times else None,
+            cache_hits=1 if cache_hit else 0,
+        )
+        observe_llm_call(getattr(response, "model", None), latency, cached=cache_hit)
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
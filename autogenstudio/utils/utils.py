@@ -1,13 +1,21 @@
 import base64
+import builtins
+import contextvars
 import hashlib
-from typing import List, Dict, Tuple, Union
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Dict, Optional, Tuple, Union
 import os
 import shutil
+import sys
+import time
 from pathlib import Path
 import re
 import autogen
 from autogen.oai.client import OpenAIWrapper
-from ..datamodel import AgentConfig, AgentFlowSpec, AgentWorkFlowConfig, LLMConfig, Model, Skill
+from autogen.token_count_utils import count_token
+from ..datamodel import AgentConfig, AgentFlowSpec, AgentWorkFlowConfig, HistoryPolicy, LLMConfig, Model, Skill
+from .metrics import workdir_bytes_published
 
 
 def md5_hash(text: str) -> str:
@@ -145,18 +153,82 @@ def serialize_file(file_path: str) -> Tuple[str, str]:
     return base64_encoded_content, file_type
 
 
+# directories that are never scanned for generated files, e.g. installed packages and caches
+IGNORE_DIRS = {"__pycache__", ".git", ".venv", "venv", "node_modules", "site-packages", ".cache"}
+
+
+def snapshot_folder(folder_path: str) -> Dict[str, Tuple[int, int, int]]:
+    """
+    Record the (inode, mtime in ns, size) signature of every file below a folder, using os.scandir so that
+    a single directory listing provides the file metadata. Directories in IGNORE_DIRS are skipped.
+
+    :param folder_path: The folder to snapshot
+    :return: A dictionary mapping file paths to their signature
+    """
+    snapshot = {}
+    pending = [folder_path]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORE_DIRS:
+                        pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    snapshot[entry.path] = (entry.inode(), stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+# ioctl request that clones a file on copy-on-write file systems (btrfs, xfs), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def copy_file(source_path: str, dest_path: str) -> str:
+    """
+    Copy a file with its metadata, as a copy-on-write clone (reflink) where the file system supports it. Unlike
+    a hard link, the copy is not changed by later in-place edits of the source file.
+
+    :param source_path: The file to copy
+    :param dest_path: The path of the copy
+    :return: The copy method used, "reflink" or "copy"
+    """
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        try:
+            with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+            shutil.copystat(source_path, dest_path)
+            return "reflink"
+        except OSError:
+            pass
+    shutil.copy2(source_path, dest_path)
+    return "copy"
+
+
 def get_modified_files(
-    start_timestamp: float, end_timestamp: float, source_dir: str, dest_dir: str
+    start_timestamp: float,
+    end_timestamp: float,
+    source_dir: str,
+    dest_dir: str,
+    snapshot: Optional[Dict[str, Tuple[int, int, int]]] = None,
 ) -> List[Dict[str, str]]:
     """
-    Copy files from source_dir that were modified within a specified timestamp range
-    to dest_dir, renaming files if they already exist there. The function excludes
-    files with certain file extensions and names.
+    Publish files from source_dir that were created or modified during a run to dest_dir, renaming files if
+    they already exist there. If a snapshot of source_dir taken before the run is given, files are selected by
+    diffing against it; otherwise files modified within the timestamp range are selected. Files are copied to
+    dest_dir (see copy_file), so published files do not change when a persistent workspace is edited in later
+    turns. The function excludes files with certain file extensions and names.
 
     :param start_timestamp: The start timestamp to filter modified files.
     :param end_timestamp: The end timestamp to filter modified files.
     :param source_dir: The directory to search for modified files.
     :param dest_dir: The destination directory to copy modified files to.
+    :param snapshot: An optional snapshot of source_dir taken with snapshot_folder before the run.
 
     :return: A list of dictionaries with details of file paths in dest_dir that were modified and copied over.
              Dictionary format: {path: "", name: "", extension: ""}
@@ -167,45 +239,44 @@ def get_modified_files(
     ignore_extensions = {".pyc", ".cache"}
     ignore_files = {"__pycache__", "__init__.py"}
 
-    for root, dirs, files in os.walk(source_dir):
-        # Excluding the directory "__pycache__" if present
-        dirs[:] = [d for d in dirs if d not in ignore_files]
-
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_ext = os.path.splitext(file)[1]
-            file_name = os.path.basename(file)
-
-            if file_ext in ignore_extensions or file_name in ignore_files:
-                continue
-
-            file_mtime = os.path.getmtime(file_path)
-            if start_timestamp < file_mtime < end_timestamp:
-                dest_file_path = os.path.join(dest_dir, file)
-                copy_idx = 1
-                while os.path.exists(dest_file_path):
-                    base, extension = os.path.splitext(file)
-                    # Handling potential name conflicts by appending a number
-                    dest_file_path = os.path.join(dest_dir, f"{base}_{copy_idx}{extension}")
-                    copy_idx += 1
-
-                # Copying the modified file to the destination directory
-                shutil.copy2(file_path, dest_file_path)
-
-                # Extract user id from the dest_dir and file path
-
-                dest_dir_as_path = Path(dest_dir)
-                uid = dest_dir_as_path.name
-
-                relative_file_path = os.path.relpath(dest_file_path, start=dest_dir)
-                file_type = get_file_type(dest_file_path)
-                file_dict = {
-                    "path": f"files/user/{uid}/{relative_file_path}",
-                    "name": file_name,
-                    "extension": file_ext.replace(".", ""),
-                    "type": file_type,
-                }
-                modified_files.append(file_dict)
+    current = snapshot_folder(source_dir)
+    if snapshot is not None:
+        changed_paths = [path for path, signature in current.items() if snapshot.get(path) != signature]
+    else:
+        changed_paths = [
+            path for path, signature in current.items() if start_timestamp < signature[1] / 1e9 < end_timestamp
+        ]
+
+    # resolve name conflicts against a single listing of the destination directory
+    os.makedirs(dest_dir, exist_ok=True)
+    existing_names = set(os.listdir(dest_dir))
+    uid = Path(dest_dir).name
+
+    for file_path in changed_paths:
+        file = os.path.basename(file_path)
+        base, file_ext = os.path.splitext(file)
+        if file_ext in ignore_extensions or file in ignore_files:
+            continue
+
+        dest_name = file
+        copy_idx = 1
+        while dest_name in existing_names:
+            # Handling potential name conflicts by appending a number
+            dest_name = f"{base}_{copy_idx}{file_ext}"
+            copy_idx += 1
+        existing_names.add(dest_name)
+        dest_file_path = os.path.join(dest_dir, dest_name)
+
+        method = copy_file(file_path, dest_file_path)
+        workdir_bytes_published.inc(current[file_path][2], method=method)
+
+        file_dict = {
+            "path": f"files/user/{uid}/{dest_name}",
+            "name": file,
+            "extension": file_ext.replace(".", ""),
+            "type": get_file_type(dest_file_path),
+        }
+        modified_files.append(file_dict)
     # sort by extension
     modified_files.sort(key=lambda x: x["extension"])
     return modified_files
@@ -224,26 +295,22 @@ def init_webserver_folders(root_file_path: str) -> Dict[str, str]:
         os.makedirs(root_file_path, exist_ok=True)
     files_static_root = os.path.join(root_file_path, "files/")
     static_folder_root = os.path.join(root_file_path, "ui")
+    # turn profiles, outside of the publicly served files folder
+    profiles_root = os.path.join(root_file_path, "profiles")
 
     os.makedirs(files_static_root, exist_ok=True)
     os.makedirs(os.path.join(files_static_root, "user"), exist_ok=True)
     os.makedirs(static_folder_root, exist_ok=True)
+    os.makedirs(profiles_root, exist_ok=True)
     folders = {
         "files_static_root": files_static_root,
         "static_folder_root": static_folder_root,
+        "profiles_root": profiles_root,
     }
     return folders
 
 
-def get_skills_from_prompt(skills: List[Skill], work_dir: str) -> str:
-    """
-    Create a prompt with the content of all skills and write the skills to a file named skills.py in the work_dir.
-
-    :param skills: A dictionary skills
-    :return: A string containing the content of all skills
-    """
-
-    instruction = """
+SKILLS_INSTRUCTION = """
 
 While solving the task you may use functions below which will be available in a file called skills.py .
 To use a function skill.py in code, IMPORT THE FUNCTION FROM skills.py  and then use the function.
@@ -251,6 +318,15 @@ If you need to install python packages, write shell code to
 install via pip and use --quiet option.
 
          """
+
+
+def get_skills_file_content(skills: List[Skill]) -> str:
+    """
+    Return the content of the skills.py file for a list of skills.
+
+    :param skills: A list of skills
+    :return: The content of all skills
+    """
     prompt = ""  # filename:  skills.py
     for skill in skills:
         prompt += f"""
@@ -262,19 +338,108 @@ install via pip and use --quiet option.
 #### End of {skill.title} ####
 
         """
+    return prompt
+
+
+def get_skills_from_prompt(skills: List[Skill], work_dir: str) -> str:
+    """
+    Create a prompt with the content of all skills and write the skills to a file named skills.py in the work_dir.
+
+    :param skills: A dictionary skills
+    :return: A string containing the content of all skills
+    """
+    prompt = get_skills_file_content(skills)
+    materialize_file(os.path.join(work_dir, "skills.py"), prompt)
+
+    return SKILLS_INSTRUCTION + prompt
+
+
+def materialize_file(file_path: str, content: str) -> bool:
+    """
+    Write content to a file only if the file does not already hold the same content, compared by hash,
+    so persistent workspaces are not rewritten on every run.
+
+    :param file_path: The path of the file to write
+    :param content: The text content of the file
+    :return: True if the file was written, False if it was already up to date
+    """
+    content_hash = md5_hash(content)
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            if md5_hash(f.read()) == content_hash:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
 
-    # check if work_dir exists
-    if not os.path.exists(work_dir):
-        os.makedirs(work_dir)
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return True
 
-    # overwrite skills.py in work_dir
-    with open(os.path.join(work_dir, "skills.py"), "w", encoding="utf-8") as f:
-        f.write(prompt)
-    # overwrite skills.py in work_dir
-    with open(os.path.join(work_dir, "skills.py"), "w", encoding="utf-8") as f:
-        f.write(prompt)
 
-    return instruction + prompt
+def get_folder_size(folder_path: str) -> int:
+    """
+    Compute the total size in bytes of the files below a folder.
+
+    :param folder_path: The folder to measure
+    :return: The total size in bytes
+    """
+    total_size = 0
+    pending = [folder_path]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total_size += entry.stat(follow_symlinks=False).st_size
+    return total_size
+
+
+def cleanup_workspaces(
+    user_root: str, max_age: Optional[float] = None, max_total_bytes: Optional[int] = None
+) -> List[str]:
+    """
+    Garbage-collect persistent session workspaces (user_root/<user>/scratch/<session>). Workspaces not used for
+    more than max_age seconds are deleted; then, if the remaining workspaces use more than max_total_bytes,
+    the least recently used ones are deleted until they fit. A workspace's last use is the modification time of
+    its directory, which the chat manager touches on every run.
+
+    :param user_root: The folder containing the per-user folders
+    :param max_age: The maximum age of a workspace in seconds, no age limit if None
+    :param max_total_bytes: The maximum total size of all workspaces, no size limit if None
+    :return: The paths of the deleted workspaces
+    """
+    workspaces = []
+    for user_entry in os.scandir(user_root) if os.path.isdir(user_root) else []:
+        scratch_dir = os.path.join(user_entry.path, "scratch")
+        if not user_entry.is_dir() or not os.path.isdir(scratch_dir):
+            continue
+        for entry in os.scandir(scratch_dir):
+            if entry.is_dir(follow_symlinks=False):
+                workspaces.append((entry.stat().st_mtime, entry.path))
+    workspaces.sort()
+
+    now = time.time()
+    deleted = []
+    if max_age is not None:
+        while workspaces and now - workspaces[0][0] > max_age:
+            deleted.append(workspaces.pop(0)[1])
+    if max_total_bytes is not None:
+        sizes = {path: get_folder_size(path) for _, path in workspaces}
+        total_size = sum(sizes.values())
+        while workspaces and total_size > max_total_bytes:
+            path = workspaces.pop(0)[1]
+            total_size -= sizes[path]
+            deleted.append(path)
+
+    for path in deleted:
+        shutil.rmtree(path, ignore_errors=True)
+    return deleted
 
 
 def delete_files_in_folder(folders: Union[str, List[str]]) -> None:
@@ -399,12 +564,157 @@ def sanitize_model(model: Model):
     return sanitized_model
 
 
-def test_model(model: Model):
+def test_model(model: Model, http_clients: Optional[Any] = None):
     """
     Test the model endpoint by sending a simple message to the model and returning the response.
+
+    :param model: The model to test
+    :param http_clients: An optional HTTPClientPool, so that probes reuse the connections of the agents
     """
 
-    sanitized_model = sanitize_model(model)
-    client = OpenAIWrapper(config_list=[sanitized_model])
+    config_list = [sanitize_model(model)]
+    if http_clients is not None:
+        config_list = http_clients.configure(config_list)
+    client = OpenAIWrapper(config_list=config_list)
     response = client.create(messages=[{"role": "user", "content": "2+2="}], cache_seed=None)
     return response.choices[0].message.content
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """
+    Count the tokens of a text with the tokenizer of the given model, falling back to a
+    characters / 4 estimate if the tokenizer is not available.
+
+    :param text: The text to count tokens for
+    :param model: The model whose tokenizer is used
+    :return: The number of tokens
+    """
+    try:
+        return count_token(text, model=model)
+    except Exception:
+        return len(text) // 4
+
+
+def apply_history_policy(messages: List[Dict[str, str]], policy: Optional[HistoryPolicy]) -> List[Dict[str, str]]:
+    """
+    Select the messages of a session history that are loaded into the agents, according to a context window policy.
+
+    :param messages: A list of message dicts with role and content keys, oldest first
+    :param policy: The history policy, all messages are kept if None
+    :return: The selected messages, optionally preceded by a digest of the dropped ones
+    """
+    if policy is None or policy.type == "all":
+        return messages
+
+    keep = len(messages)
+    if policy.type == "last_n" and policy.max_messages is not None:
+        keep = min(keep, max(0, policy.max_messages))
+    elif policy.type == "token_budget" and policy.max_tokens is not None:
+        budget = policy.max_tokens
+        keep = 0
+        for message in reversed(messages):
+            budget -= count_tokens(message["content"])
+            if budget < 0:
+                break
+            keep += 1
+
+    dropped, kept = messages[: len(messages) - keep], messages[len(messages) - keep :]
+    if not dropped or not policy.summarize_prefix:
+        return kept
+
+    digest = "\n".join(f"- {message['role']}: {message['content'][:200].strip()}" for message in dropped)
+    prefix = {"role": "user", "content": f"Summary of the earlier conversation:\n{digest}"}
+    return [prefix] + kept
+
+
+class _DeltaIOStream:
+    """
+    IOStream that forwards streamed completion chunks to a callback and everything else to the wrapped stream.
+    AutoGen prints streamed chunks with end="", while regular agent output ends with a newline.
+    """
+
+    def __init__(self, on_delta: Callable[[str], None], default_stream: Any) -> None:
+        self.on_delta = on_delta
+        self.default_stream = default_stream
+
+    def print(self, *objects: Any, sep: str = " ", end: str = "\n", flush: bool = False) -> None:
+        if end == "":
+            self.on_delta(sep.join(str(obj) for obj in objects))
+        self.default_stream.print(*objects, sep=sep, end=end, flush=flush)
+
+    def input(self, prompt: str = "", *, password: bool = False) -> str:
+        return self.default_stream.input(prompt, password=password)
+
+
+# callbacks of the active capture_stream_deltas contexts, used with AutoGen versions without autogen.io
+_delta_callbacks: contextvars.ContextVar = contextvars.ContextVar("autogenstudio_delta_callbacks", default=())
+_delta_print_lock = threading.Lock()
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def _print_stream_chunk(*objects: Any, sep: str = " ", end: str = "\n", **kwargs: Any) -> None:
+    """
+    Replacement of print in autogen.oai.client, which prints streamed chunks with end="" on AutoGen versions
+    without autogen.io. Chunks are forwarded to the callbacks of the current context, then printed as before.
+    """
+    if end == "":
+        content = _ANSI_ESCAPE.sub("", sep.join(str(obj) for obj in objects))
+        if content:
+            for on_delta in _delta_callbacks.get():
+                on_delta(content)
+    builtins.print(*objects, sep=sep, end=end, **kwargs)
+
+
+def _install_delta_print() -> bool:
+    """
+    Route the output of autogen.oai.client through _print_stream_chunk, once per process.
+    """
+    try:
+        from autogen.oai import client as oai_client
+    except ImportError:
+        return False
+    with _delta_print_lock:
+        if getattr(oai_client, "print", None) is not _print_stream_chunk:
+            oai_client.print = _print_stream_chunk
+    return True
+
+
+def stream_deltas_supported() -> bool:
+    """
+    Return True if capture_stream_deltas can forward streamed chunks with the installed AutoGen, through
+    autogen.io.IOStream or the print calls of autogen.oai.client.
+    """
+    try:
+        from autogen.io import IOStream  # noqa: F401
+    except ImportError:
+        return _install_delta_print()
+    return True
+
+
+@contextmanager
+def capture_stream_deltas(on_delta: Optional[Callable[[str], None]]) -> Iterator[None]:
+    """
+    Forward incremental completion chunks to on_delta while the context is active. Chunks are only produced
+    when the agent llm_config sets stream=True. AutoGen versions with autogen.io route them through IOStream;
+    older versions print them from autogen.oai.client, whose print is replaced once to capture them. Both are
+    scoped to the current thread (or task), so the context must be entered where the completion call runs.
+
+    :param on_delta: A callback invoked with each streamed text chunk, or None to disable capturing
+    """
+    if on_delta is None:
+        yield
+        return
+    try:
+        from autogen.io import IOStream
+    except ImportError:
+        if not _install_delta_print():
+            yield
+            return
+        token = _delta_callbacks.set(_delta_callbacks.get() + (on_delta,))
+        try:
+            yield
+        finally:
+            _delta_callbacks.reset(token)
+        return
+    with IOStream.set_default(_DeltaIOStream(on_delta, IOStream.get_default())):
+        yield
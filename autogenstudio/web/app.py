@@ -1,23 +1,51 @@
+import asyncio
+import functools
+import itertools
 import json
 import os
+import random
+import secrets
 import traceback
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi import HTTPException
 from openai import OpenAIError
 from ..version import VERSION
 
 from ..datamodel import (
+    AudioPushMetricWebRequestModel,
+    CatalogImportWebRequestModel,
     ChatWebRequestModel,
     DBWebRequestModel,
     DeleteMessageWebRequestModel,
+    HistoryPolicy,
     Message,
     Session,
 )
-from ..utils import md5_hash, init_webserver_folders, DBManager, dbutils, test_model
+from ..utils import (
+    md5_hash,
+    init_webserver_folders,
+    cleanup_workspaces,
+    get_completion_cache,
+    CatalogCache,
+    DBManager,
+    HTTPClientPool,
+    METRICS_CONTENT_TYPE,
+    MetricsMiddleware,
+    SessionCompactor,
+    Summarizer,
+    sanitize_model,
+    dbutils,
+    metrics,
+    test_model,
+)
 
 from ..chatmanager import AutoGenChatManager
+from ..groupchat import SpeakerSelectionCache
+from ..workflowmanager import TemplateCache, WorkflowCache
+from ..executor import ChatExecutor, ChatQueueFullError
 
 
 app = FastAPI()
@@ -44,6 +72,8 @@ folders = init_webserver_folders(root_file_path)
 ui_folder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui")
 
 api = FastAPI(root_path="/api")
+# request latency per route, served by GET /api/metrics
+api.add_middleware(MetricsMiddleware)
 # mount an api route such that the main route serves the ui and the /api
 app.mount("/api", api)
 
@@ -53,53 +83,348 @@ api.mount("/files", StaticFiles(directory=folders["files_static_root"], html=Tru
 
 db_path = os.path.join(root_file_path, "database.sqlite")
 dbmanager = DBManager(path=db_path)  # manage database operations
-chatmanager = AutoGenChatManager()  # manage calls to autogen
+if os.environ.get("AUTOGENSTUDIO_DB_WRITE_BEHIND", "false").lower() == "true":
+    # batch message inserts in one transaction instead of committing each one
+    dbmanager.start_write_behind(
+        max_batch_size=int(os.environ.get("AUTOGENSTUDIO_DB_BATCH_SIZE", 100)),
+        flush_interval=float(os.environ.get("AUTOGENSTUDIO_DB_FLUSH_INTERVAL", 0.5)),
+    )
+# parsed models, skills, agents and workflows, revalidated against the catalog versions on every read
+catalog_cache = CatalogCache(dbmanager, max_users=int(os.environ.get("AUTOGENSTUDIO_CATALOG_CACHE_USERS", 1024)))
+# save each intermediate agent turn while a run is in progress, so partial transcripts survive a crash
+persist_turns = os.environ.get("AUTOGENSTUDIO_PERSIST_TURNS", "false").lower() == "true"
+# keep-alive HTTP clients shared by the LLM clients of all agents and model tests
+http_clients = HTTPClientPool(
+    max_connections=int(os.environ.get("AUTOGENSTUDIO_HTTP_MAX_CONNECTIONS", 100)),
+    max_keepalive_connections=int(os.environ.get("AUTOGENSTUDIO_HTTP_MAX_KEEPALIVE", 20)),
+    keepalive_expiry=float(os.environ.get("AUTOGENSTUDIO_HTTP_KEEPALIVE_EXPIRY", 30)),
+    http2=os.environ.get("AUTOGENSTUDIO_HTTP2", "true").lower() == "true",
+)
+# summarizer of workflows with summary_method "llm", on a separately configured (small or local) model if set
+summarizer = Summarizer(
+    config_list=[
+        {
+            "model": os.environ["AUTOGENSTUDIO_SUMMARY_MODEL"],
+            "base_url": os.environ.get("AUTOGENSTUDIO_SUMMARY_BASE_URL"),
+            "api_key": os.environ.get("AUTOGENSTUDIO_SUMMARY_API_KEY"),
+            "api_type": os.environ.get("AUTOGENSTUDIO_SUMMARY_API_TYPE"),
+        }
+    ]
+    if os.environ.get("AUTOGENSTUDIO_SUMMARY_MODEL")
+    else None,
+    max_tokens=int(os.environ.get("AUTOGENSTUDIO_SUMMARY_MAX_TOKENS", 512)),
+    max_size=int(os.environ.get("AUTOGENSTUDIO_SUMMARY_CACHE_SIZE", 1024)),
+    http_clients=http_clients,
+)
+# fold the older messages of long sessions into a summary in the background, see SessionCompactor
+compactor = SessionCompactor(
+    dbmanager,
+    summarizer,
+    max_tokens=int(os.environ.get("AUTOGENSTUDIO_COMPACTION_MAX_TOKENS", 8000)),
+    keep_tokens=int(os.environ.get("AUTOGENSTUDIO_COMPACTION_KEEP_TOKENS", 2000)),
+)
+# manage calls to autogen, reusing live workflows across the turns of a session
+chatmanager = AutoGenChatManager(
+    workflow_cache=WorkflowCache(
+        max_size=int(os.environ.get("AUTOGENSTUDIO_WORKFLOW_CACHE_SIZE", 32)),
+        ttl=float(os.environ.get("AUTOGENSTUDIO_WORKFLOW_CACHE_TTL", 1800)),
+    ),
+    persist_workspace=os.environ.get("AUTOGENSTUDIO_PERSIST_WORKSPACE", "true").lower() == "true",
+    completion_cache=get_completion_cache(
+        backend=os.environ.get("AUTOGENSTUDIO_LLM_CACHE", "memory"),
+        path=os.path.join(root_file_path, "llm_cache.sqlite"),
+        max_bytes=int(os.environ.get("AUTOGENSTUDIO_LLM_CACHE_MAX_MB", 256)) * 1024 * 1024,
+    ),
+    template_cache=TemplateCache(max_size=int(os.environ.get("AUTOGENSTUDIO_TEMPLATE_CACHE_SIZE", 256))),
+    http_clients=http_clients,
+    selection_cache=SpeakerSelectionCache(max_size=int(os.environ.get("AUTOGENSTUDIO_SPEAKER_CACHE_SIZE", 4096))),
+    summarizer=summarizer,
+    profiles_dir=folders["profiles_root"],
+)
+# run chats on a bounded worker pool so a long conversation does not block the event loop
+chat_executor = ChatExecutor(
+    max_workers=int(os.environ.get("AUTOGENSTUDIO_CHAT_WORKERS", 4)),
+    max_queue_size=int(os.environ.get("AUTOGENSTUDIO_CHAT_QUEUE_SIZE", 32)),
+    max_per_user=int(os.environ.get("AUTOGENSTUDIO_CHAT_USER_LIMIT", 2)),
+    max_async_runs=int(os.environ.get("AUTOGENSTUDIO_ASYNC_CHAT_LIMIT", 256)),
+)
+# run chats as tasks on the event loop (AutoGenChatManager.achat) instead of on the worker pool
+async_runtime = os.environ.get("AUTOGENSTUDIO_ASYNC_RUNTIME", "false").lower() == "true"
+
+# shared secret of the skills that report metrics, see report_audio_push. Without one, only local reports are accepted
+metrics_token = os.environ.get("AUTOGENSTUDIO_METRICS_TOKEN") or None
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+# context window policy applied when a session history is loaded into agents, unless a request overrides it
+default_history_policy = HistoryPolicy(
+    type=os.environ.get("AUTOGENSTUDIO_HISTORY_POLICY", "all"),
+    max_messages=int(os.environ.get("AUTOGENSTUDIO_HISTORY_MAX_MESSAGES", 0)) or None,
+    max_tokens=int(os.environ.get("AUTOGENSTUDIO_HISTORY_MAX_TOKENS", 0)) or None,
+    summarize_prefix=os.environ.get("AUTOGENSTUDIO_HISTORY_SUMMARIZE_PREFIX", "false").lower() == "true",
+)
 
 
-@api.post("/messages")
-async def add_message(req: ChatWebRequestModel):
-    message = Message(**req.message.dict())
-    user_history = dbutils.get_messages(user_id=message.user_id, session_id=req.message.session_id, dbmanager=dbmanager)
+# profile a sample of the turns that do not request a profile themselves: "spans", "cprofile" or "pyinstrument"
+default_profile = os.environ.get("AUTOGENSTUDIO_PROFILE") or None
+profile_sample_rate = float(os.environ.get("AUTOGENSTUDIO_PROFILE_SAMPLE_RATE", 1.0))
+
+
+async def collect_workspaces():
+    """Periodically delete persistent session workspaces that are too old or exceed the size budget"""
+    interval = float(os.environ.get("AUTOGENSTUDIO_WORKSPACE_GC_INTERVAL", 3600))
+    max_age = float(os.environ.get("AUTOGENSTUDIO_WORKSPACE_MAX_AGE", 7 * 24 * 3600))
+    max_total_bytes = int(os.environ.get("AUTOGENSTUDIO_WORKSPACE_MAX_BYTES", 0)) or None
+    user_root = os.path.join(folders["files_static_root"], "user")
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            deleted = await loop.run_in_executor(None, cleanup_workspaces, user_root, max_age, max_total_bytes)
+            if deleted:
+                print(f"Deleted {len(deleted)} unused workspaces")
+        except Exception:
+            print(traceback.format_exc())
+        await asyncio.sleep(interval)
+
+
+@app.on_event("startup")
+async def start_workspace_collection():
+    if chatmanager.persist_workspace:
+        asyncio.create_task(collect_workspaces())
+
+
+@app.on_event("shutdown")
+def shutdown_chat_executor():
+    chat_executor.shutdown(wait=False)
+
+
+@app.on_event("shutdown")
+def flush_database_writes():
+    dbmanager.stop_write_behind()
 
-    # save incoming message to db
+
+@app.on_event("shutdown")
+def close_http_clients():
+    http_clients.close()
+
+
+@app.on_event("shutdown")
+def stop_compaction():
+    compactor.close()
+
+
+def record_turns(message: Message, on_message=None):
+    """Wrap an on_message callback so that each agent turn of a run is also saved to db"""
+    turn_index = itertools.count()
+
+    def on_turn(iteration: dict):
+        dbutils.create_agent_turn(message, next(turn_index), iteration, dbmanager=dbmanager)
+        if on_message is not None:
+            return on_message(iteration)
+
+    return on_turn
+
+
+def schedule_compaction(message: Message, flow_config) -> None:
+    """Queue a background compaction check of the session of a message, once its turn is saved"""
+    llm_config = flow_config.receiver.config.llm_config if flow_config is not None else None
+    config_list = [sanitize_model(config) for config in llm_config.config_list] if llm_config else None
+    compactor.schedule(message.user_id, message.session_id, config_list)
+
+
+def run_chat(message: Message, history: list, flow_config, work_dir: str, **kwargs) -> Message:
+    """Run a chat on the worker pool and save the incoming message and the assistant response to db"""
+    # the incoming message is saved first, agent turns reference it
     dbutils.create_message(message=message, dbmanager=dbmanager)
+    response_message: Message = chatmanager.chat(
+        message=message,
+        history=history,
+        work_dir=work_dir,
+        flow_config=flow_config,
+        **kwargs,
+    )
+    dbutils.create_response_message(response_message, message, dbmanager=dbmanager, save_turns=not persist_turns)
+    schedule_compaction(message, flow_config)
+    return response_message
+
+
+async def arun_chat(message: Message, history: list, flow_config, work_dir: str, **kwargs) -> Message:
+    """Run a chat on the event loop and save the incoming message and the assistant response to db"""
+    await dbutils.acreate_message(message=message, dbmanager=dbmanager)
+    response_message: Message = await chatmanager.achat(
+        message=message,
+        history=history,
+        work_dir=work_dir,
+        flow_config=flow_config,
+        **kwargs,
+    )
+    save_response = functools.partial(
+        dbutils.create_response_message, response_message, message, dbmanager=dbmanager, save_turns=not persist_turns
+    )
+    await asyncio.get_running_loop().run_in_executor(None, save_response)
+    schedule_compaction(message, flow_config)
+    return response_message
+
+
+async def submit_chat(req: ChatWebRequestModel, **kwargs) -> asyncio.Future:
+    """Admit a chat request on the executor"""
+    message = Message(**req.message.dict())
+    loop = asyncio.get_running_loop()
+    # the session summary of compacted sessions, followed by the messages after it
+    user_history = await loop.run_in_executor(
+        None,
+        lambda: dbutils.get_session_history(
+            user_id=message.user_id, session_id=req.message.session_id, dbmanager=dbmanager
+        ),
+    )
+
     user_dir = os.path.join(folders["files_static_root"], "user", md5_hash(message.user_id))
     os.makedirs(user_dir, exist_ok=True)
 
+    if persist_turns:
+        kwargs["on_message"] = record_turns(message, kwargs.get("on_message", None))
+    profile = req.profile
+    if profile is None and default_profile is not None and random.random() < profile_sample_rate:
+        profile = default_profile
+    chat_kwargs = dict(
+        message=message,
+        history=user_history,
+        flow_config=req.flow_config,
+        work_dir=user_dir,
+        history_policy=req.history_policy or default_history_policy,
+        profile=profile,
+        **kwargs,
+    )
     try:
-        response_message: Message = chatmanager.chat(
-            message=message,
-            history=user_history,
-            work_dir=user_dir,
-            flow_config=req.flow_config,
+        if async_runtime:
+            chat_future = chat_executor.submit_async(message.user_id, arun_chat, **chat_kwargs)
+        else:
+            chat_future = asyncio.wrap_future(chat_executor.submit(message.user_id, run_chat, **chat_kwargs))
+    except ChatQueueFullError as queue_error:
+        raise HTTPException(
+            status_code=429,
+            detail=str(queue_error),
+            headers={"Retry-After": str(queue_error.retry_after)},
         )
 
-        # save assistant response to db
-        dbutils.create_message(message=response_message, dbmanager=dbmanager)
-        response = {
-            "status": True,
-            "message": response_message.content,
-            "metadata": json.loads(response_message.metadata),
-        }
-        return response
+    return chat_future
+
+
+def cached_catalog_response(catalog: str, user_id: str, request: Request, response: Response, message: str):
+    """Serve a user's catalog from the catalog cache, or a 304 if the client's copy is current"""
+    etag, items = catalog_cache.get(catalog, user_id)
+    etag = f'"{etag}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    # let clients keep the catalog but revalidate it on every use
+    response.headers["Cache-Control"] = "no-cache"
+    return {
+        "status": True,
+        "message": message,
+        "data": items,
+    }
+
+
+def catalog_delta_response(catalog: str, item, message: str) -> dict:
+    """Save a catalog item and return only the stored row and the new catalog etag"""
+    row = dbutils.upsert_catalog_items(catalog, [dbutils.catalog_row(catalog, item)], dbmanager=dbmanager)[0]
+    return {
+        "status": True,
+        "message": message,
+        "data": row,
+        "etag": dbutils.get_catalog_etag(catalog, item.user_id, dbmanager=dbmanager),
+    }
+
+
+def chat_response(response_message: Message) -> dict:
+    return {
+        "status": True,
+        "message": response_message.content,
+        "metadata": json.loads(response_message.metadata),
+    }
+
+
+@api.post("/messages")
+async def add_message(req: ChatWebRequestModel):
+    chat_future = await submit_chat(req)
+
+    try:
+        response_message: Message = await chat_future
+        return chat_response(response_message)
     except Exception as ex_error:
         print(traceback.format_exc())
+        metrics.chat_errors.inc()
         return {
             "status": False,
             "message": "Error occurred while processing message: " + str(ex_error),
         }
 
 
+@api.post("/messages/stream")
+async def stream_message(req: ChatWebRequestModel):
+    """
+    Run a chat and stream it as server-sent events: a `turn` event for each agent message as it is recorded,
+    `delta` events with token chunks for agents whose llm_config sets stream=True, and a final `result`
+    (or `error`) event with the same payload as POST /messages.
+    """
+    loop = asyncio.get_running_loop()
+    frames: asyncio.Queue = asyncio.Queue()
+
+    def on_message(iteration: dict) -> None:
+        loop.call_soon_threadsafe(frames.put_nowait, ("turn", iteration))
+
+    def on_delta(content: str) -> None:
+        loop.call_soon_threadsafe(frames.put_nowait, ("delta", {"content": content}))
+
+    chat_task = await submit_chat(req, on_message=on_message, on_delta=on_delta)
+
+    def format_event(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    async def event_stream():
+        while True:
+            next_frame = asyncio.ensure_future(frames.get())
+            done, _ = await asyncio.wait({next_frame, chat_task}, return_when=asyncio.FIRST_COMPLETED)
+            if next_frame in done:
+                yield format_event(*next_frame.result())
+                continue
+            next_frame.cancel()
+            break
+        # frames scheduled before the chat finished are already queued
+        while not frames.empty():
+            yield format_event(*frames.get_nowait())
+        try:
+            yield format_event("result", chat_response(chat_task.result()))
+        except Exception as ex_error:
+            print(traceback.format_exc())
+            metrics.chat_errors.inc()
+            yield format_event(
+                "error",
+                {"status": False, "message": "Error occurred while processing message: " + str(ex_error)},
+            )
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @api.get("/messages")
-async def get_messages(user_id: str = None, session_id: str = None):
+async def get_messages(
+    user_id: str = None, session_id: str = None, limit: int = None, cursor: str = None, include_turns: bool = False
+):
+    """Return a page of messages for a session. Agent turns are loaded separately, unless include_turns is set"""
     if user_id is None:
         raise HTTPException(status_code=400, detail="user_id is required")
     try:
-        user_history = dbutils.get_messages(user_id=user_id, session_id=session_id, dbmanager=dbmanager)
+        user_history = dbutils.get_messages(
+            user_id=user_id, session_id=session_id, dbmanager=dbmanager, limit=limit, cursor=cursor
+        )
+        if include_turns:
+            user_history = dbutils.inline_agent_turns(user_history, dbmanager=dbmanager)
 
         return {
             "status": True,
             "data": user_history,
+            "next_cursor": dbutils.next_cursor(user_history, limit, id_field="msg_id"),
             "message": "Messages retrieved successfully",
         }
     except Exception as ex_error:
@@ -110,13 +435,48 @@ async def get_messages(user_id: str = None, session_id: str = None):
         }
 
 
+@api.get("/messages/{msg_id}/turns")
+async def get_message_turns(msg_id: str, user_id: str = None):
+    """Return the agent turns of a run, msg_id is the turn_msg_id in the metadata of the response message"""
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="user_id is required")
+    try:
+        turns = dbutils.get_agent_turns(user_id=user_id, msg_id=msg_id, dbmanager=dbmanager)
+        return {
+            "status": True,
+            "data": turns,
+            "message": "Agent turns retrieved successfully",
+        }
+    except Exception as ex_error:
+        print(ex_error)
+        return {
+            "status": False,
+            "message": "Error occurred while retrieving agent turns: " + str(ex_error),
+        }
+
+
+@api.get("/messages/{msg_id}/profile")
+async def get_message_profile(msg_id: str, user_id: str = None):
+    """Download the profile captured for a message, profiles are only served to the user who sent the message"""
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="user_id is required")
+    path = chatmanager.profile_file(user_id, msg_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="No profile found for this message")
+    return FileResponse(path, filename=os.path.basename(path))
+
+
 @api.get("/gallery")
-async def get_gallery_items(gallery_id: str = None):
+async def get_gallery_items(gallery_id: str = None, limit: int = None, cursor: str = None, tag: str = None):
+    """Return a gallery item with its transcript, or a listing of gallery items, optionally filtered by tag"""
     try:
-        gallery = dbutils.get_gallery(gallery_id=gallery_id, dbmanager=dbmanager)
+        gallery = dbutils.get_gallery(
+            gallery_id=gallery_id, dbmanager=dbmanager, limit=limit, cursor=cursor, tag=tag
+        )
         return {
             "status": True,
             "data": gallery,
+            "next_cursor": dbutils.next_cursor(gallery, limit),
             "message": "Gallery items retrieved successfully",
         }
     except Exception as ex_error:
@@ -128,17 +488,18 @@ async def get_gallery_items(gallery_id: str = None):
 
 
 @api.get("/sessions")
-async def get_user_sessions(user_id: str = None):
-    """Return a list of all sessions for a user"""
+async def get_user_sessions(user_id: str = None, limit: int = None, cursor: str = None):
+    """Return a page of sessions for a user, or all sessions if no limit is given"""
     if user_id is None:
         raise HTTPException(status_code=400, detail="user_id is required")
 
     try:
-        user_sessions = dbutils.get_sessions(user_id=user_id, dbmanager=dbmanager)
+        user_sessions = dbutils.get_sessions(user_id=user_id, dbmanager=dbmanager, limit=limit, cursor=cursor)
 
         return {
             "status": True,
             "data": user_sessions,
+            "next_cursor": dbutils.next_cursor(user_sessions, limit),
             "message": "Sessions retrieved successfully",
         }
     except Exception as ex_error:
@@ -149,6 +510,27 @@ async def get_user_sessions(user_id: str = None):
         }
 
 
+@api.get("/sessions/{session_id}/stats")
+async def get_session_stats(session_id: str, user_id: str = None):
+    """Return the token, latency and cache usage of a session, in total, per agent and per response"""
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="user_id is required")
+
+    try:
+        stats = dbutils.get_session_stats(user_id=user_id, session_id=session_id, dbmanager=dbmanager)
+        return {
+            "status": True,
+            "data": stats,
+            "message": "Session stats retrieved successfully",
+        }
+    except Exception as ex_error:
+        print(ex_error)
+        return {
+            "status": False,
+            "message": "Error occurred while retrieving session stats: " + str(ex_error),
+        }
+
+
 @api.post("/sessions")
 async def create_user_session(req: DBWebRequestModel):
     """Create a new session for a user"""
@@ -230,15 +612,9 @@ async def remove_message(req: DeleteMessageWebRequestModel):
 
 
 @api.get("/skills")
-async def get_user_skills(user_id: str):
+async def get_user_skills(user_id: str, request: Request, response: Response):
     try:
-        skills = dbutils.get_skills(user_id, dbmanager=dbmanager)
-
-        return {
-            "status": True,
-            "message": "Skills retrieved successfully",
-            "data": skills,
-        }
+        return cached_catalog_response("skills", user_id, request, response, "Skills retrieved successfully")
     except Exception as ex_error:
         print(ex_error)
         return {
@@ -248,8 +624,10 @@ async def get_user_skills(user_id: str):
 
 
 @api.post("/skills")
-async def create_user_skills(req: DBWebRequestModel):
+async def create_user_skills(req: DBWebRequestModel, delta: bool = False):
     try:
+        if delta:
+            return catalog_delta_response("skills", req.skill, "Skill saved successfully")
         skills = dbutils.upsert_skill(skill=req.skill, dbmanager=dbmanager)
         return {
             "status": True,
@@ -287,15 +665,9 @@ async def delete_user_skills(req: DBWebRequestModel):
 
 
 @api.get("/agents")
-async def get_user_agents(user_id: str):
+async def get_user_agents(user_id: str, request: Request, response: Response):
     try:
-        agents = dbutils.get_agents(user_id, dbmanager=dbmanager)
-
-        return {
-            "status": True,
-            "message": "Agents retrieved successfully",
-            "data": agents,
-        }
+        return cached_catalog_response("agents", user_id, request, response, "Agents retrieved successfully")
     except Exception as ex_error:
         print(ex_error)
         return {
@@ -305,10 +677,12 @@ async def get_user_agents(user_id: str):
 
 
 @api.post("/agents")
-async def create_user_agents(req: DBWebRequestModel):
-    """Create a new agent for a user"""
+async def create_user_agents(req: DBWebRequestModel, delta: bool = False):
+    """Create a new agent for a user, with delta=true only the saved agent and the catalog etag are returned"""
 
     try:
+        if delta:
+            return catalog_delta_response("agents", req.agent, "Agent created successfully")
         agents = dbutils.upsert_agent(agent_flow_spec=req.agent, dbmanager=dbmanager)
 
         return {
@@ -347,15 +721,9 @@ async def delete_user_agent(req: DBWebRequestModel):
 
 
 @api.get("/models")
-async def get_user_models(user_id: str):
+async def get_user_models(user_id: str, request: Request, response: Response):
     try:
-        models = dbutils.get_models(user_id, dbmanager=dbmanager)
-
-        return {
-            "status": True,
-            "message": "Models retrieved successfully",
-            "data": models,
-        }
+        return cached_catalog_response("models", user_id, request, response, "Models retrieved successfully")
     except Exception as ex_error:
         print(ex_error)
         return {
@@ -365,10 +733,12 @@ async def get_user_models(user_id: str):
 
 
 @api.post("/models")
-async def create_user_models(req: DBWebRequestModel):
-    """Create a new model for a user"""
+async def create_user_models(req: DBWebRequestModel, delta: bool = False):
+    """Create a new model for a user, with delta=true only the saved model and the catalog etag are returned"""
 
     try:
+        if delta:
+            return catalog_delta_response("models", req.model, "Model created successfully")
         models = dbutils.upsert_model(model=req.model, dbmanager=dbmanager)
 
         return {
@@ -390,7 +760,7 @@ async def test_user_models(req: DBWebRequestModel):
     """Test a model to verify it works"""
 
     try:
-        response = test_model(model=req.model)
+        response = test_model(model=req.model, http_clients=http_clients)
         return {
             "status": True,
             "message": "Model tested successfully",
@@ -433,15 +803,9 @@ async def delete_user_model(req: DBWebRequestModel):
 
 
 @api.get("/workflows")
-async def get_user_workflows(user_id: str):
+async def get_user_workflows(user_id: str, request: Request, response: Response):
     try:
-        workflows = dbutils.get_workflows(user_id, dbmanager=dbmanager)
-
-        return {
-            "status": True,
-            "message": "Workflows retrieved successfully",
-            "data": workflows,
-        }
+        return cached_catalog_response("workflows", user_id, request, response, "Workflows retrieved successfully")
     except Exception as ex_error:
         print(ex_error)
         return {
@@ -451,9 +815,11 @@ async def get_user_workflows(user_id: str):
 
 
 @api.post("/workflows")
-async def create_user_workflow(req: DBWebRequestModel):
-    """Create a new workflow for a user"""
+async def create_user_workflow(req: DBWebRequestModel, delta: bool = False):
+    """Create a new workflow for a user, with delta=true only the saved workflow and the catalog etag are returned"""
     try:
+        if delta:
+            return catalog_delta_response("workflows", req.workflow, "Workflow created successfully")
         workflow = dbutils.upsert_workflow(workflow=req.workflow, dbmanager=dbmanager)
         return {
             "status": True,
@@ -489,6 +855,109 @@ async def delete_user_workflow(req: DBWebRequestModel):
         }
 
 
+@api.post("/catalog/import")
+async def import_user_catalog(req: CatalogImportWebRequestModel):
+    """Create or update many models, skills, agents and workflows for a user in one transaction"""
+
+    try:
+        items = {}
+        for catalog in ("models", "skills", "agents", "workflows"):
+            catalog_items = getattr(req, catalog) or []
+            for item in catalog_items:
+                item.user_id = req.user_id
+            if catalog_items:
+                items[catalog] = catalog_items
+        rows = dbutils.import_catalog(items, dbmanager=dbmanager)
+        return {
+            "status": True,
+            "message": "Catalog imported successfully",
+            "data": rows,
+            "etags": {catalog: dbutils.get_catalog_etag(catalog, req.user_id, dbmanager=dbmanager) for catalog in rows},
+        }
+
+    except Exception as ex_error:
+        print(traceback.format_exc())
+        return {
+            "status": False,
+            "message": "Error occurred while importing catalog: " + str(ex_error),
+        }
+
+
+@api.get("/executor/stats")
+async def get_executor_stats():
+    """Return queue depth and worker usage of the chat executor"""
+    return {
+        "status": True,
+        "message": "Executor stats retrieved successfully",
+        "data": {
+            **chat_executor.stats(),
+            "workflow_cache": chatmanager.workflow_cache.stats(),
+            "write_queue": dbmanager.write_queue.stats() if dbmanager.write_queue else None,
+            "compaction": compactor.stats(),
+        },
+    }
+
+
+@api.get("/cache/stats")
+async def get_cache_stats():
+    """Return hit/miss counters and size of the completion, catalog, template, speaker selection and summary caches"""
+    completion_cache = chatmanager.completion_cache
+    return {
+        "status": True,
+        "message": "Cache stats retrieved successfully",
+        "data": {
+            "completion": completion_cache.stats() if completion_cache else None,
+            "catalog": catalog_cache.stats(),
+            "templates": chatmanager.template_cache.stats() if chatmanager.template_cache else None,
+            "speaker_selection": chatmanager.selection_cache.stats() if chatmanager.selection_cache else None,
+            "summaries": summarizer.stats(),
+        },
+    }
+
+
+@api.get("/http/stats")
+async def get_http_stats():
+    """Return connection pool usage of the shared LLM HTTP clients"""
+    return {
+        "status": True,
+        "message": "HTTP client stats retrieved successfully",
+        "data": http_clients.stats(),
+    }
+
+
+@api.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Return the server metrics in the Prometheus text exposition format"""
+    executor_stats = chat_executor.stats()
+    for state in ("running", "queued", "async_running"):
+        metrics.chats_in_flight.set(executor_stats[state], state=state)
+    return PlainTextResponse(metrics.registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def authorize_metrics_report(request: Request) -> None:
+    """Accept metric reports that carry the AUTOGENSTUDIO_METRICS_TOKEN or, if none is set, come from this host"""
+    if metrics_token is not None:
+        token = request.headers.get("X-Metrics-Token", "")
+        if not secrets.compare_digest(token.encode(), metrics_token.encode()):
+            raise HTTPException(status_code=403, detail="Invalid metrics token")
+    elif request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=403, detail="Metrics can only be reported from the server host")
+
+
+@api.post("/metrics/audio_push")
+async def report_audio_push(req: AudioPushMetricWebRequestModel, request: Request):
+    """
+    Record the duration of an Audio2Face audio push made by an audio skill, see AUTOGENSTUDIO_METRICS_URL. The
+    mode is validated by the request model, so the metric labels stay bounded.
+    """
+    authorize_metrics_report(request)
+    metrics.audio_push_duration.observe(req.seconds, mode=req.mode, status="success" if req.success else "error")
+    return {
+        "status": True,
+        "message": "Audio push recorded",
+    }
+
+
 @api.get("/version")
 async def get_version():
     return {
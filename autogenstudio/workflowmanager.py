@@ -1,8 +1,30 @@
+import asyncio
+import contextlib
+import copy
+import inspect
+import json
 import os
-from typing import List, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from typing import Any, Callable, ContextManager, Dict, List, NamedTuple, Optional, Tuple
 import autogen
-from .datamodel import AgentConfig, AgentFlowSpec, AgentWorkFlowConfig, Message
-from .utils import get_skills_from_prompt, clear_folder, sanitize_model
+from .groupchat import SpeakerSelectionCache, StudioGroupChat
+from .datamodel import AgentConfig, AgentFlowSpec, AgentWorkFlowConfig, HistoryPolicy, Message
+from .utils import (
+    SKILLS_INSTRUCTION,
+    apply_history_policy,
+    clear_folder,
+    get_skills_file_content,
+    materialize_file,
+    md5_hash,
+    sanitize_model,
+)
+from .utils.httpclients import HTTPClientPool
+from .utils.llmcache import CachedOpenAIWrapper, CompletionCache
+from .utils.profiling import TurnProfiler
+from .utils.usage import MeteredClient, UsageMeter
 from datetime import datetime
 
 
@@ -17,6 +39,14 @@ class AutoGenWorkFlowManager:
         history: Optional[List[Message]] = None,
         work_dir: str = None,
         clear_work_dir: bool = True,
+        on_message: Optional[Callable[[Dict[str, Any]], None]] = None,
+        history_policy: Optional[HistoryPolicy] = None,
+        completion_cache: Optional[CompletionCache] = None,
+        template_cache: Optional["TemplateCache"] = None,
+        http_clients: Optional[HTTPClientPool] = None,
+        selection_cache: Optional[SpeakerSelectionCache] = None,
+        profiler: Optional[TurnProfiler] = None,
+        user_id: Optional[str] = None,
     ) -> None:
         """
         Initializes the AutoGenFlow with agents specified in the config and optional
@@ -25,30 +55,75 @@ class AutoGenWorkFlowManager:
         Args:
             config: The configuration settings for the sender and receiver agents.
             history: An optional list of previous messages to populate the agents' history.
+            on_message: An optional callback invoked with each agent message as soon as it is recorded. With
+                arun() it may be a coroutine function.
+            history_policy: An optional context window policy applied to the history, all messages are loaded if None.
+            completion_cache: An optional completion cache, used if the workflow enables response_cache.
+            template_cache: An optional cache of compiled agent templates, shared across workflow instances.
+            http_clients: An optional pool of shared HTTP clients used by the agents' LLM clients.
+            selection_cache: An optional cache of group chat speaker selection decisions.
+            profiler: An optional profiler of the current turn, timing the construction and run phases.
+            user_id: The user running the workflow. Completion cache entries are scoped to the user.
 
         """
         self.work_dir = work_dir or "work_dir"
+        self.on_message = on_message
+        # callback invoked with the streamed chunks of the agents' completions, set per turn
+        self.on_delta = None
+        # True while arun() drives the chat, selects which of the reply hooks records messages
+        self.running_async = False
+        self.history_policy = history_policy
+        self.completion_cache = completion_cache if config.response_cache else None
+        self.user_id = user_id
         if clear_work_dir:
             clear_folder(self.work_dir)
 
-        # given the config, return an AutoGen agent object
-        self.sender = self.load(config.sender)
-        # given the config, return an AutoGen agent object
-        self.receiver = self.load(config.receiver)
+        self.http_clients = http_clients
+        self.selection_cache = selection_cache
+        self.profiler = profiler
+        # LLM and code execution usage of the agents, attributed to the messages they send
+        self.usage = UsageMeter()
+        # compile the specs once (or reuse the cached templates), then instantiate the agents from the templates
+        with self.span("compile_workflow"):
+            self.template = template_cache.get(config) if template_cache is not None else compile_workflow(config)
+        with self.span("instantiate_agents"):
+            self.sender = self.instantiate(self.template.sender)
+            # a group chat receiver includes the sender in its agents
+            self.receiver = self.instantiate(self.template.receiver, sender=self.sender)
 
-        if config.receiver.type == "groupchat":
-            # append self.sender to the list of agents
-            self.receiver._groupchat.agents.append(self.sender)
-            print(self.receiver)
         self.agent_history = []
+        # (message count, last msg_id) of the persisted session history the agents currently hold
+        self.history_marker = history_marker(history)
 
         if history:
-            self.populate_history(history)
+            with self.span("populate_history"):
+                self.populate_history(history)
 
-    def process_reply(self, recipient, messages, sender, config):
-        if "callback" in config and config["callback"] is not None:
-            callback = config["callback"]
-            callback(sender, recipient, messages[-1])
+    def span(self, name: str) -> ContextManager[None]:
+        """
+        Time a phase of the current turn, if the turn is profiled.
+
+        Args:
+            name: The name of the phase.
+        """
+        return self.profiler.span(name) if self.profiler is not None else contextlib.nullcontext()
+
+    def record_iteration(self, recipient, messages, sender) -> Dict[str, Any]:
+        """
+        Record the last message of an agent exchange in the agent history.
+
+        Returns:
+            The recorded iteration.
+        """
+        iteration = self.build_iteration(recipient, messages, sender, self.usage)
+        self.agent_history.append(iteration)
+        return iteration
+
+    def build_iteration(self, recipient, messages, sender, usage_meter: UsageMeter) -> Dict[str, Any]:
+        """
+        Build the agent history entry of the last message of an agent exchange, with the usage the sender
+        recorded in the usage meter since its previous message.
+        """
         last_message = messages[-1]
 
         sender = sender.name
@@ -62,9 +137,52 @@ class AutoGenWorkFlowManager:
             "message": last_message,
             "timestamp": datetime.now().isoformat(),
         }
-        self.agent_history.append(iteration)
+        usage = usage_meter.take(sender)
+        if usage is not None:
+            iteration["usage"] = usage
+        return iteration
+
+    def process_reply(self, recipient, messages, sender, config):
+        # async chats call sync reply functions as well, a_process_reply handles them
+        if self.running_async:
+            return False, None
+        if "callback" in config and config["callback"] is not None:
+            callback = config["callback"]
+            callback(sender, recipient, messages[-1])
+        iteration = self.record_iteration(recipient, messages, sender)
+        if self.on_message is not None:
+            self.on_message(iteration)
+        return False, None
+
+    async def a_process_reply(self, recipient, messages, sender, config):
+        if not self.running_async:
+            return False, None
+        if "callback" in config and config["callback"] is not None:
+            result = config["callback"](sender, recipient, messages[-1])
+            if inspect.isawaitable(result):
+                await result
+        iteration = self.record_iteration(recipient, messages, sender)
+        if self.on_message is not None:
+            result = self.on_message(iteration)
+            if inspect.isawaitable(result):
+                await result
         return False, None
 
+    def register_reply_hooks(self, agent: autogen.Agent) -> None:
+        """
+        Register the hooks that record agent messages: process_reply for run() and a_process_reply for arun().
+
+        Args:
+            agent: The agent to register the hooks on.
+        """
+        agent.register_reply([autogen.Agent, None], reply_func=self.process_reply, config={"callback": None})
+        agent.register_reply(
+            [autogen.Agent, None],
+            reply_func=self.a_process_reply,
+            config={"callback": None},
+            ignore_async_in_sync_chat=True,
+        )
+
     def _sanitize_history_message(self, message: str) -> str:
         """
         Sanitizes the message e.g. remove references to execution completed
@@ -82,78 +200,117 @@ class AutoGenWorkFlowManager:
 
     def populate_history(self, history: List[Message]) -> None:
         """
-        Populates the agent message history from the provided list of messages.
+        Populates the agent message history from the provided list of messages. The messages selected by the
+        history policy are written directly into the sender's and receiver's message stores in one pass,
+        without going through send() and the registered reply hooks.
 
         Args:
             history: A list of messages to populate the agents' history.
         """
+        messages = []
         for msg in history:
             if isinstance(msg, dict):
-                msg = Message(**msg)
-            if msg.role == "user":
-                self.sender.send(
-                    msg.content,
-                    self.receiver,
-                    request_reply=False,
-                )
-            elif msg.role == "assistant":
-                self.receiver.send(
-                    msg.content,
-                    self.sender,
-                    request_reply=False,
-                )
+                messages.append({"role": msg["role"], "content": msg["content"]})
+            else:
+                messages.append({"role": msg.role, "content": msg.content})
+            if messages[-1]["role"] == "summary":
+                # the rolling summary of a compacted session, see SessionCompactor
+                content = f"Summary of the earlier conversation:\n\n{messages[-1]['content']}"
+                messages[-1] = {"role": "user", "content": content}
+        messages = apply_history_policy(messages, self.history_policy)
+
+        # a message sent by an agent is stored as "assistant" on its side and as "user" on the other side
+        sender_messages = self.sender._oai_messages[self.receiver]
+        receiver_messages = self.receiver._oai_messages[self.sender]
+        for msg in messages:
+            if msg["role"] == "user":
+                sender_messages.append({"content": msg["content"], "role": "assistant"})
+                receiver_messages.append({"content": msg["content"], "role": "user"})
+            elif msg["role"] == "assistant":
+                sender_messages.append({"content": msg["content"], "role": "user"})
+                receiver_messages.append({"content": msg["content"], "role": "assistant"})
 
-    def sanitize_agent_spec(self, agent_spec: AgentFlowSpec) -> AgentFlowSpec:
+    def reset_history(self, history: List[Message], history_policy: Optional[HistoryPolicy]) -> None:
         """
-        Sanitizes the agent spec by setting loading defaults
+        Resets the agents of a cached flow to the state of a new flow for the same session history: the messages
+        of the previous turns are cleared and the agents are populated from the history with the history policy
+        of the new turn, so that a reused flow and a new flow start the turn with the same context.
 
         Args:
-            config: The agent configuration to be sanitized.
-            agent_type: The type of the agent.
+            history: The session history of the turn.
+            history_policy: The context window policy of the turn.
+        """
+        self.history_policy = history_policy
+        agents = [self.sender, self.receiver]
+        groupchat = getattr(self.receiver, "_groupchat", None)
+        if groupchat is not None:
+            groupchat.reset()
+            agents.extend(agent for agent in groupchat.agents if agent is not self.sender)
+        for agent in agents:
+            agent.clear_history()
+        if history:
+            with self.span("populate_history"):
+                self.populate_history(history)
 
-        Returns:
-            The sanitized agent configuration.
+    def reset_workspace(self) -> None:
+        """
+        Clears the work dir of a cached flow, as for a new flow created with clear_work_dir, and writes the skills
+        files of its agents again.
         """
+        clear_folder(self.work_dir)
+        for template in (self.template.sender, self.template.receiver):
+            self.materialize_skills(template, self.work_dir)
 
-        agent_spec.config.is_termination_msg = agent_spec.config.is_termination_msg or (
-            lambda x: "TERMINATE" in x.get("content", "").rstrip()[-20:]
-        )
+    def materialize_skills(self, template: "CompiledAgent", work_dir: str) -> None:
+        """
+        Writes the skills file of an agent template, and of the agents of a group chat template, to a work dir.
+        """
+        if template.skills_file is not None:
+            materialize_file(os.path.join(work_dir, "skills.py"), template.skills_file)
+        for child in template.agents:
+            self.materialize_skills(child, work_dir)
 
-        def get_default_system_message(agent_type: str) -> str:
-            if agent_type == "assistant":
-                return autogen.AssistantAgent.DEFAULT_SYSTEM_MESSAGE
-            else:
-                return "You are a helpful AI Assistant."
-
-        # sanitize llm_config if present
-        if agent_spec.config.llm_config is not False:
-            config_list = []
-            for llm in agent_spec.config.llm_config.config_list:
-                # check if api_key is present either in llm or env variable
-                if "api_key" not in llm and "OPENAI_API_KEY" not in os.environ:
-                    error_message = f"api_key is not present in llm_config or OPENAI_API_KEY env variable for agent ** {agent_spec.config.name}**. Update your workflow to provide an api_key to use the LLM."
-                    raise ValueError(error_message)
-
-                # only add key if value is not None
-                sanitized_llm = sanitize_model(llm)
-                config_list.append(sanitized_llm)
-            agent_spec.config.llm_config.config_list = config_list
-        if agent_spec.config.code_execution_config is not False:
-            code_execution_config = agent_spec.config.code_execution_config or {}
-            code_execution_config["work_dir"] = self.work_dir
-            # tbd check if docker is installed
-            code_execution_config["use_docker"] = False
-            agent_spec.config.code_execution_config = code_execution_config
-        if agent_spec.skills:
-            # get skill prompt, also write skills to a file named skills.py
-            skills_prompt = ""
-            skills_prompt = get_skills_from_prompt(agent_spec.skills, self.work_dir)
-            if agent_spec.config.system_message:
-                agent_spec.config.system_message = agent_spec.config.system_message + "\n\n" + skills_prompt
-            else:
-                agent_spec.config.system_message = get_default_system_message(agent_spec.type) + "\n\n" + skills_prompt
+    def instantiate(
+        self,
+        template: "CompiledAgent",
+        work_dir: Optional[str] = None,
+        sender: Optional[autogen.Agent] = None,
+        usage_meter: Optional[UsageMeter] = None,
+    ) -> autogen.Agent:
+        """
+        Creates an agent from a compiled template, writing its skills file to the work dir.
+
+        Args:
+            template: The compiled agent template, see compile_agent.
+            work_dir: The code execution folder of the agent, the work_dir of the workflow if None.
+            sender: The agent that starts the chat with a group chat, added to the group chat agents before the
+                group chat is created, so that its speaker transitions cover the sender too.
+            usage_meter: The usage meter of the agent, the usage meter of the workflow if None.
+
+        Returns:
+            An instance of the agent.
+        """
+        work_dir = work_dir or self.work_dir
+        if template.skills_file is not None:
+            materialize_file(os.path.join(work_dir, "skills.py"), template.skills_file)
+        config = copy.deepcopy(template.config)
+        if config.get("code_execution_config") is not False:
+            config["code_execution_config"]["work_dir"] = work_dir
+        self.attach_http_clients(config)
 
-        return agent_spec
+        if template.type == "groupchat":
+            agents = [self.instantiate(child, work_dir, usage_meter=usage_meter) for child in template.agents]
+            if sender is not None:
+                agents.append(sender)
+            groupchat = StudioGroupChat(
+                agents=agents, selection_cache=self.selection_cache, **copy.deepcopy(template.groupchat_config)
+            )
+            agent = autogen.GroupChatManager(groupchat=groupchat, **config)
+            self.register_reply_hooks(agent)
+            self.attach_completion_cache(agent)
+            self.attach_usage_meter(agent, usage_meter)
+            return agent
+        return self.create_agent(config, template.type, usage_meter)
 
     def load(self, agent_spec: AgentFlowSpec) -> autogen.Agent:
         """
@@ -165,21 +322,7 @@ class AutoGenWorkFlowManager:
         Returns:
             An instance of the loaded agent.
         """
-        agent_spec = self.sanitize_agent_spec(agent_spec)
-        if agent_spec.type == "groupchat":
-            agents = [
-                self.load(self.sanitize_agent_spec(agent_config)) for agent_config in agent_spec.groupchat_config.agents
-            ]
-            group_chat_config = agent_spec.groupchat_config.dict()
-            group_chat_config["agents"] = agents
-            groupchat = autogen.GroupChat(**group_chat_config)
-            agent = autogen.GroupChatManager(groupchat=groupchat, **agent_spec.config.dict())
-            agent.register_reply([autogen.Agent, None], reply_func=self.process_reply, config={"callback": None})
-            return agent
-
-        else:
-            agent = self.load_agent_config(agent_spec.config, agent_spec.type)
-            return agent
+        return self.instantiate(compile_agent(agent_spec))
 
     def load_agent_config(self, agent_config: AgentConfig, agent_type: str) -> autogen.Agent:
         """
@@ -192,15 +335,90 @@ class AutoGenWorkFlowManager:
         Returns:
             An instance of the loaded agent.
         """
+        config = agent_config.dict()
+        self.attach_http_clients(config)
+        return self.create_agent(config, agent_type)
+
+    def create_agent(
+        self, config: Dict[str, Any], agent_type: str, usage_meter: Optional[UsageMeter] = None
+    ) -> autogen.Agent:
+        """
+        Creates an assistant or user proxy agent from its keyword arguments and registers the studio hooks.
+
+        Args:
+            config: The keyword arguments of the agent.
+            agent_type: The type of the agent, assistant or userproxy.
+            usage_meter: The usage meter of the agent, the usage meter of the workflow if None.
+
+        Returns:
+            An instance of the agent.
+        """
         if agent_type == "assistant":
-            agent = autogen.AssistantAgent(**agent_config.dict())
+            agent = autogen.AssistantAgent(**config)
         elif agent_type == "userproxy":
-            agent = autogen.UserProxyAgent(**agent_config.dict())
+            agent = autogen.UserProxyAgent(**config)
         else:
             raise ValueError(f"Unknown agent type: {agent_type}")
-        agent.register_reply([autogen.Agent, None], reply_func=self.process_reply, config={"callback": None})
+        self.register_reply_hooks(agent)
+        self.attach_completion_cache(agent)
+        self.attach_usage_meter(agent, usage_meter)
         return agent
 
+    def attach_http_clients(self, config: Dict[str, Any]) -> None:
+        """
+        Point the LLM configs of an agent at the shared HTTP clients, if a client pool is configured.
+
+        Args:
+            config: The keyword arguments of the agent, modified in place.
+        """
+        llm_config = config.get("llm_config")
+        if self.http_clients is None or not isinstance(llm_config, dict) or not llm_config.get("config_list"):
+            return
+        llm_config["config_list"] = self.http_clients.configure(llm_config["config_list"])
+
+    def attach_completion_cache(self, agent: autogen.Agent) -> None:
+        """
+        Route the LLM calls of an agent through the completion cache, if one is configured.
+
+        Args:
+            agent: The agent whose client is wrapped.
+        """
+        if self.completion_cache is None or getattr(agent, "client", None) is None:
+            return
+        agent.client = CachedOpenAIWrapper(agent.client, self.completion_cache, agent.llm_config, scope=self.user_id)
+
+    def attach_usage_meter(self, agent: autogen.Agent, usage_meter: Optional[UsageMeter] = None) -> None:
+        """
+        Record the LLM calls and code executions of an agent in the usage meter.
+
+        Args:
+            agent: The agent whose client and code execution are wrapped.
+            usage_meter: The usage meter to record in, the usage meter of the workflow if None.
+        """
+        meter = usage_meter if usage_meter is not None else self.usage
+        if getattr(agent, "client", None) is not None:
+            stream = isinstance(agent.llm_config, dict) and bool(agent.llm_config.get("stream"))
+            agent.client = MeteredClient(agent.client, meter, agent.name, stream=stream, on_delta=self.forward_delta)
+        execute_code_blocks = getattr(agent, "execute_code_blocks", None)
+        if execute_code_blocks is None:
+            return
+
+        def metered_execute_code_blocks(code_blocks):
+            start_time = time.time()
+            try:
+                return execute_code_blocks(code_blocks)
+            finally:
+                meter.record(agent.name, code_execution_time=time.time() - start_time)
+
+        agent.execute_code_blocks = metered_execute_code_blocks
+
+    def forward_delta(self, content: str) -> None:
+        """
+        Forward a streamed completion chunk to the on_delta callback of the current turn.
+        """
+        if self.on_delta is not None:
+            self.on_delta(content)
+
     def run(self, message: str, clear_history: bool = False) -> None:
         """
         Initiates a chat between the sender and receiver agents with an initial message
@@ -210,9 +428,607 @@ class AutoGenWorkFlowManager:
             message: The initial message to start the chat.
             clear_history: If set to True, clears the chat history before initiating.
         """
+        self.running_async = False
         self.sender.initiate_chat(
             self.receiver,
             message=message,
             clear_history=clear_history,
         )
         # pass
+
+    async def arun(self, message: str, clear_history: bool = False) -> None:
+        """
+        Asynchronous variant of run. The chat runs on the event loop with a_initiate_chat, and on_message may
+        be a coroutine function.
+
+        Args:
+            message: The initial message to start the chat.
+            clear_history: If set to True, clears the chat history before initiating.
+        """
+        self.running_async = True
+        try:
+            await self.sender.a_initiate_chat(
+                self.receiver,
+                message=message,
+                clear_history=clear_history,
+            )
+        finally:
+            self.running_async = False
+
+
+class WorkflowBranch:
+    """
+    One branch of a parallel workflow: a chat between a copy of the sender and the branch agent. The usage and
+    agent messages of the branch are kept apart from the workflow until the join merges them, so that a branch
+    left running after the join cannot add to a turn that has already been recorded.
+    """
+
+    def __init__(
+        self, index: int, sender: autogen.Agent, receiver: autogen.Agent, usage: Optional[UsageMeter] = None
+    ) -> None:
+        self.index = index
+        self.sender = sender
+        self.receiver = receiver
+        self.usage = usage if usage is not None else UsageMeter()
+        self.agent_history = []
+        self.result = {"name": receiver.name, "status": "pending", "time": None, "content": None}
+        self.start_time = None
+
+    def agents(self) -> List[autogen.Agent]:
+        """
+        Return the agents of the branch, including the agents of a group chat receiver.
+        """
+        agents = [self.sender, self.receiver]
+        groupchat = getattr(self.receiver, "_groupchat", None)
+        if groupchat is not None:
+            agents.extend(agent for agent in groupchat.agents if agent is not self.sender)
+        return agents
+
+    def start(self) -> float:
+        self.result["status"] = "running"
+        self.start_time = time.time()
+        return self.start_time
+
+    def cancel(self) -> None:
+        """
+        Mark the branch as cancelled, with the time it ran until the join.
+        """
+        if self.start_time is not None:
+            self.result["time"] = time.time() - self.start_time
+        self.result["status"] = "cancelled"
+
+    def finish(self, start_time: float, error: Optional[BaseException] = None) -> Dict[str, Any]:
+        """
+        Record the outcome of the branch chat, unless the join has already cancelled the branch.
+        """
+        if self.result["status"] == "cancelled":
+            return self.result
+        self.result["time"] = time.time() - start_time
+        if error is not None:
+            self.result["status"] = "failed"
+            self.result["content"] = str(error)
+        else:
+            last_message = self.sender.last_message(self.receiver) or {}
+            self.result["status"] = "completed"
+            self.result["content"] = last_message.get("content") or ""
+        return self.result
+
+
+class ParallelWorkFlowManager(AutoGenWorkFlowManager):
+    """
+    Runs a parallel workflow: the task is sent to every branch agent (or group chat) at the same time, each in
+    its own chat with a copy of the sender and in its own work folder. Once the join condition of the workflow
+    is met, the receiver combines the branch results in a chat with the sender.
+
+    Branches that are still running when the join completes are stopped at their next reply.
+    """
+
+    def __init__(self, config: AgentWorkFlowConfig, **kwargs: Any) -> None:
+        """
+        Args:
+            config: The configuration of the parallel workflow.
+            **kwargs: The arguments of AutoGenWorkFlowManager.
+        """
+        if config.parallel_config is None or not config.parallel_config.branches:
+            raise ValueError("A parallel workflow needs a parallel_config with at least one branch")
+        super().__init__(config, **kwargs)
+        self.parallel_config = config.parallel_config
+        # agents of the branches left behind by the join, their replies end the branch chat
+        self.stopped_agents = set()
+        # the branch of each branch agent, whose messages are recorded in the branch until the join
+        self.agent_branches = {}
+        self.branch_results = []
+
+    def create_branches(self) -> List[WorkflowBranch]:
+        """
+        Instantiate the branch agents, each branch with its own sender and work folder.
+        """
+        branches = []
+        self.agent_branches = {}
+        for index, template in enumerate(self.template.branches):
+            work_dir = os.path.join(self.work_dir, f"branch_{index}")
+            os.makedirs(work_dir, exist_ok=True)
+            usage = UsageMeter()
+            sender = self.instantiate(self.template.sender, work_dir, usage_meter=usage)
+            receiver = self.instantiate(template, work_dir, sender=sender, usage_meter=usage)
+            branch = WorkflowBranch(index, sender, receiver, usage)
+            self.agent_branches.update((agent, branch) for agent in branch.agents())
+            branches.append(branch)
+        return branches
+
+    def required_results(self, branch_count: int) -> int:
+        """
+        Return the number of completed branches the join waits for.
+        """
+        if self.parallel_config.join == "first":
+            return 1
+        if self.parallel_config.join == "quorum":
+            return min(branch_count, self.parallel_config.quorum or branch_count // 2 + 1)
+        return branch_count
+
+    def stop_branches(self, branches: List[WorkflowBranch]) -> None:
+        """
+        Mark the unfinished branches as cancelled and stop their agents.
+        """
+        for branch in branches:
+            if branch.result["status"] in ("pending", "running"):
+                branch.cancel()
+                self.stopped_agents.update(branch.agents())
+
+    def join_branches(self, branches: List[WorkflowBranch]) -> None:
+        """
+        Stop the unfinished branches and merge the usage and agent messages of every branch, as of the join,
+        into the workflow. Whatever a stopped branch records afterwards stays in the branch.
+        """
+        self.stop_branches(branches)
+        self.agent_branches = {}
+        iterations = []
+        for branch in branches:
+            iterations.extend(list(branch.agent_history))
+            self.usage.merge(branch.usage.total())
+        self.agent_history.extend(sorted(iterations, key=lambda iteration: iteration["timestamp"]))
+
+    def record_iteration(self, recipient, messages, sender) -> Dict[str, Any]:
+        branch = self.agent_branches.get(recipient)
+        if branch is None:
+            return super().record_iteration(recipient, messages, sender)
+        iteration = self.build_iteration(recipient, messages, sender, branch.usage)
+        branch.agent_history.append(iteration)
+        return iteration
+
+    def process_reply(self, recipient, messages, sender, config):
+        if recipient in self.stopped_agents:
+            # a final empty reply ends the chat of a branch the join has left behind
+            return True, None
+        return super().process_reply(recipient, messages, sender, config)
+
+    async def a_process_reply(self, recipient, messages, sender, config):
+        if recipient in self.stopped_agents:
+            return True, None
+        return await super().a_process_reply(recipient, messages, sender, config)
+
+    def run_branch(self, branch: WorkflowBranch, message: str) -> Dict[str, Any]:
+        """
+        Run the chat of a branch, failures are recorded in the branch result.
+        """
+        start_time = branch.start()
+        try:
+            branch.sender.initiate_chat(branch.receiver, message=message, clear_history=True)
+        except Exception as e:
+            return branch.finish(start_time, e)
+        return branch.finish(start_time)
+
+    async def arun_branch(self, branch: WorkflowBranch, message: str) -> Dict[str, Any]:
+        start_time = branch.start()
+        try:
+            await branch.sender.a_initiate_chat(branch.receiver, message=message, clear_history=True)
+        except Exception as e:
+            return branch.finish(start_time, e)
+        return branch.finish(start_time)
+
+    def run_branches(self, message: str) -> List[Dict[str, Any]]:
+        """
+        Run the branches on a thread pool until the join condition is met or the timeout expires.
+
+        Returns:
+            The results of the branches, with their status and run time.
+        """
+        with self.span("create_branches"):
+            branches = self.create_branches()
+        required = self.required_results(len(branches))
+        pool = ThreadPoolExecutor(max_workers=len(branches), thread_name_prefix="autogenstudio-branch")
+        futures = [pool.submit(self.run_branch, branch, message) for branch in branches]
+        completed = 0
+        try:
+            for future in as_completed(futures, timeout=self.parallel_config.timeout):
+                if future.result()["status"] == "completed":
+                    completed += 1
+                if completed >= required:
+                    break
+        except FuturesTimeoutError:
+            pass
+        finally:
+            self.join_branches(branches)
+            pool.shutdown(wait=False, cancel_futures=True)
+        return [branch.result for branch in branches]
+
+    async def arun_branches(self, message: str) -> List[Dict[str, Any]]:
+        """
+        Asynchronous variant of run_branches, the branches run as tasks on the event loop.
+        """
+        with self.span("create_branches"):
+            branches = self.create_branches()
+        required = self.required_results(len(branches))
+        pending = {asyncio.ensure_future(self.arun_branch(branch, message)) for branch in branches}
+        timeout = self.parallel_config.timeout
+        deadline = time.time() + timeout if timeout is not None else None
+        completed = 0
+        try:
+            while pending and completed < required:
+                remaining = max(0, deadline - time.time()) if deadline is not None else None
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                completed += sum(1 for task in done if task.result()["status"] == "completed")
+        finally:
+            self.join_branches(branches)
+            for task in pending:
+                task.cancel()
+        return [branch.result for branch in branches]
+
+    def combine(self, message: str, results: List[Dict[str, Any]]) -> str:
+        """
+        Build the message that asks the receiver to combine the branch results.
+        """
+        sections = []
+        for result in results:
+            content = result["content"] if result["status"] == "completed" else f"({result['status']})"
+            sections.append(f"### {result['name']}\n\n{content}")
+        return (
+            f"{message}\n\nThe task was given to {len(results)} agents in parallel. Their results:\n\n"
+            + "\n\n".join(sections)
+            + "\n\nCombine these results into a single answer to the task."
+        )
+
+    def record_results(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Record the branch results as the final message of the run, used if the workflow does not aggregate.
+        """
+        content = "\n\n".join(
+            f"### {result['name']}\n\n{result['content']}" for result in results if result["status"] == "completed"
+        )
+        message = {"content": content, "role": "assistant", "name": self.receiver.name}
+        return self.record_iteration(self.sender, [message], self.receiver)
+
+    def run(self, message: str, clear_history: bool = False) -> None:
+        """
+        Runs the branches concurrently, then lets the receiver combine their results.
+
+        Args:
+            message: The task sent to every branch.
+            clear_history: If set to True, clears the chat history of the sender and receiver before aggregating.
+        """
+        self.running_async = False
+        with self.span("branches"):
+            self.branch_results = self.run_branches(message)
+        if self.parallel_config.aggregate:
+            with self.span("aggregate"):
+                self.sender.initiate_chat(
+                    self.receiver, message=self.combine(message, self.branch_results), clear_history=clear_history
+                )
+        else:
+            iteration = self.record_results(self.branch_results)
+            if self.on_message is not None:
+                self.on_message(iteration)
+
+    async def arun(self, message: str, clear_history: bool = False) -> None:
+        """
+        Asynchronous variant of run.
+
+        Args:
+            message: The task sent to every branch.
+            clear_history: If set to True, clears the chat history of the sender and receiver before aggregating.
+        """
+        self.running_async = True
+        try:
+            with self.span("branches"):
+                self.branch_results = await self.arun_branches(message)
+            if self.parallel_config.aggregate:
+                with self.span("aggregate"):
+                    await self.sender.a_initiate_chat(
+                        self.receiver,
+                        message=self.combine(message, self.branch_results),
+                        clear_history=clear_history,
+                    )
+            else:
+                iteration = self.record_results(self.branch_results)
+                if self.on_message is not None:
+                    result = self.on_message(iteration)
+                    if inspect.isawaitable(result):
+                        await result
+        finally:
+            self.running_async = False
+
+
+def create_workflow_manager(config: AgentWorkFlowConfig, **kwargs: Any) -> AutoGenWorkFlowManager:
+    """
+    Create the workflow manager for a workflow type: ParallelWorkFlowManager for parallel workflows,
+    AutoGenWorkFlowManager otherwise.
+
+    Args:
+        config: The workflow configuration.
+        **kwargs: The arguments of AutoGenWorkFlowManager.
+
+    Returns:
+        The workflow manager.
+    """
+    if config.type == "parallel":
+        return ParallelWorkFlowManager(config, **kwargs)
+    return AutoGenWorkFlowManager(config=config, **kwargs)
+
+
+def is_termination_message(message: Dict[str, Any]) -> bool:
+    """
+    Default termination check of studio agents: the message ends with TERMINATE.
+    """
+    return "TERMINATE" in (message.get("content") or "").rstrip()[-20:]
+
+
+class CompiledAgent(NamedTuple):
+    """
+    An agent spec prepared for instantiation: sanitized LLM configs, the final system message and the skills
+    file. Templates are shared and must not be modified, instantiate() works on a copy of config.
+    """
+
+    type: str
+    # keyword arguments of the agent, without the per-run code execution work_dir
+    config: Dict[str, Any]
+    # content of skills.py, or None if the agent has no skills
+    skills_file: Optional[str] = None
+    # keyword arguments of autogen.GroupChat, without agents, for groupchat agents
+    groupchat_config: Optional[Dict[str, Any]] = None
+    agents: Tuple["CompiledAgent", ...] = ()
+
+
+class CompiledWorkflow(NamedTuple):
+    """
+    The compiled sender and receiver of a workflow, and the branches of a parallel workflow, see compile_workflow.
+    """
+
+    spec_hash: str
+    sender: CompiledAgent
+    receiver: CompiledAgent
+    branches: Tuple[CompiledAgent, ...] = ()
+
+
+def compile_agent(agent_spec: AgentFlowSpec) -> CompiledAgent:
+    """
+    Compiles an agent spec into a template: applies loading defaults, sanitizes the LLM configs and builds the
+    skills prompt. The spec itself is not modified.
+
+    Args:
+        agent_spec: The agent spec to compile.
+
+    Returns:
+        The compiled agent template.
+    """
+    config = agent_spec.config.dict()
+    config["is_termination_msg"] = config.get("is_termination_msg") or is_termination_message
+
+    # sanitize llm_config if present
+    llm_config = config.get("llm_config")
+    if llm_config is not False and llm_config is not None:
+        config_list = []
+        for llm in llm_config.get("config_list") or []:
+            # check if api_key is present either in llm or env variable
+            if "api_key" not in llm and "OPENAI_API_KEY" not in os.environ:
+                error_message = f"api_key is not present in llm_config or OPENAI_API_KEY env variable for agent ** {agent_spec.config.name}**. Update your workflow to provide an api_key to use the LLM."
+                raise ValueError(error_message)
+
+            # only add key if value is not None
+            config_list.append(sanitize_model(llm))
+        llm_config["config_list"] = config_list
+    if config.get("code_execution_config") is not False:
+        code_execution_config = config.get("code_execution_config") or {}
+        # tbd check if docker is installed
+        code_execution_config["use_docker"] = False
+        config["code_execution_config"] = code_execution_config
+
+    skills_file = None
+    if agent_spec.skills:
+        # the skills file is written to the work dir when the agent is instantiated
+        skills_file = get_skills_file_content(agent_spec.skills)
+        if agent_spec.type == "assistant":
+            default_system_message = autogen.AssistantAgent.DEFAULT_SYSTEM_MESSAGE
+        else:
+            default_system_message = "You are a helpful AI Assistant."
+        config["system_message"] = (
+            (config.get("system_message") or default_system_message) + "\n\n" + SKILLS_INSTRUCTION + skills_file
+        )
+
+    if agent_spec.type == "groupchat":
+        groupchat_config = agent_spec.groupchat_config.dict()
+        groupchat_config.pop("agents", None)
+        return CompiledAgent(
+            type=agent_spec.type,
+            config=config,
+            skills_file=skills_file,
+            groupchat_config=groupchat_config,
+            agents=tuple(compile_agent(child) for child in agent_spec.groupchat_config.agents),
+        )
+    return CompiledAgent(type=agent_spec.type, config=config, skills_file=skills_file)
+
+
+def spec_hash(config: AgentWorkFlowConfig) -> str:
+    """
+    Hash a workflow spec by content.
+    """
+    return md5_hash(json.dumps(config.dict(), sort_keys=True, default=str))
+
+
+def compile_workflow(config: AgentWorkFlowConfig, config_hash: Optional[str] = None) -> CompiledWorkflow:
+    """
+    Compiles the sender, receiver and parallel branches of a workflow, see compile_agent.
+
+    Args:
+        config: The workflow spec.
+        config_hash: The spec hash, if already computed.
+
+    Returns:
+        The compiled workflow.
+    """
+    return CompiledWorkflow(
+        spec_hash=config_hash or spec_hash(config),
+        sender=compile_agent(config.sender),
+        receiver=compile_agent(config.receiver),
+        branches=tuple(compile_agent(branch) for branch in config.parallel_config.branches)
+        if config.parallel_config
+        else (),
+    )
+
+
+class TemplateCache:
+    """
+    LRU cache of compiled workflows keyed by the content hash of their spec, so that agents of an unchanged
+    workflow are instantiated from prepared templates instead of sanitizing the spec on every load.
+    """
+
+    def __init__(self, max_size: int = 256) -> None:
+        """
+        Args:
+            max_size: The maximum number of compiled workflows to keep.
+        """
+        self.max_size = max_size
+        self._templates: "OrderedDict[str, CompiledWorkflow]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, config: AgentWorkFlowConfig) -> CompiledWorkflow:
+        """
+        Return the compiled workflow of a spec, compiling it on a miss.
+        """
+        config_hash = spec_hash(config)
+        with self._lock:
+            template = self._templates.get(config_hash)
+            if template is not None:
+                self._templates.move_to_end(config_hash)
+                self.hits += 1
+                return template
+            self.misses += 1
+        template = compile_workflow(config, config_hash)
+        with self._lock:
+            self._templates[config_hash] = template
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return template
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache size and hit/miss counters.
+        """
+        with self._lock:
+            return {"size": len(self._templates), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+def history_marker(history: Optional[List[Any]]) -> Tuple[int, Optional[str]]:
+    """
+    Identify a session history by its length and the msg_id of its last message.
+
+    Args:
+        history: A list of Message objects or message dicts.
+
+    Returns:
+        A (message count, last msg_id) tuple.
+    """
+    if not history:
+        return 0, None
+    last_message = history[-1]
+    msg_id = last_message.get("msg_id") if isinstance(last_message, dict) else last_message.msg_id
+    return len(history), msg_id
+
+
+class WorkflowCache:
+    """
+    LRU cache of live AutoGenWorkFlowManager instances keyed by session id and a hash of the flow config,
+    so agents (and their clients) are reused across the turns of a session instead of being rebuilt and
+    replayed on every message. Flows are checked out while a turn runs, so a flow is never used by two
+    runs at once, and expire after ttl seconds without use.
+    """
+
+    def __init__(self, max_size: int = 32, ttl: float = 1800) -> None:
+        """
+        Args:
+            max_size: The maximum number of live flows to keep.
+            ttl: The number of seconds an unused flow is kept.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._flows: "OrderedDict[Tuple[str, str], Tuple[float, AutoGenWorkFlowManager]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def config_hash(config: AgentWorkFlowConfig) -> str:
+        """
+        Hash a flow config, see spec_hash.
+        """
+        return spec_hash(config)
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [key for key, (last_used, _) in self._flows.items() if now - last_used > self.ttl]
+        for key in expired:
+            del self._flows[key]
+            self.evictions += 1
+
+    def checkout(
+        self, session_id: str, config_hash: str, history: Optional[List[Any]]
+    ) -> Optional[AutoGenWorkFlowManager]:
+        """
+        Remove and return the cached flow for a session, if there is one that holds exactly the given history.
+
+        Args:
+            session_id: The id of the chat session.
+            config_hash: The hash of the flow config, see config_hash.
+            history: The persisted session history the next turn runs on.
+
+        Returns:
+            The cached flow, or None on a miss.
+        """
+        with self._lock:
+            self._purge_expired(time.time())
+            entry = self._flows.pop((session_id, config_hash), None)
+            if entry is None or entry[1].history_marker != history_marker(history):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def checkin(self, session_id: str, config_hash: str, flow: AutoGenWorkFlowManager) -> None:
+        """
+        Return a flow to the cache after a turn, evicting the least recently used flows beyond max_size.
+        """
+        with self._lock:
+            now = time.time()
+            self._flows[(session_id, config_hash)] = (now, flow)
+            self._flows.move_to_end((session_id, config_hash))
+            self._purge_expired(now)
+            while len(self._flows) > self.max_size:
+                self._flows.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache size and hit/miss counters.
+        """
+        with self._lock:
+            return {
+                "size": len(self._flows),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -180,6 +180,7 @@ export const CollapseBox = ({
   children,
   className = " p-3",
   open = false,
+  onClick,
 }: IProps) => {
   const [isOpen, setIsOpen] = React.useState<boolean>(open);
   const chevronClass = "h-4 cursor-pointer inline-block mr-1";
@@ -195,6 +196,9 @@ export const CollapseBox = ({
       <div
         onClick={() => {
           setIsOpen(!isOpen);
+          if (onClick) {
+            onClick();
+          }
         }}
         className={`cursor-pointer bg-secondary p-2 rounded ${
           isOpen ? "rounded-b-none " : " "
@@ -1702,6 +1706,7 @@ const GroupChatFlowSpecView = ({
                 { label: "Auto", value: "auto" },
                 { label: "Round Robin", value: "round_robin" },
                 { label: "Random", value: "random" },
+                { label: "Keyword", value: "keyword" },
               ] as any
             }
           />
@@ -58,8 +58,11 @@ export interface IGroupChatConfig {
   admin_name: string;
   messages: Array<any>;
   max_round: number;
-  speaker_selection_method: "auto" | "round_robin" | "random";
+  speaker_selection_method: "auto" | "round_robin" | "random" | "keyword";
   allow_repeat_speaker: boolean | Array<IAgentConfig>;
+  speaker_transitions?: { [agent: string]: Array<string> } | null;
+  speaker_keywords?: { [agent: string]: Array<string> } | null;
+  cache_speaker_selection?: boolean;
 }
 
 export interface IGroupChatFlowSpec {
@@ -77,11 +80,20 @@ export interface IFlowConfig {
   description: string;
   sender: IAgentFlowSpec;
   receiver: IAgentFlowSpec | IGroupChatFlowSpec;
-  type: "twoagents" | "groupchat";
+  type: "twoagents" | "groupchat" | "parallel";
   timestamp?: string;
   summary_method?: "none" | "last" | "llm";
   id?: string;
   user_id?: string;
+  parallel_config?: IParallelConfig | null;
+}
+
+export interface IParallelConfig {
+  branches: Array<IAgentFlowSpec | IGroupChatFlowSpec>;
+  join: "all" | "first" | "quorum";
+  quorum?: number | null;
+  timeout?: number | null;
+  aggregate?: boolean;
 }
 
 export interface IModelConfig {
@@ -112,10 +124,12 @@ export interface IChatSession {
 
 export interface IGalleryItem {
   id: string;
-  messages: Array<IMessage>;
-  session: IChatSession;
+  messages?: Array<IMessage>;
+  session?: IChatSession;
   tags: Array<string>;
   timestamp: string;
+  title?: string;
+  message_count?: number;
 }
 
 export interface ISkill {
@@ -85,11 +85,11 @@ const GalleryView = ({ location }: any) => {
     return (
       <div>
         <div className="mb-4 text-sm">
-          This session contains {item.messages.length} messages and was created{" "}
-          {timeAgo(item.timestamp)}
+          This session contains {item.messages?.length || 0} messages and was
+          created {timeAgo(item.timestamp)}
         </div>
         <div className="">
-          <ChatBox initMessages={item.messages} editable={false} />
+          <ChatBox initMessages={item.messages || []} editable={false} />
         </div>
       </div>
     );
@@ -115,20 +115,19 @@ const GalleryView = ({ location }: any) => {
         <Card
           active={isSelected}
           onClick={() => {
-            setCurrentGallery(item);
+            // the listing only has the item summary, load the transcript
+            fetchGallery(item.id);
             // add to history
             navigate(`/gallery?id=${item.id}`);
           }}
           className="h-full p-2 cursor-pointer"
-          title={truncateText(item.messages[0]?.content || "", 20)}
+          title={truncateText(item.title || "", 20)}
         >
-          <div className="my-2">
-            {" "}
-            {truncateText(item.messages[0]?.content || "", 80)}
-          </div>
+          <div className="my-2"> {truncateText(item.title || "", 80)}</div>
           <div className="text-xs">
             {" "}
-            {item.messages.length} message{item.messages.length > 1 && "s"}
+            {item.message_count || 0} message
+            {(item.message_count || 0) > 1 && "s"}
           </div>
           <div className="my-2 border-t border-dashed w-full pt-2 inline-flex gap-2 ">
             <TagsView tags={item.tags} />{" "}
@@ -5,6 +5,7 @@ import {
 } from "@heroicons/react/24/outline";
 import * as React from "react";
 import {
+  BounceLoader,
   CodeBlock,
   CodeLoader,
   CsvLoader,
@@ -15,12 +16,38 @@ import {
   MarkdownView,
   PdfViewer,
 } from "../../atoms";
-import { formatDuration, getServerUrl } from "../../utils";
+import { fetchJSON, formatDuration, getServerUrl } from "../../utils";
 import { IMetadataFile } from "../../types";
 import Icon from "../../icons";
+import { appContext } from "../../../hooks/provider";
 
 const MetaDataView = ({ metadata }: { metadata: any | null }) => {
   const serverUrl = getServerUrl();
+  const { user } = React.useContext(appContext);
+  // agent turns are inlined for new responses and loaded on demand for saved ones
+  const [agentTurns, setAgentTurns] = React.useState<any[] | null>(
+    metadata.messages || null
+  );
+  const [turnsLoading, setTurnsLoading] = React.useState(false);
+
+  const fetchAgentTurns = () => {
+    if (agentTurns !== null || turnsLoading || !metadata.turn_msg_id) {
+      return;
+    }
+    setTurnsLoading(true);
+    const turnsUrl = `${serverUrl}/messages/${
+      metadata.turn_msg_id
+    }/turns?user_id=${encodeURIComponent(user?.email || "")}`;
+    const onSuccess = (data: any) => {
+      setAgentTurns(data && data.status ? data.data : []);
+      setTurnsLoading(false);
+    };
+    const onError = (err: any) => {
+      console.log("error loading agent turns", err);
+      setTurnsLoading(false);
+    };
+    fetchJSON(turnsUrl, { method: "GET" }, onSuccess, onError);
+  };
   const renderFileContent = (file: IMetadataFile, i: number) => {
     const file_type = file.extension;
     const is_image = ["image"].includes(file.type);
@@ -195,7 +222,7 @@ const MetaDataView = ({ metadata }: { metadata: any | null }) => {
 
   const files = (metadata.files || []).map(renderFile);
 
-  const messages = (metadata.messages || []).map((message: any, i: number) => {
+  const messages = (agentTurns || []).map((message: any, i: number) => {
     return (
       <div className=" mb-2 border-dashed" key={"messagerow" + i}>
         <GroupView
@@ -214,7 +241,8 @@ const MetaDataView = ({ metadata }: { metadata: any | null }) => {
   });
 
   const hasContent = files.length > 0;
-  const hasMessages = messages.length > 0;
+  const messageCount = agentTurns ? agentTurns.length : metadata.turn_count || 0;
+  const hasMessages = messageCount > 0;
 
   return (
     <div>
@@ -222,11 +250,16 @@ const MetaDataView = ({ metadata }: { metadata: any | null }) => {
         <div className="rounded   bg-primary  ">
           <CollapseBox
             open={false}
-            title={`Agent Messages (${messages.length} message${
-              messages.length > 1 ? "s" : ""
+            onClick={fetchAgentTurns}
+            title={`Agent Messages (${messageCount} message${
+              messageCount > 1 ? "s" : ""
             }) | ${formatDuration(metadata?.time)}`}
           >
-            {messages}
+            {turnsLoading ? (
+              <BounceLoader title=" loading agent messages" />
+            ) : (
+              messages
+            )}
           </CollapseBox>
         </div>
       )}
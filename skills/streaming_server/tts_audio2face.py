@@ -14,8 +14,11 @@ But in a real application such stream of chunks may be aquired from some other s
 gRPC protocol details could be find in audio2face.proto
 """
 
+import json
+import os
 import sys
 import time
+import urllib.request
 
 import audio2face_pb2
 import audio2face_pb2_grpc
@@ -24,6 +27,26 @@ import numpy as np
 import soundfile
 
 
+def report_push_duration(mode, seconds, success):
+    """
+    Report the duration of an audio push to the AutoGen Studio server, whose address and token are passed to
+    skills in AUTOGENSTUDIO_METRICS_URL and AUTOGENSTUDIO_METRICS_TOKEN. Reporting is best effort and never fails
+    the push.
+    """
+    metrics_url = os.environ.get("AUTOGENSTUDIO_METRICS_URL")
+    if not metrics_url:
+        return
+    data = json.dumps({"mode": mode, "seconds": seconds, "success": success}).encode()
+    headers = {"Content-Type": "application/json"}
+    if os.environ.get("AUTOGENSTUDIO_METRICS_TOKEN"):
+        headers["X-Metrics-Token"] = os.environ["AUTOGENSTUDIO_METRICS_TOKEN"]
+    request = urllib.request.Request(metrics_url + "/audio_push", data=data, headers=headers)
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Could not report audio push duration: {e}")
+
+
 def push_audio_track(url, audio_data, samplerate, instance_name):
     """
     This function pushes the whole audio track at once via PushAudioRequest()
@@ -44,7 +67,13 @@ def push_audio_track(url, audio_data, samplerate, instance_name):
         request.instance_name = instance_name
         request.block_until_playback_is_finished = block_until_playback_is_finished
         print("Sending audio data...")
-        response = stub.PushAudio(request)
+        start_time = time.time()
+        success = False
+        try:
+            response = stub.PushAudio(request)
+            success = response.success
+        finally:
+            report_push_duration("track", time.time() - start_time, success)
         if response.success:
             print("SUCCESS")
         else:
@@ -90,7 +119,13 @@ def push_audio_track_stream(url, audio_data, samplerate, instance_name):
 
         request_generator = make_generator()
         print("Sending audio data...")
-        response = stub.PushAudioStream(request_generator)
+        start_time = time.time()
+        success = False
+        try:
+            response = stub.PushAudioStream(request_generator)
+            success = response.success
+        finally:
+            report_push_duration("stream", time.time() - start_time, success)
         if response.success:
             print("SUCCESS")
         else: